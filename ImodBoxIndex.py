@@ -0,0 +1,152 @@
+import numpy as np
+from .features import get_object_points
+
+class ImodBoxIndex(object):
+    """
+    Spatial index of the axis-aligned bounding boxes of the objects and
+    contours of a model, used to find the objects or contours that intersect
+    a region, or lie near a point, without scanning their points.
+
+    Boxes are stored in model (pixel) coordinates as rows of (xmin, ymin, zmin,
+    xmax, ymax, zmax), and are sorted by xmin, such that a query only tests
+    the boxes that start before its own box ends. Empty objects and contours
+    have inverted, infinite boxes, which never match a query.
+
+    The index is kept by ImodModel.get_box_index, and is updated
+    incrementally: on each call, only the boxes of objects whose contours
+    have been reassigned, added, or removed, or have had their points
+    reassigned (see ImodObject.z_index_key) are recomputed from their points.
+    Contours whose points are edited in place require invalidate_z_index() to
+    be called on their object.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.objects = []
+        self.boxes = empty_boxes(0)
+        self.contBoxes = empty_boxes(0)
+        self.objIds = np.zeros(0, dtype = int)
+        self.contIds = np.zeros(0, dtype = int)
+        self.order = np.zeros(0, dtype = int)
+        self.contOrder = np.zeros(0, dtype = int)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __repr__(self):
+        return '<ImodBoxIndex of {0} objects, {1} contours>'.format(
+            len(self.boxes), len(self.contBoxes))
+
+    def update(self, objects):
+        """
+        Brings the index up to date with the given sequence of objects.
+        Returns the number of objects whose boxes were recomputed.
+        """
+        # Objects are matched by identity, and are referenced by the index,
+        # such that their ids cannot be reused while it exists
+        entries = {}
+        keys = []
+        nUpdated = 0
+        for obj in objects:
+            key = obj.z_index_key()
+            entry = self.entries.get(id(obj))
+            if entry is None or entry[0] is not obj or entry[1] != key:
+                entry = (obj, key, contour_boxes(obj))
+                nUpdated += 1
+            entries[id(obj)] = entry
+            keys.append(obj)
+        if not nUpdated and len(keys) == len(self.objects) and all(
+            a is b for a, b in zip(keys, self.objects)):
+            return 0
+        self.entries = entries
+        self.objects = keys
+
+        contBoxes = [entries[id(x)][2] for x in keys]
+        n = np.asarray([len(x) for x in contBoxes], dtype = int)
+        self.contBoxes = np.concatenate(contBoxes) if keys else \
+            empty_boxes(0)
+        self.objIds = np.repeat(np.arange(len(keys)), n)
+        self.contIds = np.arange(len(self.objIds)) - np.repeat(
+            np.cumsum(n) - n, n)
+        self.boxes = empty_boxes(len(keys))
+        full = n > 0
+        if full.any():
+            starts = (np.cumsum(n) - n)[full]
+            self.boxes[full, :3] = np.minimum.reduceat(self.contBoxes[:, :3],
+                starts)
+            self.boxes[full, 3:] = np.maximum.reduceat(self.contBoxes[:, 3:],
+                starts)
+        self.order = np.argsort(self.boxes[:, 0], kind = 'mergesort')
+        self.contOrder = np.argsort(self.contBoxes[:, 0], kind = 'mergesort')
+        return nUpdated
+
+    def query_box(self, lo, hi, level = 'object'):
+        """
+        Returns the indices of the objects (or, if level is 'contour', of the
+        contours, see objIds and contIds) whose boxes intersect the box from
+        lo = (xmin, ymin, zmin) to hi = (xmax, ymax, zmax), in ascending
+        order.
+        """
+        boxes, order = self.get_level(level)
+        lo = np.asarray(lo, dtype = float)
+        hi = np.asarray(hi, dtype = float)
+        # Only boxes starting before the query box ends can intersect it
+        n = np.searchsorted(boxes[order, 0], hi[0], side = 'right')
+        cand = order[:n]
+        hit = ((boxes[cand, :3] <= hi).all(1) &
+               (boxes[cand, 3:] >= lo).all(1))
+        return np.sort(cand[hit])
+
+    def box_distances(self, lo, hi, scale = (1, 1, 1), level = 'object'):
+        """
+        Returns the distance of each object's (or contour's) box to the box
+        from lo to hi, which is 0 for intersecting boxes, and inf for empty
+        objects. Coordinates are multiplied by scale, e.g. the pixel sizes,
+        before computing distances. A point is given as lo = hi.
+        """
+        boxes, order = self.get_level(level)
+        return box_distance(boxes, np.asarray(lo, dtype = float),
+            np.asarray(hi, dtype = float), scale)
+
+    def get_level(self, level):
+        if level == 'object':
+            return self.boxes, self.order
+        elif level == 'contour':
+            return self.contBoxes, self.contOrder
+        raise ValueError('Level must be object or contour, not {0}.'.format(
+            level))
+
+def empty_boxes(n):
+    """
+    Returns n empty boxes, with minima of inf and maxima of -inf.
+    """
+    boxes = np.empty([n, 6])
+    boxes[:, :3] = float('Inf')
+    boxes[:, 3:] = -float('Inf')
+    return boxes
+
+def contour_boxes(obj):
+    """
+    Returns the (ncont x 6) array of the bounding boxes of the contours of an
+    object, computed with a single reduction over its points.
+    """
+    pts, nPoints = get_object_points(obj)
+    boxes = empty_boxes(len(nPoints))
+    full = nPoints > 0
+    if full.any():
+        starts = (np.cumsum(nPoints) - nPoints)[full]
+        boxes[full, :3] = np.minimum.reduceat(pts, starts)
+        boxes[full, 3:] = np.maximum.reduceat(pts, starts)
+    return boxes
+
+def box_distance(boxes, lo, hi, scale = (1, 1, 1)):
+    """
+    Returns the Euclidean distance between each row of an (N x 6) array of
+    boxes and the box from lo to hi, after scaling all coordinates by scale.
+    Empty boxes are at a distance of inf.
+    """
+    gap = np.maximum(np.maximum(boxes[:, :3] - hi, lo - boxes[:, 3:]), 0)
+    with np.errstate(invalid = 'ignore'):
+        d = np.sqrt(((gap * scale) ** 2).sum(1))
+    d[np.isnan(d) | (boxes[:, 0] > boxes[:, 3])] = float('Inf')
+    return d
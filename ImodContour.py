@@ -1,4 +1,6 @@
 import struct
+from .utils import read_array
+from .binspec import CONTOUR_HEADER, CONTOUR_HEADER_FIELDS, unpack_fields
 
 class ImodContour(object):
 
@@ -11,21 +13,24 @@ class ImodContour(object):
         points = [],
         pointSizes = [],
         size_set = 0,
+        mmap = False,
         **kwargs):
             self.__dict__.update(kwargs)
             self.__dict__.update(locals())
+            # Drop the references to the instance itself and to the keyword
+            # arguments picked up from locals(), and to the file once read
+            del self.self, self.kwargs
             self.size_vals = []
             if self.fid:
                 self.read_file()    
+                self.fid = None
 
     def read_file(self):
         fid = self.fid
-        self.nPoints = struct.unpack('>l', fid.read(4))[0]
-        self.flags = struct.unpack('>l', fid.read(4))[0]
-        self.type = struct.unpack('>l', fid.read(4))[0]
-        self.iSurface = struct.unpack('>l', fid.read(4))[0]
-        self.points = struct.unpack('>{0}f'.format(3 * self.nPoints),
-            fid.read(12 * self.nPoints))
+        header, _ = unpack_fields(CONTOUR_HEADER, CONTOUR_HEADER_FIELDS,
+            fid.read(CONTOUR_HEADER.size))
+        self.__dict__.update(header)
+        self.points = read_array(fid, 'f', 3 * self.nPoints, self.mmap)
 
         # Read the next data chunk. If it is SIZE, then set size_set to one and
         # read the values from the binary file. If not, seek back and continue.
@@ -33,8 +38,11 @@ class ImodContour(object):
         if datatype == 'SIZE':
             self.size_set = 1
             psize = struct.unpack('>l', fid.read(4))[0]
-            for i in range(0, psize, 4):
-                self.size_vals.append(struct.unpack('>f', fid.read(4))[0])
+            if self.mmap:
+                self.size_vals = read_array(fid, 'f', psize // 4, self.mmap)
+            else:
+                for i in range(0, psize, 4):
+                    self.size_vals.append(struct.unpack('>f', fid.read(4))[0])
         else:
             fid.seek(-4, 1)
         return self
@@ -0,0 +1,361 @@
+import struct
+import numpy as np
+from .ImodContour import ImodContour
+from .utils import read_array
+from .binspec import CONTOUR_HEADER
+
+class ImodContourArray(object):
+    """
+    Compact, columnar storage of the contours of an ImodObject. The points of
+    all contours are held in a single contiguous (N x 3) float32 array, and
+    contour i spans rows offsets[i] to offsets[i+1] of it (a compressed sparse
+    row layout). The contour flags, types, and surface numbers are held in one
+    array each, and SIZE values, if any contour has them, in an (N,) float32
+    array alongside the points. Compared to a list of ImodContour instances,
+    this costs a few bytes per contour rather than a few hundred.
+
+    The array behaves as a list of contours: indexing it returns a lightweight
+    ImodContourView, which exposes the nPoints, flags, type, iSurface, points,
+    size_set, and size_vals attributes of an ImodContour, backed by the
+    arrays. Contours can be deleted, appended, and have their points
+    reassigned, each of which rebuilds the arrays. Views are positional, so
+    they refer to a different contour once contours before them have been
+    deleted. To remove many contours at once, use compress().
+    """
+
+    def __init__(self,
+        points = None,
+        offsets = None,
+        flags = None,
+        types = None,
+        iSurfaces = None,
+        sizes = None,
+        sizeSet = None):
+            self.points = (np.zeros([0, 3], dtype = np.float32)
+                if points is None else points)
+            self.offsets = (np.zeros(1, dtype = np.int64)
+                if offsets is None else offsets)
+            n = len(self.offsets) - 1
+            self.flags = (np.zeros(n, dtype = np.uint32) if flags is None
+                else flags)
+            self.types = (np.zeros(n, dtype = np.int32) if types is None
+                else types)
+            self.iSurfaces = (np.zeros(n, dtype = np.int32)
+                if iSurfaces is None else iSurfaces)
+            self.sizes = sizes
+            self.sizeSet = (np.zeros(n, dtype = bool) if sizeSet is None
+                else sizeSet)
+            # Incremented whenever contours are added, removed, or have their
+            # points reassigned, so that indices over them can be invalidated
+            self.version = 0
+
+    @classmethod
+    def from_chunks(cls, headers, points, sizes):
+        """
+        Builds the arrays from per-contour data, as read from CONT chunks.
+
+        Inputs
+        ======
+        headers - List of (nPoints, flags, type, iSurface) tuples.
+        points  - List of flat sequences of 3 * nPoints coordinates.
+        sizes   - List of sequences of nPoints SIZE values, or None for
+                  contours without a SIZE chunk.
+        """
+        n = len(headers)
+        header = np.asarray(headers, dtype = np.int64).reshape(n, 4)
+        offsets = np.zeros(n + 1, dtype = np.int64)
+        np.cumsum(header[:, 0], out = offsets[1:])
+        if n:
+            pts = np.concatenate([np.asarray(x) for x in points]).astype(
+                np.float32).reshape(-1, 3)
+        else:
+            pts = np.zeros([0, 3], dtype = np.float32)
+        sizeSet = np.asarray([x is not None for x in sizes], dtype = bool)
+        vals = None
+        if sizeSet.any():
+            vals = np.zeros(len(pts), dtype = np.float32)
+            for i in np.flatnonzero(sizeSet):
+                vals[offsets[i]:offsets[i+1]] = fit_sizes(sizes[i],
+                    header[i, 0])
+        return cls(points = pts,
+                   offsets = offsets,
+                   flags = header[:, 1].astype(np.uint32),
+                   types = header[:, 2].astype(np.int32),
+                   iSurfaces = header[:, 3].astype(np.int32),
+                   sizes = vals,
+                   sizeSet = sizeSet)
+
+    @classmethod
+    def from_contours(cls, contours):
+        """
+        Builds the arrays from a sequence of ImodContour instances (or any
+        objects with the same attributes).
+        """
+        if isinstance(contours, ImodContourArray):
+            return contours.copy()
+        headers = [(x.nPoints, x.flags, x.type, x.iSurface) for x in contours]
+        return cls.from_chunks(headers, [x.points for x in contours],
+            [x.size_vals if x.size_set else None for x in contours])
+
+    def to_contours(self):
+        """
+        Returns the contours as a list of ImodContour instances.
+        """
+        return [x.to_contour() for x in self]
+
+    def copy(self):
+        return ImodContourArray(points = self.points.copy(),
+            offsets = self.offsets.copy(),
+            flags = self.flags.copy(),
+            types = self.types.copy(),
+            iSurfaces = self.iSurfaces.copy(),
+            sizes = None if self.sizes is None else self.sizes.copy(),
+            sizeSet = self.sizeSet.copy())
+
+    @property
+    def nPoints(self):
+        """
+        Array of the number of points of each contour.
+        """
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not (0 <= i < n):
+            raise IndexError('Contour index out of range.')
+        return ImodContourView(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield ImodContourView(self, i)
+
+    def __delitem__(self, i):
+        keep = np.ones(len(self), dtype = bool)
+        keep[i] = False
+        self.compress(keep)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return '<ImodContourArray of {0} contours, {1} points>'.format(
+            len(self), len(self.points))
+
+    def append(self, contour):
+        self.extend([contour])
+
+    def extend(self, contours):
+        other = contours
+        if not isinstance(other, ImodContourArray):
+            other = ImodContourArray.from_contours(contours)
+        sizes = None
+        if self.sizes is not None or other.sizes is not None:
+            sizes = np.concatenate([x.sizes if x.sizes is not None else
+                np.zeros(len(x.points), dtype = np.float32)
+                for x in [self, other]])
+        self.offsets = np.append(self.offsets, other.offsets[1:] +
+            self.offsets[-1])
+        self.points = np.concatenate([self.points, other.points])
+        self.flags = np.append(self.flags, other.flags)
+        self.types = np.append(self.types, other.types)
+        self.iSurfaces = np.append(self.iSurfaces, other.iSurfaces)
+        self.sizeSet = np.append(self.sizeSet, other.sizeSet)
+        self.sizes = sizes
+        self.version += 1
+
+    def compress(self, keep):
+        """
+        Keeps only the contours for which the boolean array keep is True,
+        rebuilding the arrays in a single pass.
+        """
+        keep = np.asarray(keep, dtype = bool)
+        nPoints = self.nPoints
+        rows = np.repeat(keep, nPoints)
+        self.points = self.points[rows]
+        if self.sizes is not None:
+            self.sizes = self.sizes[rows]
+        self.offsets = np.zeros(keep.sum() + 1, dtype = np.int64)
+        np.cumsum(nPoints[keep], out = self.offsets[1:])
+        self.flags = self.flags[keep]
+        self.types = self.types[keep]
+        self.iSurfaces = self.iSurfaces[keep]
+        self.sizeSet = self.sizeSet[keep]
+        self.version += 1
+        return self
+
+    def take(self, indices):
+        """
+        Reorders (or selects) the contours by the given array of contour
+        indices, rebuilding the arrays in a single pass.
+        """
+        indices = np.asarray(indices, dtype = int)
+        starts = self.offsets[:-1][indices]
+        nPoints = self.nPoints[indices]
+        rows = (np.repeat(starts - np.cumsum(nPoints) + nPoints, nPoints) +
+            np.arange(nPoints.sum()))
+        self.points = self.points[rows]
+        if self.sizes is not None:
+            self.sizes = self.sizes[rows]
+        self.offsets = np.zeros(len(indices) + 1, dtype = np.int64)
+        np.cumsum(nPoints, out = self.offsets[1:])
+        self.flags = self.flags[indices]
+        self.types = self.types[indices]
+        self.iSurfaces = self.iSurfaces[indices]
+        self.sizeSet = self.sizeSet[indices]
+        self.version += 1
+        return self
+
+    def set_points(self, i, points, sizes = None):
+        """
+        Replaces the points of contour i by the flat sequence points, and its
+        SIZE values by sizes, if given.
+        """
+        pts = np.asarray(points, dtype = np.float32).reshape(-1, 3)
+        start, end = self.offsets[i], self.offsets[i+1]
+        self.version += 1
+        if len(pts) == end - start:
+            self.points[start:end] = pts
+        else:
+            self.points = np.concatenate([self.points[:start], pts,
+                self.points[end:]])
+            if self.sizes is not None:
+                self.sizes = np.concatenate([self.sizes[:start],
+                    np.zeros(len(pts), dtype = np.float32),
+                    self.sizes[end:]])
+            self.offsets[i+1:] += len(pts) - (end - start)
+        if sizes is not None:
+            self.set_sizes(i, sizes)
+
+    def set_sizes(self, i, sizes):
+        """
+        Sets the SIZE values of contour i, or removes them if sizes is None.
+        """
+        if sizes is None:
+            self.sizeSet[i] = False
+            return
+        if self.sizes is None:
+            self.sizes = np.zeros(len(self.points), dtype = np.float32)
+        start, end = self.offsets[i], self.offsets[i+1]
+        self.sizes[start:end] = fit_sizes(sizes, end - start)
+        self.sizeSet[i] = True
+
+class ImodContourView(object):
+    """
+    Lightweight view of contour i of an ImodContourArray, with the attributes
+    of an ImodContour.
+    """
+    __slots__ = ('array', 'i')
+
+    def __init__(self, array, i):
+        self.array = array
+        self.i = i
+
+    @property
+    def nPoints(self):
+        return int(self.array.offsets[self.i+1] - self.array.offsets[self.i])
+
+    @nPoints.setter
+    def nPoints(self, value):
+        if value != self.nPoints:
+            raise ValueError('The number of points of a compact contour is '
+                'set by assigning its points.')
+
+    @property
+    def flags(self):
+        return int(self.array.flags[self.i])
+
+    @flags.setter
+    def flags(self, value):
+        self.array.flags[self.i] = value
+
+    @property
+    def type(self):
+        return int(self.array.types[self.i])
+
+    @type.setter
+    def type(self, value):
+        self.array.types[self.i] = value
+
+    @property
+    def iSurface(self):
+        return int(self.array.iSurfaces[self.i])
+
+    @iSurface.setter
+    def iSurface(self, value):
+        self.array.iSurfaces[self.i] = value
+
+    @property
+    def points(self):
+        """
+        Flat (3 * nPoints) view of the contour's rows of the point array.
+        """
+        a = self.array
+        return a.points[a.offsets[self.i]:a.offsets[self.i+1]].reshape(-1)
+
+    @points.setter
+    def points(self, values):
+        self.array.set_points(self.i, values)
+
+    @property
+    def size_set(self):
+        return int(self.array.sizeSet[self.i])
+
+    @property
+    def size_vals(self):
+        a = self.array
+        if not a.sizeSet[self.i]:
+            return []
+        return a.sizes[a.offsets[self.i]:a.offsets[self.i+1]]
+
+    @size_vals.setter
+    def size_vals(self, values):
+        self.array.set_sizes(self.i, values)
+
+    def to_contour(self):
+        """
+        Returns a copy of the contour as an ImodContour instance.
+        """
+        contour = ImodContour(nPoints = self.nPoints, flags = self.flags,
+            type = self.type, iSurface = self.iSurface,
+            points = self.points.tolist(), size_set = self.size_set)
+        if self.size_set:
+            contour.size_vals = self.size_vals.tolist()
+        return contour
+
+def fit_sizes(sizes, n):
+    """
+    Returns n SIZE values from sizes, padded with zeros or truncated as needed.
+    """
+    vals = np.zeros(n, dtype = np.float32)
+    if sizes is not None:
+        sizes = np.asarray(sizes, dtype = np.float32)[:n]
+        vals[:len(sizes)] = sizes
+    return vals
+
+def read_contour_chunk(fid, mmap = False):
+    """
+    Reads a CONT chunk, and its SIZE chunk if present, given a file positioned
+    just after the 'CONT' tag. Returns the (nPoints, flags, type, iSurface)
+    header, the flat array of points, and the array of SIZE values, or None.
+    """
+    header = CONTOUR_HEADER.unpack(fid.read(CONTOUR_HEADER.size))
+    points = read_array(fid, 'f', 3 * header[0], True) if mmap else \
+        np.frombuffer(fid.read(12 * header[0]), dtype = '>f4')
+    sizes = None
+    if fid.read(4) == 'SIZE':
+        nbytes = struct.unpack('>l', fid.read(4))[0]
+        sizes = read_array(fid, 'f', nbytes // 4, True) if mmap else \
+            np.frombuffer(fid.read(nbytes), dtype = '>f4')
+    else:
+        fid.seek(-4, 1)
+    return header, points, sizes
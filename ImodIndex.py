@@ -0,0 +1,265 @@
+import os
+import mmap
+import struct
+import zipfile
+
+import numpy as np
+from .binspec import (MODEL_HEADER, MODEL_HEADER_FIELDS, OBJECT_HEADER,
+    OBJECT_HEADER_FIELDS, VIEW_HEADER, OBJECT_VIEW, unpack_fields, cstr)
+
+class ImodIndex(object):
+    """
+    Offset table of the chunks in an IMOD model file. The table is built by a
+    single scanning pass that only reads chunk tags and lengths (OBJT, CONT,
+    MESH, SIZE, IMAT, MEPA, CLIP, VIEW, MINX, ...), seeking past all point,
+    vertex, and index payloads. It stores, for each object, the byte offset of
+    its OBJT chunk, the number of bytes spanned by the object, its name and
+    color, and its number of contours, points, and meshes, as well as the
+    offsets of the model-level VIEW and MINX chunks and the number of objects
+    that have VIEW data. With it, any object can
+    be parsed directly by seeking to its offset, without parsing the objects
+    that precede it.
+
+    If sidecar is True, the index is saved to and loaded from a sidecar file
+    (filename + '.pyimodidx') next to the model file. The sidecar is keyed by
+    the size and modification time of the model file, and is rebuilt whenever
+    either of these has changed.
+    """
+
+    # Byte sizes of the fixed-size model header and OBJT chunk, including the
+    # leading 'IMOD'/'OBJT' tag.
+    headerBytes = 8 + MODEL_HEADER.size
+    objtBytes = 4 + OBJECT_HEADER.size
+
+    def __init__(self,
+        filename = None,
+        sidecar = False,
+        **kwargs):
+            self.__dict__.update(kwargs)
+            self.filename = filename
+            self.sidecar = sidecar
+            self.nObjects = 0
+            self.objOffsets = np.zeros(0, dtype = np.int64)
+            self.objBytes = np.zeros(0, dtype = np.int64)
+            self.nContours = np.zeros(0, dtype = np.int64)
+            self.nMeshes = np.zeros(0, dtype = np.int64)
+            self.nPoints = np.zeros(0, dtype = np.int64)
+            self.names = []
+            self.colors = np.zeros([0, 3], dtype = np.float32)
+            self.tailOffset = -1
+            self.viewOffset = -1
+            self.viewObjects = 0
+            self.minxOffset = -1
+            if self.filename:
+                if not (self.sidecar and self.load()):
+                    self.build()
+                    if self.sidecar:
+                        # The sidecar is only a cache, e.g. the model may be
+                        # in a read-only directory
+                        try:
+                            self.save()
+                        except (IOError, OSError):
+                            pass
+
+    def sidecar_name(self):
+        return self.filename + '.pyimodidx'
+
+    def file_key(self):
+        """
+        Returns the (size, mtime) pair that the index of the model file is
+        keyed by.
+        """
+        st = os.stat(self.filename)
+        return st.st_size, st.st_mtime
+
+    def is_current(self):
+        """
+        Returns True if the model file has not changed since it was indexed.
+        """
+        return self.file_key() == (self.fileSize, self.mtime)
+
+    def build(self):
+        """
+        Scans the model file and builds the offset table.
+        """
+        self.fileSize, self.mtime = self.file_key()
+        with open(self.filename, mode = "rb") as fid:
+            mm = mmap.mmap(fid.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            self.scan(mm)
+        finally:
+            mm.close()
+        return self
+
+    def scan(self, mm):
+        if mm[0:4] != 'IMOD':
+            raise ValueError('{0} is not an IMOD model file.'.format(
+                self.filename))
+        header, _ = unpack_fields(MODEL_HEADER, MODEL_HEADER_FIELDS, mm, 8)
+        self.nObjects = header['nObjects']
+        objOffsets = []
+        nContours = []
+        nMeshes = []
+        nPoints = []
+        names = []
+        colors = []
+        pos = self.headerBytes
+        size = len(mm)
+        while pos + 4 <= size:
+            datatype = mm[pos:pos+4]
+            if datatype == 'OBJT':
+                objOffsets.append(pos)
+                nContours.append(0)
+                nMeshes.append(0)
+                nPoints.append(0)
+                header, _ = unpack_fields(OBJECT_HEADER, OBJECT_HEADER_FIELDS,
+                    mm, pos + 4)
+                names.append(cstr(header['name'][:64]))
+                colors.append([header['red'], header['green'],
+                    header['blue']])
+                pos += self.objtBytes
+            elif datatype == 'CONT':
+                n = struct.unpack_from('>l', mm, pos + 4)[0]
+                nContours[-1] += 1
+                nPoints[-1] += n
+                pos += 20 + 12 * n
+            elif datatype == 'MESH':
+                nVertices, nIndices = struct.unpack_from('>2l', mm, pos + 4)
+                nMeshes[-1] += 1
+                pos += 20 + 12 * nVertices + 4 * nIndices
+            elif datatype == 'IEOF':
+                break
+            else:
+                # All other chunks consist of the tag, the number of bytes to
+                # follow, and the data.
+                nbytes = struct.unpack_from('>l', mm, pos + 4)[0]
+                if datatype in ('VIEW', 'MINX') and self.tailOffset < 0:
+                    self.tailOffset = pos
+                if datatype == 'VIEW' and nbytes != 4 and self.viewOffset < 0:
+                    self.viewOffset = pos
+                    # The objvsize field ends the model-level VIEW data
+                    self.viewObjects = struct.unpack_from('>i', mm,
+                        pos + 4 + VIEW_HEADER.size)[0] // OBJECT_VIEW.size
+                elif datatype == 'MINX' and self.minxOffset < 0:
+                    self.minxOffset = pos
+                pos += 8 + nbytes
+        if self.tailOffset < 0:
+            self.tailOffset = pos
+
+        if len(objOffsets) != self.nObjects:
+            raise ValueError('Found {0} of {1} objects in {2}.'.format(
+                len(objOffsets), self.nObjects, self.filename))
+        self.objOffsets = np.asarray(objOffsets, dtype = np.int64)
+        self.objBytes = np.diff(np.append(self.objOffsets, self.tailOffset))
+        self.nContours = np.asarray(nContours, dtype = np.int64)
+        self.nMeshes = np.asarray(nMeshes, dtype = np.int64)
+        self.nPoints = np.asarray(nPoints, dtype = np.int64)
+        self.names = names
+        self.colors = np.asarray(colors, dtype = np.float32).reshape(-1, 3)
+        return self
+
+    def save(self, fname = None):
+        """
+        Writes the index to a sidecar file, by default filename + '.pyimodidx'.
+        The index is written to a temporary file first, such that concurrent
+        or interrupted runs never leave a partially written sidecar.
+        """
+        fname = fname or self.sidecar_name()
+        ftmp = '{0}.{1}.tmp'.format(fname, os.getpid())
+        with open(ftmp, mode = "wb") as fid:
+            np.savez(fid,
+                fileSize = self.fileSize,
+                mtime = self.mtime,
+                nObjects = self.nObjects,
+                objOffsets = self.objOffsets,
+                objBytes = self.objBytes,
+                nContours = self.nContours,
+                nMeshes = self.nMeshes,
+                nPoints = self.nPoints,
+                names = np.asarray(self.names, dtype = str),
+                colors = self.colors,
+                tailOffset = self.tailOffset,
+                viewOffset = self.viewOffset,
+                viewObjects = self.viewObjects,
+                minxOffset = self.minxOffset)
+        os.rename(ftmp, fname)
+
+    def load(self, fname = None):
+        """
+        Loads the index from a sidecar file. Returns False if the sidecar does
+        not exist, cannot be read, or is stale with respect to the model file.
+        """
+        fname = fname or self.sidecar_name()
+        if not os.path.isfile(fname) or not zipfile.is_zipfile(fname):
+            return False
+        try:
+            with np.load(fname) as data:
+                if (int(data['fileSize']), float(data['mtime'])) != \
+                    self.file_key():
+                    return False
+                for key in ['fileSize', 'nObjects', 'tailOffset',
+                    'viewOffset', 'viewObjects', 'minxOffset']:
+                    setattr(self, key, int(data[key]))
+                self.mtime = float(data['mtime'])
+                for key in ['objOffsets', 'objBytes', 'nContours', 'nMeshes',
+                    'nPoints', 'colors']:
+                    setattr(self, key, data[key])
+                self.names = [str(x) for x in data['names']]
+        except (IOError, KeyError, ValueError, AttributeError,
+            zipfile.BadZipfile):
+            return False
+        return True
+
+    def view_offset(self, iObject):
+        """
+        Returns the byte offset of the per-object VIEW data of object iObject,
+        or -1 if the object has no VIEW data.
+        """
+        if self.viewOffset < 0 or not (0 <= iObject < self.viewObjects):
+            return -1
+        # Skip the tag, the chunk length, and the model-level VIEW data
+        return (self.viewOffset + 8 + VIEW_HEADER.size +
+            OBJECT_VIEW.size * iObject)
+
+def scan(fname, sidecar = False):
+    """
+    Returns summary statistics of an IMOD model file without parsing any of
+    its point data. Only the model header, the OBJT headers, and the CONT and
+    MESH chunk headers are read; all payloads are seeked past (see ImodIndex).
+
+    Inputs
+    ======
+    fname   - Filename of the IMOD model file.
+    sidecar - If True, the chunk index is loaded from or saved to a sidecar
+              file next to the model file.
+
+    Returns
+    =======
+    stats - A dictionary containing the model name, image dimensions (xMax,
+            yMax, zMax), pixelSizeXY, units, fileSize (in bytes), the total
+            nObjects, nContours, nPoints, and nMeshes, and the per-object
+            entries: names (list), colors (nObjects x 3 array of RGB values
+            ranging from 0-1), objContours, objPoints, and objMeshes.
+    """
+    index = ImodIndex(fname, sidecar = sidecar)
+    with open(fname, mode = "rb") as fid:
+        data = fid.read(ImodIndex.headerBytes)
+    header, _ = unpack_fields(MODEL_HEADER, MODEL_HEADER_FIELDS, data, 8)
+
+    stats = {'name': cstr(header['name']),
+             'xMax': header['xMax'],
+             'yMax': header['yMax'],
+             'zMax': header['zMax'],
+             'pixelSizeXY': header['pixelSizeXY'],
+             'units': header['units'],
+             'fileSize': index.fileSize,
+             'nObjects': index.nObjects,
+             'nContours': int(index.nContours.sum()),
+             'nPoints': int(index.nPoints.sum()),
+             'nMeshes': int(index.nMeshes.sum()),
+             'names': list(index.names),
+             'colors': index.colors,
+             'objContours': index.nContours,
+             'objPoints': index.nPoints,
+             'objMeshes': index.nMeshes}
+    return stats
@@ -1,7 +1,20 @@
-import struct
+import numpy as np
+from .utils import read_array
+from .binspec import MESH_HEADER, MESH_HEADER_FIELDS, unpack_fields
 
 class ImodMesh(object):
 
+    # List markers of the mesh index list. Indices that follow BGNPOLYNORM2
+    # are vertex indices, 3 per triangle, each followed in the vertex list by
+    # its normal. Indices that follow BGNPOLYNORM are (normal, vertex) index
+    # pairs, 3 pairs per triangle. Indices that follow BGNPOLY are vertex
+    # indices, 3 per triangle.
+    END = -1
+    BGNPOLY = -2
+    BGNPOLYNORM = -21
+    ENDPOLY = -22
+    BGNPOLYNORM2 = -23
+
     def __init__(self,
         fid = None,
         debug = 0,
@@ -12,6 +25,7 @@ class ImodMesh(object):
         pad = 0,
         vertices = [],
         indices = [],
+        mmap = False,
         **kwargs):
             self.__dict__.update(kwargs)
             self.__dict__.update(locals())
@@ -20,20 +34,78 @@ class ImodMesh(object):
 
     def read_file(self):
         fid = self.fid
-        self.nVertices = struct.unpack('>l', fid.read(4))[0]
-        self.nIndices = struct.unpack('>l', fid.read(4))[0]
-        self.flag = struct.unpack('>l', fid.read(4))[0]
-        self.type = struct.unpack('>h', fid.read(2))[0]
-        self.pad = struct.unpack('>h', fid.read(2))[0] 
-        self.vertices = struct.unpack('>{0}f'.format(3 * self.nVertices),
-            fid.read(12 * self.nVertices))
-        self.indices = struct.unpack('>{0}l'.format(self.nIndices),
-            fid.read(4 * self.nIndices))
+        header, _ = unpack_fields(MESH_HEADER, MESH_HEADER_FIELDS,
+            fid.read(MESH_HEADER.size))
+        self.__dict__.update(header)
+        self.vertices = read_array(fid, 'f', 3 * self.nVertices, self.mmap)
+        self.indices = read_array(fid, 'l', self.nIndices, self.mmap)
         return self
 
+    def get_triangles(self):
+        """
+        Decodes the polygon lists of the mesh index list into an (ntri x 3)
+        array of indices into the vertex list (see get_vertices). Lists of
+        other types are skipped.
+        """
+        ind = np.asarray(self.indices, dtype = np.int64)
+        markers = np.flatnonzero(ind < 0)
+        tris = [np.zeros([0, 3], dtype = np.int64)]
+        for i, iMarker in enumerate(markers[:-1]):
+            block = ind[iMarker+1:markers[i+1]]
+            if ind[iMarker] == self.BGNPOLYNORM:
+                block = block[1::2]
+            elif ind[iMarker] not in (self.BGNPOLYNORM2, self.BGNPOLY):
+                continue
+            tris.append(block[:len(block) // 3 * 3].reshape(-1, 3))
+        return np.concatenate(tris)
+
+    def get_vertices(self):
+        """
+        Returns the vertex list as an (nVertices x 3) array. For meshes with
+        normals, vertices and normals alternate.
+        """
+        return np.asarray(self.vertices, dtype = float).reshape(-1, 3)
+
+    def get_triangle_coords(self, scale = (1, 1, 1)):
+        """
+        Returns the coordinates of the corners of all triangles of the mesh,
+        as an (ntri x 3 x 3) array, multiplied by scale along X, Y, and Z.
+        """
+        return self.get_vertices()[self.get_triangles()] * scale
+
+    def calc_volume(self, scale = (1, 1, 1)):
+        """
+        Returns the volume enclosed by the mesh, computed with the divergence
+        theorem, with coordinates multiplied by scale along X, Y, and Z.
+        """
+        return abs(triangle_volume(self.get_triangle_coords(scale)).sum())
+
+    def calc_surface_area(self, scale = (1, 1, 1)):
+        """
+        Returns the surface area of the mesh, with coordinates multiplied by
+        scale along X, Y, and Z.
+        """
+        return triangle_area(self.get_triangle_coords(scale)).sum()
+
     def dump(self):
         from collections import OrderedDict as od
         for key, value in od(sorted(self.__dict__.items())).iteritems():
             print key, value
         print "\n"
 
+
+def triangle_volume(tri):
+    """
+    Returns the signed volume of the tetrahedron spanned by each triangle of
+    the (ntri x 3 x 3) array tri and the origin. Summed over a closed mesh,
+    the absolute value is the enclosed volume.
+    """
+    return np.einsum('ij,ij->i', tri[:, 0], np.cross(tri[:, 1],
+        tri[:, 2])) / 6
+
+def triangle_area(tri):
+    """
+    Returns the area of each triangle of the (ntri x 3 x 3) array tri.
+    """
+    return np.sqrt((np.cross(tri[:, 1] - tri[:, 0],
+        tri[:, 2] - tri[:, 0]) ** 2).sum(1)) / 2
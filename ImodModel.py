@@ -1,17 +1,40 @@
 from __future__ import division
 
 import os
+import mmap as mmapfile
 import struct
-import time
+import itertools
+from functools import partial
 import numpy as np
+import multiprocessing as mp
 from .ImodObject import ImodObject
 from .ImodContour import ImodContour
+from .ImodContourArray import ImodContourArray
 from .ImodWrite import ImodWrite
 from .ImodView import ImodView
-from .mrc import get_dims, mrc_to_numpy
-from .utils import is_integer, is_string
+from .ImodIndex import ImodIndex
+from .ImodObjectList import ImodObjectList
+from .ImodZIndex import ImodZIndex
+from .ImodBoxIndex import ImodBoxIndex, box_distance
+from .mrc import MrcVolume, MrcSliceCache, MRC_DTYPES, write_mrc_header
+from .utils import is_integer, is_string, get_bit
+from .binspec import (MODEL_HEADER, MODEL_HEADER_FIELDS, VIEW_HEADER,
+    VIEW_HEADER_FIELDS, VIEW_HEADER_TAIL_FIELDS, OBJECT_VIEW, MINX, MINX_FIELDS,
+    unpack_fields, cstr)
 from .features import *
 
+# Predicates accepted by ImodModel.filterObjects. Object predicates are
+# evaluated in this order, from the cheapest to the most costly.
+OBJECT_PREDICATES = ('nContours', 'nSlices', 'border', 'area', 'volume',
+    'distance')
+CONTOUR_PREDICATES = ('nPoints', 'contourDistance')
+
+# Point arrays shared with the worker processes of ImodModel.proximity_pairs
+PROXIMITY_POINTS = None
+
+# Statistics computed by ImodModel.sample_intensities
+INTENSITY_STATS = ('mean', 'std', 'min', 'max', 'hist')
+
 class ImodModel(object):
     """
     Python class that reads and manipulates IMOD model files. IMOD is a set of
@@ -41,6 +64,45 @@ class ImodModel(object):
 
     The latter will create an empty model file with default settings and
     properties.
+
+    Large model files can instead be opened through a read-only memory map:
+
+    mod = pyimod.ImodModel('filename.mod', mmap = True)
+
+    In this mode, contour points, SIZE values, and mesh vertices and indices
+    are not decoded into Python tuples. Instead, they are exposed as read-only,
+    big-endian Numpy views into the mapped file, such that opening a model
+    only costs a pass over its chunk headers. Point data are only paged in
+    from disk when they are actually accessed. To modify point data of a
+    memory mapped model, assign a new list or array to the points attribute
+    rather than editing it in place.
+
+    Models can also be opened lazily:
+
+    mod = pyimod.ImodModel('filename.mod', lazy = True, budget = 2 ** 30)
+
+    In this mode, mod.Objects is an ImodObjectList, which reads each object's
+    header on first access, and its contours and meshes on first access of
+    its Contours or Meshes. If budget is given, the contour and mesh data of
+    the least recently used objects are dropped once more than budget bytes
+    of them have been read. If sidecar is True, the chunk index used to seek
+    to objects is persisted next to the model file (see ImodIndex).
+
+    Parts of a model can be skipped at parse time, by seeking past them
+    rather than decoding them:
+
+    mod = pyimod.ImodModel('filename.mod', objects = '1,4-6',
+        z_range = (10, 20), meshes = False, views = False)
+
+    objects is a list of object numbers (1 - nObjects), or a string in IMOD
+    syntax, of the objects to read. z_range = (zmin, zmax) only reads the
+    contours whose first point has zmin <= z <= zmax. If meshes or views is
+    False, mesh or VIEW data are not read. The skipped parts are left out of
+    the model, as if the file did not contain them.
+
+    With compact = True, the contours of each object are read into the
+    columnar storage of ImodContourArray (see ImodObject.compact_contours)
+    rather than into one ImodContour instance per contour.
     """
 
     'Class used for reading and manipulating IMOD model files'
@@ -139,8 +201,18 @@ class ImodModel(object):
         minx_cscale = [0, 0, 0],
         minx_ctrans = [0, 0, 0],
         minx_crot = [0, 0, 0], 
+        mmap = False,
+        lazy = False,
+        budget = None,
+        sidecar = False,
+        objects = None,
+        z_range = None,
+        meshes = True,
+        views = True,
+        compact = False,
         **kwargs):
             self.Objects = []
+            self.index = None
             self.__dict__.update(kwargs)
             self.__dict__.update(locals())
 
@@ -175,54 +247,56 @@ class ImodModel(object):
 
     def read_file(self):
         with open(self.filename, mode = "rb") as fid:
+            # In memory mapped mode, parse directly from the mapping. The map
+            # is left open after parsing, since the point arrays of all
+            # contours and meshes are views into it. It is released once the
+            # model and all of its arrays have been garbage collected.
+            if self.mmap:
+                fid = mmapfile.mmap(fid.fileno(), 0,
+                    access = mmapfile.ACCESS_READ)
             self.fid = fid
             data = fid.read(8)
             if self.debug == 1:
                 print data[0:4]
             self.version = data[4:9]
-            data = fid.read(128)
-            self.name = data.split('\x00')[0]
-            self.xMax = struct.unpack('>l', fid.read(4))[0]
-            self.yMax = struct.unpack('>l', fid.read(4))[0]
-            self.zMax = struct.unpack('>l', fid.read(4))[0]
-            self.nObjects = struct.unpack('>l', fid.read(4))[0]
-            self.flags = struct.unpack('>l', fid.read(4))[0]
-            self.drawMode = struct.unpack('>l', fid.read(4))[0]
-            self.mouseMode = struct.unpack('>l', fid.read(4))[0]
-            self.blackLevel = struct.unpack('>l', fid.read(4))[0]
-            self.whiteLevel = struct.unpack('>l', fid.read(4))[0]
-            self.xOffset = struct.unpack('>f', fid.read(4))[0]
-            self.yOffset = struct.unpack('>f', fid.read(4))[0]
-            self.zOffset = struct.unpack('>f', fid.read(4))[0]
-            self.xScale = struct.unpack('>f', fid.read(4))[0]
-            self.yScale = struct.unpack('>f', fid.read(4))[0]
-            self.zScale = struct.unpack('>f', fid.read(4))[0]
-            self.object = struct.unpack('>l', fid.read(4))[0]
-            self.contour = struct.unpack('>l', fid.read(4))[0]
-            self.point = struct.unpack('>l', fid.read(4))[0]
-            self.res = struct.unpack('>l', fid.read(4))[0]
-            self.thresh = struct.unpack('>l', fid.read(4))[0]
-            self.pixelSizeXY = struct.unpack('>f', fid.read(4))[0]
-            self.units = struct.unpack('>l', fid.read(4))[0]
-            self.csum = struct.unpack('>l', fid.read(4))[0]
-            self.alpha = struct.unpack('>f', fid.read(4))[0]
-            self.beta = struct.unpack('>f', fid.read(4))[0]
-            self.gamma = struct.unpack('>f', fid.read(4))[0]
+            header, _ = unpack_fields(MODEL_HEADER, MODEL_HEADER_FIELDS,
+                fid.read(MODEL_HEADER.size))
+            self.__dict__.update(header)
+            self.name = cstr(self.name)
 
             if self.debug == 2:
                 self.dump()
 
-            iObject = 1
-            while iObject <= self.nObjects:          
-                data = fid.read(64)
-                datatype = data[0:4]
-                fid.seek(-64, 1)
-                if self.debug == 1:
-                    print datatype
-                if datatype == 'OBJT':
-                    self.Objects.append(ImodObject(self.fid,
-                        debug = self.debug))
-                    iObject = iObject + 1
+            # Position within the file of each of the objects that are read,
+            # and their position in the model
+            fileObjects = self.get_object_subset()
+            position = dict([(x, i) for i, x in enumerate(fileObjects)])
+
+            # In lazy mode, only index the objects, and skip to the VIEW and
+            # MINX chunks that follow them.
+            if self.lazy:
+                self.Objects = ImodObjectList(self, budget = self.budget,
+                    items = fileObjects)
+                fid.seek(self.Objects.index.tailOffset, 0)
+            else:
+                iObject = 1
+                while iObject <= self.nObjects:
+                    data = fid.read(64)
+                    datatype = data[0:4]
+                    fid.seek(-64, 1)
+                    if self.debug == 1:
+                        print datatype
+                    if datatype == 'OBJT':
+                        # Objects outside of the subset are only read up to
+                        # their header, and discarded
+                        obj = ImodObject(self.fid, debug = self.debug,
+                            mmap = self.mmap, meshes = self.meshes,
+                            z_range = self.z_range, compact = self.compact,
+                            payload = iObject - 1 in position)
+                        if iObject - 1 in position:
+                            self.Objects.append(obj)
+                        iObject = iObject + 1
+            self.nObjects = len(fileObjects)
 
             while True:
                 data = fid.read(4)
@@ -237,10 +311,22 @@ class ImodModel(object):
                         self.view_4bytes_cview = struct.unpack('>i', fid.read(4))[0]
                         continue
                     # Handle all other cases of the VIEW chunk
+                    if not self.views:
+                        fid.seek(nViewBytes, 1)
+                        continue
                     self.view_set = 1
                     self.read_view(fid)
-                    for i in range(0, self.view_objvsize):
-                        self.Objects[i].Views.append(ImodView(self.fid))
+                    nViews = self.view_objvsize
+                    self.view_objvsize = len([x for x in fileObjects
+                        if x < nViews])
+                    if self.lazy:
+                        # Object views are read along with each object
+                        fid.seek(OBJECT_VIEW.size * nViews, 1)
+                        continue
+                    for i in range(0, nViews):
+                        view = ImodView(self.fid)
+                        if i in position:
+                            self.Objects[position[i]].Views.append(view)
                 elif data == 'MINX':
                     self.read_minx(fid)
                 elif data == 'IEOF':
@@ -249,47 +335,95 @@ class ImodModel(object):
                     print data
                     break
 
-        fid.close()
         return self
 
     def read_minx(self, fid):
         self.minx_set = 1
         fid.seek(4, 1)
-        self.minx_oscale = [struct.unpack('>f', fid.read(4))[0] for x in [0, 1, 2]]
-        self.minx_otrans = [struct.unpack('>f', fid.read(4))[0] for x in [0, 1, 2]]
-        self.minx_orot = [struct.unpack('>f', fid.read(4))[0] for x in [0, 1, 2]]
-        self.minx_cscale = [struct.unpack('>f', fid.read(4))[0] for x in [0, 1, 2]]
-        self.minx_ctrans = [struct.unpack('>f', fid.read(4))[0] for x in [0, 1, 2]]
-        self.minx_crot = [struct.unpack('>f', fid.read(4))[0] for x in [0, 1, 2]]        
+        values = MINX.unpack(fid.read(MINX.size))
+        for i, key in enumerate(MINX_FIELDS):
+            setattr(self, key, list(values[3*i:3*i+3]))
 
     def read_view(self, fid):
-        self.view_fovy = struct.unpack('>f', fid.read(4))[0]
-        self.view_rad = struct.unpack('>f', fid.read(4))[0]
-        self.view_aspect = struct.unpack('>f', fid.read(4))[0]
-        self.view_cnear = struct.unpack('>f', fid.read(4))[0]
-        self.view_cfar = struct.unpack('>f', fid.read(4))[0]
-        self.view_rot_x = struct.unpack('>f', fid.read(4))[0]
-        self.view_rot_y = struct.unpack('>f', fid.read(4))[0]
-        self.view_rot_z = struct.unpack('>f', fid.read(4))[0]
-        self.view_trans_x = struct.unpack('>f', fid.read(4))[0]
-        self.view_trans_y = struct.unpack('>f', fid.read(4))[0]
-        self.view_trans_z = struct.unpack('>f', fid.read(4))[0]
-        self.view_scale_x = struct.unpack('>f', fid.read(4))[0]
-        self.view_scale_y = struct.unpack('>f', fid.read(4))[0]
-        self.view_scale_z = struct.unpack('>f', fid.read(4))[0]
-        self.view_mat = []
-        for i in range(0, 16):
-            self.view_mat.append(struct.unpack('>f', fid.read(4))[0])
-        self.view_world = struct.unpack('>i', fid.read(4))[0]
-        data = fid.read(32)
-        self.view_label = data.rstrip('\0')
-        self.view_dcstart = struct.unpack('>f', fid.read(4))[0]
-        self.view_dcend = struct.unpack('>f', fid.read(4))[0]
-        self.view_lightx = struct.unpack('>f', fid.read(4))[0]
-        self.view_lighty = struct.unpack('>f', fid.read(4))[0]
-        self.view_plax = struct.unpack('>f', fid.read(4))[0]
-        self.view_objvsize = struct.unpack('>i', fid.read(4))[0]
-        fid.seek(4, 1)
+        header, values = unpack_fields(VIEW_HEADER, VIEW_HEADER_FIELDS,
+            fid.read(VIEW_HEADER.size))
+        self.__dict__.update(header)
+        self.view_mat = list(values[14:30])
+        self.__dict__.update(zip(VIEW_HEADER_TAIL_FIELDS, values[30:38]))
+        self.view_label = self.view_label.rstrip('\0')
+
+    def get_object_subset(self):
+        """
+        Returns the sorted list of positions (0 - nObjects-1) within the model
+        file of the objects selected by the objects argument, or of all
+        objects if it was not given.
+        """
+        if self.objects is None:
+            return range(self.nObjects)
+        objects = self.objects
+        if isinstance(objects, str):
+            objects = parse_obj_list(objects)
+        for x in objects:
+            if not (1 <= x <= self.nObjects):
+                raise ValueError('Object {0} does not exist within the '
+                    'model.'.format(x))
+        return sorted(set([x - 1 for x in objects]))
+
+    def get_index(self, sidecar = False):
+        """
+        Returns the chunk offset index (see ImodIndex) of the model file. The
+        index is built on first use, and rebuilt if the model file has changed
+        since. If sidecar is True, the index is loaded from or saved to a
+        sidecar file next to the model file, such that it only needs to be
+        built once across separate runs.
+        """
+        if not self.filename:
+            raise ValueError('Model has no file to index.')
+        if self.index is None or not self.index.is_current():
+            self.index = ImodIndex(self.filename, sidecar = sidecar)
+        return self.index
+
+    def open_file(self):
+        """
+        Opens the model file for reading. In memory mapped mode, a read-only
+        map of the file is returned instead of a file object.
+        """
+        fid = open(self.filename, mode = "rb")
+        if self.mmap:
+            mm = mmapfile.mmap(fid.fileno(), 0, access = mmapfile.ACCESS_READ)
+            fid.close()
+            fid = mm
+        return fid
+
+    def load_object(self, iObject, sidecar = False, payload = True):
+        """
+        Reads object iObject, ranging from 0 - self.nObjects-1, directly from
+        the model file and returns it as a new ImodObject instance. Using the
+        model's chunk index, the file is seeked straight to the object, such
+        that none of the objects preceding it are parsed. The object's VIEW
+        data, if present, is read as well. The sidecar argument is passed on
+        to get_index. If payload is False, only the object's header is read
+        (see ImodObject).
+        """
+        index = self.get_index(sidecar)
+        if not (0 <= iObject < index.nObjects):
+            raise ValueError('Object {0} does not exist within the model.'.format(
+                iObject))
+
+        fid = self.open_file()
+        try:
+            fid.seek(index.objOffsets[iObject], 0)
+            obj = ImodObject(fid, debug = self.debug, mmap = self.mmap,
+                payload = payload, meshes = self.meshes,
+                z_range = self.z_range, compact = self.compact)
+            if self.views and index.view_offset(iObject) >= 0:
+                fid.seek(index.view_offset(iObject), 0)
+                obj.Views.append(ImodView(fid))
+        finally:
+            # A memory map must stay open, as the object's arrays view it.
+            if not self.mmap:
+                fid.close()
+        return obj
 
     def addObject(self):
         self.Objects.append(ImodObject(cmap = self.cmap))
@@ -443,118 +577,45 @@ class ImodModel(object):
                   comparison. If False, will keep all objects, but color those
                   that do not meet the comparison red, and those that do green.
         """
-        is_string(compStr, 'Comparison string')
         is_integer(nCont, 'Number of contours')
-        if not opsDict.has_key(compStr):
-            raise ValueError('{0} is not a valid operator'.format(compStr))
-
-        # Loop to check for nContours conditional statement
-        for iObj in range(self.nObjects - 1, -1, -1):
-            if not opsDict[compStr] (self.Objects[iObj].nContours, nCont):
-                if remove:
-                    del(self.Objects[iObj])
-                else:
-                    self.Objects[iObj].setColor(1, 0, 0)
-            else:
-                if not remove:
-                    self.Objects[iObj].setColor(0, 1, 0)
-
-        # Update # of objects and number of views, if these were changed.
-        if remove:
-            self.nObjects = len(self.Objects)
-            if self.view_set:
-                self.view_objvsize = len(self.Objects)
+        self.filterObjects(remove = remove, nContours = (compStr, nCont))
 
     def filterByNSlices(self, compStr, nSlices, remove = True):
         """
         Removes all objects that do not satisfy the supplied conditional 
         statement for the number of unique slices present.
         """ 
-        is_string(compStr, 'Comparison string')
         is_integer(nSlices, 'Number of contours')
-        if not opsDict.has_key(compStr):
-            raise ValueError('{0} is not a valid operator'.format(compStr))
-        
-        for iObj in range(self.nObjects -1, -1, -1):
-            zlist = self.Objects[iObj].get_z_values()
-            nz = len(np.unique(np.asarray(zlist)))
-            if not opsDict[compStr] (nz, nSlices):
-                if remove:
-                    del(self.Objects[iObj])
-                else:
-                    self.Objects[iObj].setColor(1, 0, 0)
-            else:
-                if not remove:
-                    self.Objects[iObj].setColor(0, 1, 0)
-
-        # Update # of objects and number of views, if these were changed.
-        if remove:
-            self.nObjects = len(self.Objects)
-            if self.view_set:
-                self.view_objvsize = len(self.Objects)
+        self.filterObjects(remove = remove, nSlices = (compStr, nSlices))
 
     def filterByContourArea(self, compStr, areaComp, remove = True):
         """
         Removes all objects that do not satisfy the supplied conditional
-        statement for the maximum area of a contour in the given object.
+        statement for the maximum area of a contour in the given object. Areas
+        are computed from the model in memory (see contour_metrics), and are
+        compared in the model's units divided by 1000 squared (i.e. in
+        microns squared for models in nm), as reported by imodinfo_v.
         """
-        is_string(compStr, 'Comparison string')
         is_integer(areaComp, 'Maximum area')
-        if not opsDict.has_key(compStr):
-            raise ValueError('{0} is not a valid operator'.format(compStr))
-    
-        for iObj in range(self.nObjects -1, -1, -1):
-            M, vol, sa = imodinfo_v(self.filename, iObj,
-                self.Objects[iObj].nContours)
-            amax = np.max(M[:, 3])
-            print iObj+1, amax
-            if not opsDict[compStr] (amax, areaComp):
-                if remove:
-                    del(self.Objects[iObj])
-                else:
-                    self.Objects[iObj].setColor(1, 0, 0)
-            else:
-                if not remove:
-                    self.Objects[iObj].setColor(0, 1, 0)
-
-        # Update # of objects and number of views, if these were changed.
-        if remove:
-            self.nObjects = len(self.Objects)
-            if self.view_set:
-                self.view_objvsize = len(self.Objects)
+        self.filterObjects(remove = remove, area = (compStr, areaComp))
 
     def filterByVolume(self, compStr, volumeComp, remove = True):
         """
         Removes all objects that do not satisfy the supplied conditional
         statement for the maximum volume of an object in the given model.
+        Volumes are computed from the meshes in memory (see mesh_metrics), and
+        are compared in the model's units divided by 1000 cubed (i.e. in
+        microns cubed for models in nm), as reported by imodinfo_v.
         """
-        is_string(compStr, 'Comparison string')
-        if not opsDict.has_key(compStr):
-            raise ValueError('{0} is not a valid operator'.format(compStr))
-
-        for iObj in range(self.nObjects -1, -1, -1):
-            _, vol, _ = imodinfo_v(self.filename, iObj,
-                self.Objects[iObj].nContours)
-            if not opsDict[compStr] (vol, volumeComp):
-                if remove:
-                    del(self.Objects[iObj])
-                else:
-                    self.Objects[iObj].setColor(1, 0, 0)
-            else:
-                if not remove:
-                    self.Objects[iObj].setColor(0, 1, 0)
-         
-        # Update # of objects and number of views, if these were changed.
-        if remove:
-            self.nObjects = len(self.Objects)
-            if self.view_set:
-                self.view_objvsize = len(self.Objects)
+        self.filterObjects(remove = remove, volume = (compStr, volumeComp))
 
     def filterByMeshDistance(self, objRef, compStr, d_thresh, **kwargs):
         """
         Removes all objects that do not satisfy a distance criterion from a
         reference mesh. Euclidean distances are computed between the vertices
-        of the reference object and all other objects in the model.
+        of the reference object and all other objects in the model. The
+        vertices of the reference mesh are indexed by a k-d tree once, against
+        which the vertices of each object are queried in batch.
         
         Required
         ========
@@ -567,87 +628,344 @@ class ImodModel(object):
         ========
         skip: Vertices to skip in each mesh (e.g. skip = 2 will skip every
               other vertex). This can be used to save time.
+        exact: If True, the exact minimum distance of every object is
+               computed. By default, distances are only resolved up to
+               d_thresh, which is all the comparison needs: querying stops
+               at the first vertex closer than d_thresh, and objects farther
+               than d_thresh are given a distance of inf.
+
+        Returns
+        =======
+        d_min: List of the minimum distance of each object to the reference
+               mesh, in the order of the objects before filtering. The entry
+               of the reference object is None.
         """
-        global np, cdist
-        import numpy as np
-        from scipy.spatial.distance import cdist
-
         skip = kwargs.get('skip', 1)
+        exact = kwargs.get('exact', False)
 
-        is_integer(objRef, 'Reference Object')
-        is_string(compStr, 'Comparison String')
         is_integer(d_thresh, 'Distance')
+        check_op(compStr)
+        dists = self.getMeshDistances(objRef, range(self.nObjects), skip = skip,
+            d_upper = None if exact else d_thresh)
 
-        if not opsDict.has_key(compStr):
-            raise ValueError('{0} is not a valid operator'.format(compStr))
-   
-        if objRef > self.nObjects:
-            raise valueError('Reference object does not exist within the model.')
-
-        v_ref = get_vertices(self, objRef - 1, skip)
-
-        c = 0 
-        ckeep = 0 
-        while c < self.nObjects:
-            if c == objRef - 1:
-                c+=1
-                ckeep+=1
+        keep = np.ones(self.nObjects, dtype = bool)
+        for iObj, d_min in enumerate(dists):
+            if d_min is None:
                 continue
-            v_test = get_vertices(self, ckeep, skip)
-            d_min = calc_min_dist(v_ref, v_test)
-            if not opsDict[compStr] (d_min, d_thresh):
-                del(self.Objects[ckeep])
-                decStr = 'REMOVED'
-            else:
-                ckeep+=1
-                decStr = ''
-            print "{0}. dmin = {1} {2}. {3}".format(str(c+1).zfill(6), d_min, self.unitsStr, decStr)
-            c+=1
+            keep[iObj] = opsDict[compStr] (d_min, d_thresh)
+            print "{0}. dmin {1} {2}. {3}".format(str(iObj+1).zfill(6),
+                dist_str(d_min, d_thresh), self.unitsStr,
+                '' if keep[iObj] else 'REMOVED')
 
-        self.nObjects = len(self.Objects)
-        if self.view_set:
-            self.view_objvsize = self.nObjects
+        self.compressObjects(keep)
+        return dists
 
     def filterByContourDistance(self, objRef, compStr, d_thresh, **kwargs):
-        global np, cdist
-        import numpy as np
-        from scipy.spatial.distance import cdist 
+        """
+        Removes all contours that do not satisfy a distance criterion from a
+        reference mesh. Euclidean distances are computed between the vertices
+        of the reference object and the points of each contour of all other
+        objects. The vertices of the reference mesh are indexed by a k-d tree
+        once, against which the points of all contours of each object are
+        queried in a single batch.
+
+        Required
+        ========
+        objRef: Reference object, ranging from 1 - self.nObjects
+        compStr: Comparison string in opsDict
+        d_thresh: Distance threshold for removal, whose units are the same as
+                  those specified in self.unitsStr
 
+        Optional
+        ========
+        skip_ref: Vertices to skip in the reference mesh.
+        skip_cont: Points to skip in each contour.
+        exact: If True, the exact minimum distance of every contour is
+               computed. By default, distances are only resolved up to
+               d_thresh, and contours farther than d_thresh are given a
+               distance of inf.
+
+        Returns
+        =======
+        d_min: List with, for each object, an array of the minimum distance
+               of each of its contours to the reference mesh, in the order of
+               the contours before filtering. The entry of the reference
+               object is None.
+        """
         skip_ref = kwargs.get('skip_ref', 1)
         skip_cont = kwargs.get('skip_cont', 1)
+        exact = kwargs.get('exact', False)
 
-        is_integer(objRef, 'Reference Object')
-        is_string(compStr, 'Comparison String')
         is_integer(d_thresh, 'Distance')
+        check_op(compStr)
+        dists = self.getContourDistances(objRef, range(self.nObjects),
+            skip_ref = skip_ref, skip_cont = skip_cont,
+            d_upper = None if exact else d_thresh)
 
-        if not opsDict.has_key(compStr):
-            raise ValueError('{0} is not a valid operator'.format(compStr))
-
-        if objRef > self.nObjects:
-            raise valueError('Reference object does not exist within the model.')
+        for iObject, d_min in enumerate(dists):
+            if d_min is None:
+                continue
+            keep = opsDict[compStr] (d_min, d_thresh)
+            for iContour in range(len(d_min)):
+                print "{0} {1}. dmin {2} {3}. {4}".format(
+                    str(iObject+1).zfill(6), str(iContour+1).zfill(6),
+                    dist_str(d_min[iContour], d_thresh), self.unitsStr,
+                    '' if keep[iContour] else 'REMOVED')
+            self.Objects[iObject].compress_contours(keep)
+        return dists
+
+    def getMeshDistances(self, objRef, objects, skip = 1, d_upper = None):
+        """
+        Returns a list of the minimum distance of the mesh vertices of each of
+        the given objects (0 - nObjects-1) to those of the reference object
+        objRef (1 - nObjects), whose own entry is None. Distances are only
+        resolved up to d_upper, if given (see calc_min_dist), in which case
+        objects whose vertices' bounding box is farther than d_upper from that
+        of the reference are not queried.
+        """
+        is_integer(objRef, 'Reference Object')
+        if not 0 < objRef <= self.nObjects:
+            raise ValueError('Reference object does not exist within the model.')
+        v_ref = get_vertices(self, objRef - 1, skip)
+        tree = build_tree(v_ref)
+        if len(v_ref):
+            box_ref = np.concatenate([v_ref.min(0), v_ref.max(0)])[None]
+        dists = []
+        for iObj in objects:
+            if iObj == objRef - 1:
+                dists.append(None)
+                continue
+            v_test = get_vertices(self, iObj, skip)
+            if (d_upper is not None and len(v_ref) and len(v_test) and
+                box_distance(box_ref, v_test.min(0), v_test.max(0))[0] >
+                d_upper):
+                dists.append(float('Inf'))
+            else:
+                dists.append(calc_min_dist(tree, v_test, d_upper))
+        return dists
 
+    def getContourDistances(self, objRef, objects, skip_ref = 1, skip_cont = 1,
+        d_upper = None):
+        """
+        Returns a list with, for each of the given objects (0 - nObjects-1), an
+        array of the minimum distance of each of its contours to the mesh
+        vertices of the reference object objRef (1 - nObjects), whose own
+        entry is None.
+        """
+        is_integer(objRef, 'Reference Object')
+        if not 0 < objRef <= self.nObjects:
+            raise ValueError('Reference object does not exist within the model.')
         v_ref = get_vertices(self, objRef - 1, skip_ref)
+        tree = build_tree(v_ref)
+
+        # If distances are bounded, contours whose bounding box is farther
+        # than d_upper from that of the reference mesh are not queried
+        prune = d_upper is not None and len(v_ref)
+        if prune:
+            scale = self.getPixelScale()
+            index = self.get_box_index()
+            dbox = index.box_distances(v_ref.min(0) / scale,
+                v_ref.max(0) / scale, scale, level = 'contour')
+            starts = np.searchsorted(index.objIds, np.arange(self.nObjects))
+
+        dists = []
+        for iObj in objects:
+            if iObj == objRef - 1:
+                dists.append(None)
+                continue
+            contours = range(self.Objects[iObj].nContours)
+            if prune:
+                near = dbox[starts[iObj]:starts[iObj] + len(contours)] <= \
+                    d_upper
+                contours = np.flatnonzero(near)
+            pts = [get_points(self, iObj, iContour, skip_cont)
+                for iContour in contours]
+            d_min = calc_min_dists(tree, pts, d_upper)
+            if prune:
+                d_min, d_near = np.empty(len(near)), d_min
+                d_min.fill(float('Inf'))
+                d_min[near] = d_near
+            dists.append(d_min)
+        return dists
+
+    def filterObjects(self, remove = True, **predicates):
+        """
+        Filters the model's contours and objects by any number of predicates
+        at once. Contour predicates are evaluated into one boolean mask per
+        object, and applied first. Object predicates are then evaluated into a
+        single boolean mask over all objects, with the cheapest predicates
+        first, and the more costly ones only for the objects that are still
+        kept. The objects that fail any predicate are then removed (or
+        recolored) in a single pass. For example,
+
+            mod.filterObjects(nPoints = ('>', 0), nContours = ('>', 2),
+                border = True)
+
+        removes all empty contours, and then all objects with 2 contours or
+        less, and all objects touching the bounds of the image.
+
+        Object predicates
+        =================
+        nContours - (compStr, n): Keeps objects whose number of contours
+                    satisfies the comparison, e.g. ('>', 10).
+        nSlices   - (compStr, n): Same, for the number of unique Z slices.
+        border    - If True, removes objects that touch the bounds of the
+                    image (see removeBorderObjects). May also be given as a
+                    margin, in pixels, from the bounds.
+        area      - (compStr, a): Same, for the maximum contour area of each
+                    object (see filterByContourArea).
+        volume    - (compStr, v): Same, for the mesh volume of each object
+                    (see filterByVolume).
+        distance  - (objRef, compStr, d): Same, for the minimum distance of
+                    each object's mesh to the mesh of the reference object
+                    objRef (1 - nObjects), which is always kept (see
+                    filterByMeshDistance).
+
+        Contour predicates
+        ==================
+        nPoints         - (compStr, n): Keeps contours whose number of points
+                          satisfies the comparison.
+        contourDistance - (objRef, compStr, d): Keeps contours whose minimum
+                          distance to the mesh of objRef satisfies the
+                          comparison (see filterByContourDistance).
+
+        Inputs
+        ======
+        remove - If True (default), removes objects that fail the object
+                 predicates. If False, keeps all objects, but colors those
+                 that fail red, and those that pass green. Contours that fail
+                 the contour predicates are always removed.
+
+        Returns
+        =======
+        keep - Boolean array of the objects that passed, in the order of the
+               objects before filtering. This can be applied later with
+               compressObjects.
+        """
+        for key in predicates:
+            if key not in OBJECT_PREDICATES + CONTOUR_PREDICATES:
+                raise ValueError('{0} is not a valid predicate.'.format(key))
+        masks = self.getContourMask(**predicates)
+        if masks is not None:
+            for iObj, keep in enumerate(masks):
+                self.Objects[iObj].compress_contours(keep)
+        keep = self.getObjectMask(**predicates)
+        self.applyObjectMask(keep, remove = remove)
+        return keep
+
+    def getObjectMask(self, **predicates):
+        """
+        Returns a boolean array of the objects that satisfy all of the given
+        object predicates (see filterObjects), without modifying the model.
+        """
+        keep = np.ones(self.nObjects, dtype = bool)
+        for key in OBJECT_PREDICATES:
+            args = predicates.get(key)
+            if args is None or args is False:
+                continue
+            objects = np.flatnonzero(keep)
+            if not len(objects):
+                break
+            keep[objects] = self.evalPredicate(key, args, objects)
+        return keep
 
-        iObject = 0
-        while iObject < self.nObjects:
-            if iObject == objRef - 1:
-                iObject+=1
+    def getContourMask(self, **predicates):
+        """
+        Returns a list with a boolean array per object of the contours that
+        satisfy all of the given contour predicates (see filterObjects), or
+        None if no contour predicate is given.
+        """
+        masks = None
+        for key in CONTOUR_PREDICATES:
+            args = predicates.get(key)
+            if args is None:
                 continue
-            c = 0
-            ckeep = 0
-            while c < self.Objects[iObject].nContours:
-                pts_test = get_points(self, iObject, ckeep, skip_cont)
-                d_min = calc_min_dist(v_ref, pts_test)
-                if not opsDict[compStr] (d_min, d_thresh):
-                    del(self.Objects[iObject].Contours[ckeep])
-                    decStr = 'REMOVED'
+            if key == 'nPoints':
+                compStr, n = args
+                check_op(compStr)
+                vals = [x.get_npoints() for x in self.Objects]
+            else:
+                objRef, compStr, n = args
+                check_op(compStr)
+                vals = self.getContourDistances(objRef, range(self.nObjects),
+                    d_upper = n)
+            # The contours of the reference object (None) are always kept
+            mask = [np.ones(obj.nContours, dtype = bool) if v is None else
+                np.asarray(opsDict[compStr] (np.asarray(v), n), dtype = bool)
+                for obj, v in zip(self.Objects, vals)]
+            if masks is None:
+                masks = mask
+            else:
+                masks = [x & y for x, y in zip(masks, mask)]
+        return masks
+
+    def evalPredicate(self, key, args, objects):
+        """
+        Evaluates a single object predicate (see filterObjects) for the given
+        list of object indices (0 - nObjects-1), in ascending order. Returns a
+        boolean array of the objects that satisfy it.
+        """
+        objects = np.asarray(objects, dtype = int)
+        if key == 'border':
+            margin = 0 if args is True else args
+            return ~self.findBorderObjects(objects, margin = margin)
+        if key == 'distance':
+            objRef, compStr, d_thresh = args
+            check_op(compStr)
+            dists = self.getMeshDistances(objRef, objects, d_upper = d_thresh)
+            return np.asarray([d is None or opsDict[compStr] (d, d_thresh)
+                for d in dists], dtype = bool)
+
+        compStr, n = args
+        check_op(compStr)
+        if key == 'nContours':
+            vals = [self.Objects[i].nContours for i in objects]
+        elif key == 'nSlices':
+            vals = [self.Objects[i].get_z_index().nSlices for i in objects]
+        elif key == 'area':
+            # Maximum contour area of each object, in units / 1000 ** 2
+            M = contour_metrics(self, objects)
+            vals = np.zeros(len(objects))
+            np.maximum.at(vals, np.searchsorted(objects, M[:, 0]),
+                M[:, 5] / (1000 ** 2))
+        elif key == 'volume':
+            # Mesh volume of each object, in units / 1000 ** 3
+            vals = mesh_metrics(self, objects)[:, 0] / (1000 ** 3)
+        return np.asarray(opsDict[compStr] (np.asarray(vals), n), dtype = bool)
+
+    def applyObjectMask(self, keep, remove = True):
+        """
+        Removes the objects for which the boolean array keep is False, or, if
+        remove is False, colors them red, and the others green.
+        """
+        if remove:
+            self.compressObjects(keep)
+        else:
+            for iObj, k in enumerate(keep):
+                if k:
+                    self.Objects[iObj].setColor(0, 1, 0)
                 else:
-                    ckeep+=1
-                    decStr = ''
-                print "{0} {1}. dmin = {2} {3}. {4}".format(str(iObject+1).zfill(6), str(c+1).zfill(6), d_min, self.unitsStr, decStr)
-                c+=1
-            self.Objects[iObject].nContours = len(self.Objects[iObject].Contours)
-            iObject+=1
+                    self.Objects[iObj].setColor(1, 0, 0)
+
+    def compressObjects(self, keep):
+        """
+        Keeps only the objects for which the boolean array keep is True, in a
+        single pass over the objects, and updates the number of objects and
+        object views accordingly.
+        """
+        keep = np.asarray(keep, dtype = bool)
+        if len(keep) != self.nObjects:
+            raise ValueError('Object mask has {0} entries, but the model has '
+                '{1} objects.'.format(len(keep), self.nObjects))
+        if keep.all():
+            return
+        if isinstance(self.Objects, ImodObjectList):
+            self.Objects.compress(keep)
+        else:
+            self.Objects = [x for x, k in zip(self.Objects, keep) if k]
+        self.nObjects = len(self.Objects)
+        if self.view_set:
+            self.view_objvsize = int(keep[:self.view_objvsize].sum())
 
     def moveObjects(self, destObj, moveObjs):
         is_integer(destObj, 'Destination Object')
@@ -781,25 +1099,26 @@ class ImodModel(object):
                         print "    Transparency: {0} --> {1}".format(before,
                             self.Objects[iObject].transparency)
 
-    def removeBorderObjects(self, remove = True, fname = ''):
+    def removeBorderObjects(self, remove = True, fname = '', margin = 0,
+        nproc = None, cache_dir = None):
         """
         Removes all objects that contain contours touching either of the 6 
         bounds of the image stack. If the filename of an MRC file is supplied
         to the fname argument, a more rigorous search for boundary objects 
         will be performed such that objects that are touching alignment-
-        induced borders will be removed. This on a slice-by-slice basis,
-        sequentially over all slices as follows:
-            1. Initialize a Numpy array of the current MRC slice.
+        induced borders will be removed. This is done on a slice-by-slice
+        basis, for the slices that contain contours, as follows:
+            1. Read the MRC slice through a memory map.
             2. Compute the Sobel gradient magnitude of the image.
             3. Threshold the gradient magnitude, keeping only small values
                (e.g. values <= 1). These pixels are likely to correspond to
                borders, which have constant pixel value across the image.
             4. Compute the distance transform (DT) of the thresholded gradient
                magnitude.
-            5. Loop over all objects in the model file. Find contours that are
-               on the given slice. Test the value of DT at each point. If the
-               value is very small (e.g. <= 3), assume the point is on or over
-               the border and remove the object.
+            5. Test the value of DT at each point of the contours on the
+               slice. If the value is very small (e.g. <= 3), assume the point
+               is on or over the border and remove the object.
+        Steps 1-4 run in a pool of processes. See findBorderArtifactObjects.
 
         Input
         =====
@@ -807,101 +1126,778 @@ class ImodModel(object):
                   False, will keep all objects, but color those that touch
                   borders red, and those that do not green.
         fname   - Filename of MRC for alignment-induced border removal.
+        margin  - Distance from the bounds of the image stack, in pixels,
+                  within which points are considered to touch them. Default
+                  is 0.
+        nproc   - Number of processes computing distance transforms. Default
+                  is the number of CPUs.
+        cache_dir - Directory in which to cache the distance transform of each
+                  slice, to be reused by later runs on the same MRC file.
         """
  
-        # Loop over all objects and contours. Find objects containing contours
-        # that touch either of the 6 borders. Append these object numbers to a
-        # list, cdel for subsequent deletion.
-        cdel = []
-        for iObject in range(0, self.nObjects):
-            for iContour in range(0, self.Objects[iObject].nContours):
-                pts = self.Objects[iObject].Contours[iContour].points
-                # Check if the contour's points contain any that touch either
-                # of the 6 boundaries in x, y, or z. If so, append the object
-                # number to the cdel list.
-                if (sum([x < 1 for x in pts[0::3]]) or 
-                    sum([x > self.xMax - 1 for x in pts [0::3]]) or
-                    sum([y < 1 for y in pts[1::3]]) or
-                    sum([y > self.yMax -1 for y in pts [1::3]]) or
-                    (0 in pts[2::3]) or
-                    (self.zMax - 1 in pts[2::3])):
-                    cdel.append(iObject)
-                    break
+        # Find objects containing contours that touch either of the 6 borders
+        touch = self.findBorderObjects(margin = margin)
 
-        # Loop over all objects, and remove those that are in cdel. If remove
-        # is False, set the colors appropriately.
-        for iObj in range(self.nObjects -1, -1, -1):
-            if iObj in cdel:
-                if remove:
-                    del(self.Objects[iObj])
-                else:
-                    self.Objects[iObj].setColor(1, 0, 0)
-            else:
-                if not remove:
-                    self.Objects[iObj].setColor(0, 1, 0)
+        # Run alignment-induced border removal on the remaining objects, if
+        # desired
+        if fname:
+            objects = np.flatnonzero(~touch)
+            touch[objects] = self.findBorderArtifactObjects(fname, objects,
+                nproc = nproc, cache_dir = cache_dir)
 
-        # Update the number of objects and views, if remove is True.
-        if remove:
-            self.nObjects -= len(cdel)
-            if self.view_set:
-                self.view_objvsize -= len(cdel)
+        # Remove the objects that touch borders in a single pass. If remove is
+        # False, set the colors appropriately.
+        self.applyObjectMask(~touch, remove = remove)
 
-        # Run alignment-induced border removal, if desired
-        if fname:
-            cdel = []
-            nx, ny, nz = get_dims(fname)
-            fid = open(fname, mode = "rb")
-            fid.seek(1024, 0)
-            for iSlice in range(nz):
-                tic = time.clock()
-                # Get slice from the MRC stack
-                img = mrc_to_numpy(fid, nx, ny)
-
-                # Get the distance transform
-                dt = proc_border(img).astype('uint8')
-                print np.max(dt)
-                toc = time.clock()
-               
-                print "Slice {0} processed. Elapsed time: {1} seconds.".format(
-                    iSlice + 1, toc - tic)
-
-                for iObj in range(self.nObjects):
-                    zvals = self.Objects[iObj].get_z_values()
-                    idx = np.where(np.asarray(zvals) == iSlice + 1)[0]
-                    if idx.any():
-                        for iCont in idx:
-                            pts = self.Objects[iObj].Contours[iCont].points
-                            nPts = self.Objects[iObj].Contours[iCont].nPoints
-                            pts = [int(x) for x in pts]
-                            pts = np.reshape(pts, [nPts, 3])
-                            pts[:,0] = pts[:,0] - 1
-                            pts[:,1] = ny - pts[:,1] 
-                            pts[:,[0, 1, 2]] = pts[:,[1, 0, 2]]
-                            dtvals = np.asarray([dt[pts[x,0], pts[x,1]] for x in
-                                range(nPts)])
-                            idxdt = np.where(dtvals <= 3)[0]
-                            if idxdt.any():
-                                print "Remove Object {0}".format(iObj+1)
-                                cdel.append(iObj)
-            fid.close()
+    def findBorderObjects(self, objects = None, margin = 0):
+        """
+        Returns a boolean array of whether each of the given objects (0 -
+        nObjects-1, by default all objects) has a point touching either of
+        the 6 bounds of the image stack, or within margin pixels of them. The
+        bounds are tested in a single comparison over all points of the
+        objects, which is then reduced per object.
+        """
+        if objects is None:
+            objects = range(self.nObjects)
+        objects = np.asarray(objects, dtype = int)
+        pts, offsets, objIds, contIds = get_contour_arrays(self, objects,
+            scale = False)
+        lo = np.asarray([1, 1, 0]) + margin
+        hi = np.asarray([self.xMax, self.yMax, self.zMax]) - 1 - margin
+        out = ((pts[:, 0] < lo[0]) | (pts[:, 0] > hi[0]) |
+               (pts[:, 1] < lo[1]) | (pts[:, 1] > hi[1]) |
+               (pts[:, 2] <= lo[2]) | (pts[:, 2] >= hi[2]))
+
+        # Reduce the points to their object's position in objects
+        lookup = np.zeros(self.nObjects, dtype = int)
+        lookup[objects] = np.arange(len(objects))
+        ptObj = np.repeat(lookup[objIds], np.diff(offsets))
+        return np.bincount(ptObj[out], minlength = len(objects)) > 0
+
+    def findBorderArtifactObjects(self, fname, objects = None, thresh = 3,
+        nproc = None, cache_dir = None):
+        """
+        Returns a boolean array of whether each of the given objects (0 -
+        nObjects-1, by default all objects) has a point on or near an
+        alignment-induced border of the MRC file fname (see
+        removeBorderObjects).
+
+        The contours are first indexed by Z slice, such that only the slices
+        that contain contours are read, through a memory map. The distance
+        transforms of these slices are computed in a pool of nproc processes
+        (by default, one per CPU), and optionally cached to cache_dir as one
+        .npy file per slice. The points of each slice are then looked up in
+        its distance transform at once. A point is on a border if its
+        distance is <= thresh. With nproc = 1, slices are read through an
+        MrcSliceCache, which reads the next slices ahead in a background
+        thread while the current one is processed.
+
+        As in earlier versions, contours with Z value z are tested against
+        slice z of the file, counting from 1.
+        """
+        if objects is None:
+            objects = range(self.nObjects)
+        objects = np.asarray(objects, dtype = int)
+        touch = np.zeros(len(objects), dtype = bool)
+        vol = MrcVolume(fname, memmap = False)
+        nx, ny, nz = vol.nx, vol.ny, vol.nz
+
+        # Z slice of each point, and index of the points of each slice
+        pts, offsets, objIds, contIds = get_contour_arrays(self, objects,
+            scale = False)
+        nPoints = np.diff(offsets)
+        iSlices = np.repeat(get_contour_z(pts, offsets) - 1, nPoints)
+        lookup = np.zeros(self.nObjects, dtype = int)
+        lookup[objects] = np.arange(len(objects))
+        ptObj = np.repeat(lookup[objIds], nPoints)
+        order = np.argsort(iSlices, kind = 'mergesort')
+        slices = np.unique(iSlices)
+        slices = slices[(slices >= 0) & (slices < nz)]
+        starts = np.searchsorted(iSlices[order], slices, side = 'left')
+        ends = np.searchsorted(iSlices[order], slices, side = 'right')
+        cols = np.clip(pts[:, 0].astype(int) - 1, 0, nx - 1)
+        rows = np.clip(ny - pts[:, 1].astype(int), 0, ny - 1)
+
+        tasks = [(fname, iSlice, cache_dir) for iSlice in slices]
+        pool = None
+        cache = None
+        if nproc == 1 or len(tasks) < 2:
+            cache = MrcSliceCache(fname, budget = 4 * nx * ny *
+                vol.dtype.itemsize, readahead = 2)
+            dts = itertools.imap(partial(get_border_map, slices = cache),
+                tasks)
+        else:
+            pool = mp.Pool(processes = nproc)
+            dts = pool.imap(get_border_map, tasks)
+        try:
+            for iSlice, start, end, dt in zip(slices, starts, ends, dts):
+                idx = order[start:end]
+                hit = idx[dt[rows[idx], cols[idx]] <= thresh]
+                touch[ptObj[hit]] = True
+                print "Slice {0} processed.".format(iSlice + 1)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if cache is not None:
+                cache.close()
+        for i in np.flatnonzero(touch):
+            print "Remove Object {0}".format(objects[i] + 1)
+        return touch
+
+    def get_z_index(self):
+        """
+        Returns an ImodZIndex of the contours of all objects, which maps each Z
+        slice to the contours on it, across objects. The objIds and contIds
+        attributes of the index give the object and contour number (from 0)
+        of each of its entries. The index is built in a single vectorized
+        pass, and kept until objects or contours are added or removed.
+        """
+        key = (id(self.Objects), self.nObjects,
+            tuple(x.z_index_key() for x in self.Objects))
+        zindex = getattr(self, '_zindex', None)
+        if zindex is None or zindex.key != key:
+            pts, offsets, objIds, contIds = get_contour_arrays(self,
+                scale = False)
+            zindex = ImodZIndex(z = get_contour_z(pts, offsets),
+                empty = np.diff(offsets) == 0, objIds = objIds,
+                contIds = contIds, key = key)
+            self._zindex = zindex
+        return zindex
+
+    def get_slice_contours(self, z):
+        """
+        Returns a list of the (object, contour) numbers, from 0, of all
+        contours on slice z, ordered by object.
+        """
+        zindex = self.get_z_index()
+        idx = zindex.get_contours(z)
+        return zip(zindex.objIds[idx].tolist(), zindex.contIds[idx].tolist())
+
+    def getPixelScale(self):
+        """
+        Returns the (X, Y, Z) scale from model coordinates to model units.
+        """
+        return np.asarray([self.pixelSizeXY, self.pixelSizeXY,
+            self.pixelSizeZ], dtype = float)
+
+    def get_box_index(self):
+        """
+        Returns the ImodBoxIndex of the bounding boxes of the model's objects
+        and contours, brought up to date with the model's objects. Only the
+        boxes of objects whose contours have changed since the last call are
+        recomputed.
+        """
+        if getattr(self, '_boxindex', None) is None:
+            self._boxindex = ImodBoxIndex()
+        self._boxindex.update(self.Objects)
+        return self._boxindex
+
+    def query_box(self, lo, hi, level = 'object'):
+        """
+        Returns the objects whose bounding boxes intersect the box from lo =
+        (xmin, ymin, zmin) to hi = (xmax, ymax, zmax), in model (pixel)
+        coordinates.
+
+        Inputs
+        ======
+        lo, hi - Corners of the query box.
+        level  - If 'object' (default), returns an array of object numbers
+                 (0 - nObjects-1). If 'contour', tests the bounding boxes of
+                 individual contours, and returns a list of (object, contour)
+                 numbers.
+        """
+        index = self.get_box_index()
+        idx = index.query_box(lo, hi, level = level)
+        if level == 'contour':
+            return zip(index.objIds[idx].tolist(), index.contIds[idx].tolist())
+        return idx
+
+    def query_radius(self, center, r, exact = False):
+        """
+        Returns an array of the objects (0 - nObjects-1) that lie within a
+        distance r of the point center. The center is given in model (pixel)
+        coordinates, and r in model units, as specified in self.unitsStr.
+
+        By default, objects whose bounding box lies within r are returned,
+        which is a superset of the objects that have a point within r. If
+        exact is True, the points of these candidates are then tested.
+        """
+        center = np.asarray(center, dtype = float)
+        d = self.get_box_index().box_distances(center, center,
+            self.getPixelScale())
+        objects = np.flatnonzero(d <= r)
+        if exact:
+            objects = np.asarray([i for i in objects
+                if self.point_distance(i, center) <= r], dtype = int)
+        return objects
+
+    def nearest_objects(self, center, k = 1):
+        """
+        Returns the k objects closest to the point center, given in model
+        (pixel) coordinates, and their distances to it, in model units. The
+        distance of an object is that of its closest contour point. Objects
+        are visited in order of the distance of their bounding box, which is a
+        lower bound of their distance, such that the points of only a few
+        objects are tested.
+
+        Returns
+        =======
+        objects - Array of the k closest objects (0 - nObjects-1), closest
+                  first.
+        dists   - Array of their distances.
+        """
+        center = np.asarray(center, dtype = float)
+        dbox = self.get_box_index().box_distances(center, center,
+            self.getPixelScale())
+        best = []
+        for iObj in np.argsort(dbox, kind = 'mergesort'):
+            if np.isinf(dbox[iObj]):
+                break
+            if len(best) >= k and dbox[iObj] > best[-1][0]:
+                break
+            best.append((self.point_distance(iObj, center), iObj))
+            best.sort()
+            best = best[:k]
+        return (np.asarray([x[1] for x in best], dtype = int),
+            np.asarray([x[0] for x in best], dtype = float))
+
+    def point_distance(self, iObj, center):
+        """
+        Returns the distance, in model units, from the point center, in model
+        coordinates, to the closest contour point of object iObj.
+        """
+        pts, nPoints = get_object_points(self.Objects[iObj])
+        if not len(pts):
+            return float('Inf')
+        scale = self.getPixelScale()
+        return np.sqrt(((((pts - center) * scale) ** 2).sum(1)).min())
+
+    def proximity_pairs(self, d_thresh, objects = None, use_meshes = False,
+        nproc = 1):
+        """
+        Finds all pairs of objects that lie within a distance d_thresh of each
+        other. Candidate pairs are first found by comparing the bounding boxes
+        of the objects, such that only pairs whose boxes are within d_thresh
+        are tested. The minimum distance of each candidate pair is then
+        computed with a k-d tree of the points of one of the two objects.
+
+        Inputs
+        ======
+        d_thresh   - Distance threshold, in model units, as specified in
+                     self.unitsStr.
+        objects    - List of objects (0 - nObjects-1) to test against each
+                     other. By default, all objects are used.
+        use_meshes - If True, uses the mesh vertices of each object rather
+                     than its contour points.
+        nproc      - Number of processes among which to split the candidate
+                     pairs. Default is 1.
+
+        Returns
+        =======
+        P - A numpy array of size (npairs x 9), with one line for each pair
+            of objects within d_thresh, sorted by object. The columns are:
+            (1) the first object, (2) the second object, (3) their minimum
+            distance, (4-6) the X, Y, and Z coordinates of the closest point
+            of the first object, and (7-9) those of the second object. All
+            distances and coordinates are in model units, i.e. scaled by
+            pixelSizeXY and pixelSizeZ.
+        """
+        global PROXIMITY_POINTS
+        if objects is None:
+            objects = range(self.nObjects)
+        objects = np.asarray(objects, dtype = int)
+        scale = self.getPixelScale()
+        pts = []
+        for iObj in objects:
+            if use_meshes:
+                pts.append(get_vertices(self, iObj, 1) if
+                    self.Objects[iObj].nMeshes else np.zeros([0, 3]))
+            else:
+                pts.append(get_object_points(self.Objects[iObj])[0] * scale)
+
+        # Bounding boxes of the objects, in model units. Only the boxes
+        # starting before a box ends, plus d_thresh, can be within d_thresh.
+        boxes = np.asarray([np.concatenate([x.min(0), x.max(0)]) if len(x)
+            else [np.inf] * 3 + [-np.inf] * 3 for x in pts], dtype = float)
+        order = np.argsort(boxes[:, 0], kind = 'mergesort')
+        ends = np.searchsorted(boxes[order, 0], boxes[order, 3] + d_thresh,
+            side = 'right')
+        pairs = []
+        for i in range(len(order)):
+            cand = order[i+1:ends[i]]
+            if not len(cand):
+                continue
+            near = box_distance(boxes[cand], boxes[order[i], :3],
+                boxes[order[i], 3:]) <= d_thresh
+            a = np.minimum(order[i], cand[near])
+            b = np.maximum(order[i], cand[near])
+            pairs.append(np.column_stack([a, b]))
+        if not pairs:
+            return np.zeros([0, 9])
+        pairs = np.concatenate(pairs)
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+        # Minimum distance of each candidate pair. The points are made
+        # visible to the worker processes before they are started.
+        PROXIMITY_POINTS = pts
+        try:
+            chunks = np.array_split(pairs, max(1, min(len(pairs), 4 *
+                nproc)))
+            if nproc > 1:
+                pool = mp.Pool(processes = nproc)
+                try:
+                    results = pool.map(proximity_worker,
+                        [(x, d_thresh) for x in chunks])
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = [proximity_worker((x, d_thresh)) for x in chunks]
+        finally:
+            PROXIMITY_POINTS = None
+        P = np.concatenate(results)
+        P[:, 0] = objects[P[:, 0].astype(int)]
+        P[:, 1] = objects[P[:, 1].astype(int)]
+        return P
+
+    def rasterize(self, shape = None, objects = None, mode = 'label',
+        out = None, dtype = None, holes = False, nproc = 1, values = None):
+        """
+        Fills the closed contours of the given objects into a label volume,
+        e.g. to generate training labels or masks without running imodmop.
+        The volume is produced one Z slice at a time: the contours of each
+        slice are scan-filled at once (see features.contour_spans), and the
+        slices are filled in a pool of nproc processes, such that volumes can
+        be written to an MRC file without holding them in memory.
+
+        Pixel (y, x) of slice z is filled if its center, (x + 0.5, y + 0.5),
+        lies inside a contour whose Z value (see ImodObject.get_z_values) is
+        z. Each contour is filled on its own, by the even-odd rule, unless
+        holes is True, and the label of the last object is kept where objects
+        overlap. Rows are in model order, as stored in MRC files, i.e. not
+        flipped.
 
-            # Loop over all objects, and remove those that are in cdel. If remove
-            # is False, set the colors appropriately.
-            for iObj in range(self.nObjects -1, -1, -1):
-                if iObj in cdel:
-                    if remove:
-                        del(self.Objects[iObj])
-                    else:
-                        self.Objects[iObj].setColor(1, 0, 0)
+        Inputs
+        ======
+        shape   - (nz, ny, nx) shape of the volume. Default is the image size
+                  of the model, (zMax, yMax, xMax).
+        objects - List of objects (0 - nObjects-1) to fill. By default, all
+                  closed objects are filled, and open and scattered objects
+                  are skipped.
+        mode    - If 'label' (default), each object is filled with its number
+                  (1 - nObjects). If 'binary', all objects are filled with 1.
+        out     - Array of the given shape (e.g. a memory map) to overwrite,
+                  or the filename of an MRC file to write. By default, a new
+                  array is returned.
+        dtype   - Data type of the volume. Default is the smallest of uint8,
+                  uint16, and uint32 that holds the labels. MRC files have no
+                  32-bit integer mode, so 32-bit labels are written to them as
+                  float32, which holds labels up to 2^24 exactly.
+        holes   - If True, the contours of each object on a slice are filled
+                  together by the even-odd rule, such that contours inside
+                  other contours of their object are left as holes, as traced
+                  by from_labels(holes = True).
+        nproc   - Number of processes among which the slices are split.
+                  Default is 1.
+        values  - Label of each of the given objects, in place of those set
+                  by mode, e.g. the labels of a model built by from_labels
+                  ([x.label for x in model.Objects]).
+
+        Returns
+        =======
+        out - The label volume, or the filename of the MRC file.
+        """
+        if mode not in ('label', 'binary'):
+            raise ValueError('Mode must be label or binary, not {0}.'.format(
+                mode))
+        if shape is None:
+            shape = (self.zMax, self.yMax, self.xMax)
+        nz, ny, nx = shape
+        if objects is None:
+            # Bit 3 flags open objects, and bit 9 scattered objects
+            objects = [i for i in range(self.nObjects)
+                if not (get_bit(self.Objects[i].flags, 3) or
+                        get_bit(self.Objects[i].flags, 9))]
+        objects = np.asarray(objects, dtype = int)
+        if values is not None:
+            values = np.asarray(values, dtype = np.int64)
+            if values.shape != objects.shape:
+                raise ValueError('Got {0} values for {1} objects.'.format(
+                    values.size, len(objects)))
+            if len(values) and values.min() < 0:
+                raise ValueError('Label values must not be negative.')
+        elif mode == 'label':
+            values = objects + 1
+        else:
+            values = np.ones(len(objects), dtype = int)
+        if dtype is None:
+            top = values.max() if len(values) else 0
+            dtype = (np.uint8 if top < 1 << 8 else np.uint16 if top < 1 << 16
+                else np.uint32)
+        dtype = np.dtype(dtype)
+
+        # Index the contours of the objects by slice. Contours are kept in
+        # the order of objects, such that later objects are filled last.
+        pts, offsets, objIds, contIds = get_contour_arrays(self, objects,
+            scale = False)
+        nPoints = np.diff(offsets)
+        objPos = np.repeat(np.arange(len(objects)),
+            [len(self.Objects[i].Contours) for i in objects])
+        labels = values[objPos]
+        zindex = ImodZIndex(z = get_contour_z(pts, offsets),
+            empty = nPoints < 3)
+        slices = [z for z in zindex.slices.tolist() if 0 <= z < nz]
+
+        def get_tasks():
+            for z in slices:
+                idx = zindex.get_contours(z)
+                n = nPoints[idx]
+                rows = (np.repeat(offsets[idx] - np.cumsum(n) + n, n) +
+                    np.arange(n.sum()))
+                if holes:
+                    # One group per object, labeled by its first contour
+                    first, groups = np.unique(objPos[idx],
+                        return_index = True, return_inverse = True)[1:]
+                    yield (pts[rows, :2], np.concatenate([[0], np.cumsum(n)]),
+                        labels[idx][first], (ny, nx), dtype, groups)
                 else:
-                    if not remove:
-                        self.Objects[iObj].setColor(0, 1, 0)
+                    yield (pts[rows, :2], np.concatenate([[0], np.cumsum(n)]),
+                        labels[idx], (ny, nx), dtype, None)
+
+        # Output array, or MRC file written slice by slice
+        fid = None
+        if isinstance(out, basestring):
+            fname = out
+            fileDtype = dtype
+            if dtype.kind + str(dtype.itemsize) not in MRC_DTYPES:
+                fileDtype = np.dtype(np.float32)
+            pixelSpacing = self.getPixelScale()
+            if unitDict.get(self.unitsStr):
+                pixelSpacing = convert_units(pixelSpacing, self.unitsStr, 'A')
+            else:
+                pixelSpacing = (1, 1, 1)
+            mrcLabels = ['pyimod: rasterized {0}'.format(
+                os.path.basename(self.filename or '') or 'model')]
+            fid = open(fname, mode = 'wb')
+            write_mrc_header(fid, shape, fileDtype, pixelSpacing,
+                labels = mrcLabels)
+            dmin, dmax, dsum = 0, 0, 0
+        elif out is None:
+            out = np.zeros(shape, dtype = dtype)
+        elif tuple(out.shape) != tuple(shape):
+            raise ValueError('Output array of shape {0} does not match shape '
+                '{1}.'.format(out.shape, tuple(shape)))
+
+        if nproc == 1 or len(slices) < 2:
+            pool = None
+            imgs = itertools.imap(rasterize_worker, get_tasks())
+        else:
+            pool = mp.Pool(processes = nproc)
+            imgs = pool.imap(rasterize_worker, get_tasks())
+        try:
+            blank = np.zeros([ny, nx], dtype = dtype)
+            filled = set(slices)
+            for z in range(nz):
+                img = imgs.next() if z in filled else blank
+                if fid is None:
+                    out[z] = img
+                    continue
+                img = img.astype(fileDtype.newbyteorder('<'), copy = False)
+                img.tofile(fid)
+                dmin = min(dmin, img.min()) if z else img.min()
+                dmax = max(dmax, img.max()) if z else img.max()
+                dsum += img.sum(dtype = float)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if fid is not None:
+                # Back-patch the statistics of the data
+                fid.seek(0)
+                write_mrc_header(fid, shape, fileDtype, pixelSpacing,
+                    stats = (dmin, dmax, dsum / max(nx * ny * nz, 1)),
+                    labels = mrcLabels)
+                fid.close()
+                out = fname
+        return out
+
+    @classmethod
+    def from_labels(cls, volume, min_points = 3, simplify = True,
+        holes = False, nproc = 1, chunk = 16, **kwargs):
+        """
+        Builds a model from a label volume, e.g. a segmentation, with one
+        closed object per label and one contour per region of the label on
+        each slice. The boundaries of all labels of a slice are traced at
+        once along the pixel edges (see features.trace_labels). The label of
+        each object is kept as its label attribute, such that
+        rasterize(holes = True, values = [x.label for x in model.Objects])
+        on a model built with holes = True gives back the label volume
+        exactly. Without values, rasterize numbers the objects 1 - N, which
+        gives back the volume only up to relabeling its labels 1 - N in
+        ascending order. By default, the boundaries of holes are dropped, such
+        that rasterize() gives back the regions with their holes filled (with
+        the label of the region, unless the hole holds a label of a later
+        object). The slices are split into chunks of chunk slices, traced in a
+        pool of nproc processes, which read the slices of MRC files through a
+        memory map.
+
+        Inputs
+        ======
+        volume     - Label volume, as an (nz, ny, nx) or (ny, nx) array, an
+                     MrcVolume, or the filename of an MRC file. 0 is the
+                     background. Rows are in model order, as stored in MRC
+                     files.
+        min_points - Contours with fewer points are dropped. Default is 3.
+        simplify   - If True (default), contours keep only their corners.
+        holes      - If True, the boundaries of holes are kept as contours of
+                     their label, running clockwise, such that filling the
+                     contours of a label on a slice by the even-odd rule (see
+                     rasterize) leaves the holes out. By default, they are
+                     dropped.
+        nproc      - Number of processes tracing the chunks. Default is 1.
+        chunk      - Number of slices per chunk. Default is 16.
+        kwargs     - Passed to the ImodModel constructor.
+
+        Returns
+        =======
+        model - ImodModel instance, with one object per label, in ascending
+                order of label, named after their label, and with their
+                label as their label attribute. The image size is that of
+                the volume, and for MRC files, the pixel sizes are
+                set from its pixel spacing, in nm.
+        """
+        fname = None
+        if isinstance(volume, MrcVolume):
+            volume = volume.fname
+        if isinstance(volume, basestring):
+            fname = volume
+            volume = MrcVolume(fname)
+        elif volume.ndim == 2:
+            volume = volume[np.newaxis]
+        nz, ny, nx = volume.shape
+
+        # Trace the chunks of slices, passing MRC files by name, such that
+        # the worker processes map them on their own
+        tasks = [(fname if fname else volume[z:z+chunk], z, min(z + chunk, nz),
+            min_points, simplify, holes) for z in range(0, nz, chunk)]
+        if nproc == 1 or len(tasks) < 2:
+            results = map(label_contours_worker, tasks)
+        else:
+            pool = mp.Pool(processes = nproc)
+            try:
+                results = pool.map(label_contours_worker, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        labels = np.concatenate([x[0] for x in results])
+        nPoints = np.concatenate([np.diff(x[1]) for x in results])
+        pts = np.concatenate([x[2] for x in results]).astype(np.float32)
+        del results
+
+        # Group the contours by label, keeping them in order of Z
+        order = np.argsort(labels, kind = 'mergesort')
+        labels = labels[order]
+        starts = np.cumsum(nPoints) - nPoints
+        n = nPoints[order]
+        rows = np.repeat(starts[order] - np.cumsum(n) + n, n) + np.arange(
+            n.sum())
+        pts = pts[rows]
+        offsets = np.zeros(len(n) + 1, dtype = np.int64)
+        np.cumsum(n, out = offsets[1:])
+        uniq, first = np.unique(labels, return_index = True)
+        bounds = np.append(first, len(labels))
+
+        model = cls(**kwargs)
+        model.setImageSize(nx, ny, nz)
+        if fname:
+            spacing = volume.pixelSpacing
+            if all(x > 0 for x in spacing):
+                model.setUnits('nm')
+                model.setPixelSizeXY(spacing[0] / 10)
+                model.setPixelSizeZ(spacing[2] / 10)
+        for label, a, b in zip(uniq, bounds[:-1], bounds[1:]):
+            model.addObject()
+            obj = model.Objects[-1]
+            obj.setName('Label {0}'.format(label))
+            obj.label = int(label)
+            obj.Contours = ImodContourArray(
+                points = pts[offsets[a]:offsets[b]],
+                offsets = offsets[a:b+1] - offsets[a])
+            obj.nContours = b - a
+        return model
+
+    def sample_intensities(self, mrc, objects = None, stats = ('mean', 'std',
+        'min', 'max'), level = 'contour', bins = 16, hist_range = None):
+        """
+        Computes statistics of the intensities of an MRC file inside and
+        along the contours of the given objects. The contours are indexed by
+        Z slice, such that each slice is read once, for all objects on it,
+        and only the window spanned by the contours of the slice is read
+        from the memory map of the file.
+
+        The interior of a contour is the set of pixels whose centers lie
+        inside it (see features.contour_spans), and its boundary is sampled
+        at intervals of at most one pixel along its edges (see
+        features.contour_samples), taking the value of the pixel under each
+        sample. Contours are treated as closed, and those with Z value z (see
+        ImodObject.get_z_values) are sampled on slice z (0 - nz-1) of the
+        file. Rows are in model order, as stored in MRC files.
 
-            # Update the number of objects and views, if remove is True.
-            if remove:
-                self.nObjects -= len(cdel)
-                if self.view_set:
-                    self.view_objvsize -= len(cdel)
+        Inputs
+        ======
+        mrc        - Filename of the MRC file, or an MrcVolume.
+        objects    - List of objects (0 - nObjects-1) to sample. By default,
+                     all objects are sampled.
+        stats      - Statistics to compute, from INTENSITY_STATS: 'mean',
+                     'std' (population standard deviation), 'min', 'max',
+                     and 'hist' (histogram of the values). Default is
+                     ('mean', 'std', 'min', 'max').
+        level      - If 'contour' (default), computes the statistics of each
+                     contour. If 'object', pools the values of all contours
+                     of each object.
+        bins       - Number of bins of the histograms, or the array of their
+                     edges. Default is 16.
+        hist_range - (min, max) range of the histogram bins, if bins is a
+                     number. Default is the (dmin, dmax) range of the MRC
+                     header.
+
+        Returns
+        =======
+        T - A numpy array with one line per contour (or object), in order.
+            The columns are: (1) the object index, (2) for the contour level,
+            the contour index within the object, then, for the interior and
+            then for the boundary of the contours, the number of values and
+            the statistics, in the order of stats, with one column per bin for
+            'hist'. Statistics of contours (or objects) without values are
+            NaN.
+        """
+        for stat in stats:
+            if stat not in INTENSITY_STATS:
+                raise ValueError('{0} is not a valid statistic.'.format(stat))
+        if level not in ('contour', 'object'):
+            raise ValueError('Level must be contour or object, not {0}.'.format(
+                level))
+        vol = mrc if isinstance(mrc, MrcVolume) else MrcVolume(mrc)
+        nz, ny, nx = vol.shape
+        if 'hist' in stats:
+            if np.ndim(bins):
+                edges = np.asarray(bins, dtype = float)
+            else:
+                lo, hi = hist_range if hist_range is not None else \
+                    (vol.dmin, vol.dmax)
+                if not lo < hi:
+                    raise ValueError('Invalid histogram range ({0}, {1}). Set '
+                        'hist_range.'.format(lo, hi))
+                edges = np.linspace(lo, hi, bins + 1)
+            nBins = len(edges) - 1
+        else:
+            nBins = 0
+
+        if objects is None:
+            objects = range(self.nObjects)
+        objects = np.asarray(objects, dtype = int)
+        pts, offsets, objIds, contIds = get_contour_arrays(self, objects,
+            scale = False)
+        nPoints = np.diff(offsets)
+        ncont = len(nPoints)
+        zindex = ImodZIndex(z = get_contour_z(pts, offsets),
+            empty = nPoints == 0)
+
+        # Count, sum, sum of squares, minimum, maximum, and histogram of the
+        # interior (0) and boundary (1) values of each contour
+        N = np.zeros([2, ncont])
+        S = np.zeros([2, ncont])
+        S2 = np.zeros([2, ncont])
+        vmin = np.zeros([2, ncont]) + float('Inf')
+        vmax = np.zeros([2, ncont]) - float('Inf')
+        H = np.zeros([2, ncont, nBins])
+
+        def accumulate(k, idx, local, v):
+            # Values v of the contours idx[local], sorted by local
+            m = len(idx)
+            N[k, idx] += np.bincount(local, minlength = m)
+            S[k, idx] += np.bincount(local, weights = v, minlength = m)
+            S2[k, idx] += np.bincount(local, weights = v * v, minlength = m)
+            if len(v):
+                starts = np.flatnonzero(np.concatenate([[True],
+                    local[1:] != local[:-1]]))
+                u = idx[local[starts]]
+                vmin[k, u] = np.minimum(vmin[k, u], np.minimum.reduceat(v,
+                    starts))
+                vmax[k, u] = np.maximum(vmax[k, u], np.maximum.reduceat(v,
+                    starts))
+            if nBins:
+                b = np.searchsorted(edges, v, side = 'right') - 1
+                b[v == edges[-1]] = nBins - 1
+                ok = (b >= 0) & (b < nBins)
+                H[k, idx] += np.bincount(local[ok] * nBins + b[ok],
+                    minlength = m * nBins).reshape(m, nBins)
+
+        for z in zindex.slices:
+            if not 0 <= z < nz:
+                continue
+            idx = zindex.get_contours(z)
+            n = nPoints[idx]
+            rows = (np.repeat(offsets[idx] - np.cumsum(n) + n, n) +
+                np.arange(n.sum()))
+            p = pts[rows, :2]
+            off = np.concatenate([[0], np.cumsum(n)])
+
+            # Window of the slice spanned by its contours
+            lo = np.clip(np.floor(p.min(0)).astype(int), 0, [nx, ny])
+            hi = np.clip(np.floor(p.max(0)).astype(int) + 1, 0, [nx, ny])
+            if (hi <= lo).any():
+                continue
+            win = np.asarray(vol.data[z, lo[1]:hi[1], lo[0]:hi[0]],
+                dtype = float)
+            p = p - lo
+
+            cid, r, c0, c1 = contour_spans(p, off, win.shape)
+            run, r, c = span_pixels(r, c0, c1)
+            accumulate(0, idx, cid[run], win[r, c])
+
+            cid, x, y = contour_samples(p, off)
+            c = np.floor(x).astype(int)
+            r = np.floor(y).astype(int)
+            ok = (c >= 0) & (c < win.shape[1]) & (r >= 0) & (r < win.shape[0])
+            accumulate(1, idx, cid[ok], win[r[ok], c[ok]])
+
+        # Pool the values of the contours of each object
+        if level == 'object':
+            lookup = np.zeros(self.nObjects, dtype = int)
+            lookup[objects] = np.arange(len(objects))
+            g = lookup[objIds]
+            reduced = []
+            for A, ufunc, init in [(N, np.add, 0), (S, np.add, 0),
+                (S2, np.add, 0), (vmin, np.minimum, float('Inf')),
+                (vmax, np.maximum, -float('Inf')), (H, np.add, 0)]:
+                B = np.zeros((2, len(objects)) + A.shape[2:]) + init
+                for k in range(2):
+                    ufunc.at(B[k], g, A[k])
+                reduced.append(B)
+            N, S, S2, vmin, vmax, H = reduced
+            cols = [objects]
+        else:
+            cols = [objIds, contIds]
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            for k in range(2):
+                mean = S[k] / N[k]
+                cols.append(N[k])
+                for stat in stats:
+                    if stat == 'mean':
+                        cols.append(mean)
+                    elif stat == 'std':
+                        cols.append(np.sqrt(np.maximum(S2[k] / N[k] - mean ** 2,
+                            0)))
+                    elif stat == 'min':
+                        cols.append(np.where(N[k] > 0, vmin[k], np.nan))
+                    elif stat == 'max':
+                        cols.append(np.where(N[k] > 0, vmax[k], np.nan))
+                    elif stat == 'hist':
+                        cols.append(H[k])
+        return np.column_stack(cols)
 
     def mergeAll(self):
         """
@@ -947,7 +1943,7 @@ def get_vertices(model, iObject, skip):
     if len(model.Objects[iObject].Meshes) > 1:
         raise valueError('Object {0} has more than 1 mesh'.format(iObject))
     v = np.array(model.Objects[iObject].Meshes[0].vertices)
-    v = v.reshape(v.shape[0]/3, 3)
+    v = v.reshape(-1, 3)
     v = v[0::2]
     v = v[0::skip]
     v = np.array([model.pixelSizeXY, model.pixelSizeXY, model.pixelSizeZ] * v)
@@ -955,22 +1951,166 @@ def get_vertices(model, iObject, skip):
 
 def get_points(model, iObject, iContour, skip):
     p = np.array(model.Objects[iObject].Contours[iContour].points)
-    p = p.reshape(p.shape[0]/3, 3)
+    p = p.reshape(-1, 3)
     p = p[0::skip]
     p = np.array([model.pixelSizeXY, model.pixelSizeXY, model.pixelSizeZ] * p)
     return p
 
-def calc_min_dist(pts_ref, pts_test):
+def build_tree(pts):
+    """
+    Returns a k-d tree of the (N x 3) array of points pts, for nearest
+    neighbor queries.
+    """
+    from scipy.spatial import cKDTree
+    return cKDTree(pts)
+
+def calc_min_dist(pts_ref, pts_test, d_upper = None, block = 4096):
+    """
+    Returns the minimum Euclidean distance between two sets of points.
+
+    Inputs
+    ======
+    pts_ref  - Reference points, as an (N x 3) array or a k-d tree of them
+               (see build_tree).
+    pts_test - (M x 3) array of test points.
+    d_upper  - If given, distances are only resolved up to d_upper: the test
+               points are queried in blocks of block points, stopping at the
+               first block containing a distance smaller than d_upper, and
+               inf is returned if no distance is at most d_upper.
+
+    Returns
+    =======
+    d_min - The minimum distance, or inf if pts_test is empty.
+    """
+    tree = pts_ref if hasattr(pts_ref, 'query') else build_tree(pts_ref)
+    pts_test = np.asarray(pts_test).reshape(-1, 3)
+    if d_upper is None:
+        block = max(len(pts_test), 1)
     d_min = float('Inf')
-    for i in range(0, pts_test.shape[0] - 1):
-        d = cdist(pts_ref, pts_test[[i, i+1]], 'euclidean')
-        d = np.reshape(d, d.shape[0] * d.shape[1], 1)
-        d_min_idx = np.argmin(d)
-        d_min_i = d[d_min_idx]
-        if d_min_i < d_min:
-            d_min = d_min_i
+    for i in range(0, len(pts_test), block):
+        d_min = min(d_min, query_tree(tree, pts_test[i:i+block],
+            d_upper).min())
+        if d_upper is not None and d_min < d_upper:
+            break
     return d_min
 
+def calc_min_dists(pts_ref, pts_test, d_upper = None):
+    """
+    Returns an array of the minimum Euclidean distance between the reference
+    points and each of a list of sets of test points, such as the points of
+    the contours of an object, computed with a single k-d tree query. The
+    inputs are as for calc_min_dist, with pts_test being a list of (M x 3)
+    arrays.
+    """
+    tree = pts_ref if hasattr(pts_ref, 'query') else build_tree(pts_ref)
+    n = np.asarray([len(x) for x in pts_test], dtype = np.int64)
+    d_min = np.empty(len(n))
+    d_min.fill(float('Inf'))
+    if not n.sum():
+        return d_min
+    d = query_tree(tree, np.concatenate([np.asarray(x).reshape(-1, 3)
+        for x in pts_test]), d_upper)
+    starts = np.cumsum(n) - n
+    nonempty = n > 0
+    d_min[nonempty] = np.minimum.reduceat(d, starts[nonempty])
+    return d_min
+
+def query_tree(tree, pts, d_upper = None):
+    """
+    Returns the distance of each point of pts to its nearest neighbor in
+    tree. If d_upper is given, distances greater than d_upper are returned as
+    inf.
+    """
+    if d_upper is None:
+        return tree.query(pts, k = 1)[0]
+    # The upper bound of cKDTree excludes distances equal to it
+    return tree.query(pts, k = 1,
+        distance_upper_bound = np.nextafter(d_upper, float('Inf')))[0]
+
+def proximity_worker(args):
+    """
+    Computes the minimum distance and closest points of a chunk of candidate
+    pairs for ImodModel.proximity_pairs, given a tuple of the (n x 2) array
+    of pairs of positions in PROXIMITY_POINTS, and the distance threshold.
+    Returns the lines of the pairs within the threshold.
+    """
+    pairs, d_thresh = args
+    trees = {}
+    P = []
+    for a, b in pairs:
+        # Query the points of the smaller object against a tree of the larger
+        pa, pb = PROXIMITY_POINTS[a], PROXIMITY_POINTS[b]
+        if not len(pa) or not len(pb):
+            continue
+        swap = len(pa) > len(pb)
+        ref, test = (a, b) if swap else (b, a)
+        if ref not in trees:
+            trees[ref] = build_tree(PROXIMITY_POINTS[ref])
+        d, idx = trees[ref].query(PROXIMITY_POINTS[test], k = 1,
+            distance_upper_bound = np.nextafter(d_thresh, float('Inf')))
+        i = np.argmin(d)
+        if np.isinf(d[i]):
+            continue
+        p_test = PROXIMITY_POINTS[test][i]
+        p_ref = PROXIMITY_POINTS[ref][idx[i]]
+        p_a, p_b = (p_ref, p_test) if swap else (p_test, p_ref)
+        P.append(np.concatenate([[a, b, d[i]], p_a, p_b]))
+    return np.asarray(P, dtype = float).reshape(-1, 9)
+
+def rasterize_worker(args):
+    """
+    Fills the contours of one slice for ImodModel.rasterize, given a tuple of
+    the (N x 2) array of their X and Y coordinates, their offsets, their
+    labels, the (ny, nx) shape of the slice, its data type, and the group of
+    each contour, or None (see features.fill_contours).
+    """
+    pts, offsets, labels, shape, dtype, groups = args
+    return fill_contours(pts, offsets, labels, shape, dtype = dtype,
+        groups = groups)
+
+def label_contours_worker(args):
+    """
+    Traces the label boundaries of a chunk of slices for
+    ImodModel.from_labels, given a tuple of the MRC filename (or the array of
+    the chunk's slices), the first and last + 1 slice of the chunk, and the
+    min_points, simplify, and holes arguments. Returns the labels, offsets,
+    and (N x 3) points of the contours of the chunk, in order of Z.
+    """
+    source, z0, z1, min_points, simplify, holes = args
+    if isinstance(source, basestring):
+        source = MrcVolume(source).data[z0:z1]
+    labels, nPoints, pts = [], [], []
+    for z in range(z0, z1):
+        labels_z, offsets_z, pts_z = trace_labels(source[z - z0],
+            simplify = simplify, holes = holes)
+        n = np.diff(offsets_z)
+        keep = n >= min_points
+        labels.append(labels_z[keep])
+        nPoints.append(n[keep])
+        pts_z = pts_z[np.repeat(keep, n)]
+        pts.append(np.column_stack([pts_z, np.repeat(float(z), len(pts_z))]))
+    nPoints = np.concatenate(nPoints)
+    offsets = np.zeros(len(nPoints) + 1, dtype = np.int64)
+    np.cumsum(nPoints, out = offsets[1:])
+    return np.concatenate(labels), offsets, np.concatenate(pts)
+
+def dist_str(d, d_thresh):
+    """
+    Formats a minimum distance for printing, where inf denotes a distance
+    that was only resolved to be greater than d_thresh.
+    """
+    if np.isinf(d):
+        return '> {0}'.format(d_thresh)
+    return '= {0}'.format(d)
+
+def check_op(compStr):
+    """
+    Checks that compStr is a valid comparison operator of opsDict.
+    """
+    is_string(compStr, 'Comparison string')
+    if not opsDict.has_key(compStr):
+        raise ValueError('{0} is not a valid operator'.format(compStr))
+
 def parse_obj_list(objs):
     objs = objs.split(',')
     lst = []
@@ -996,6 +2136,45 @@ def parse_name_str(nstr):
     else:
         raise ValueError('Invalid name string {0}'.format(nstr))
 
+def get_border_map(args, slices = None):
+    """
+    Returns the border distance transform (see proc_border) of a slice of an
+    MRC file, given a tuple of the file name, the slice index (0 - nz-1), and
+    a cache directory (or None). If a cache directory is given, the distance
+    transform is read from it if present, and saved to it otherwise. Cached
+    files are named after the MRC file, its size and modification time, and
+    the slice index, so that they are not reused once the file changes.
+    Slices are read from slices, an MrcSliceCache of the file, if given.
+    """
+    fname, iSlice, cache_dir = args
+    fcache = None
+    if cache_dir:
+        st = os.stat(fname)
+        fcache = os.path.join(cache_dir, '{0}_{1}_{2}_{3}.npy'.format(
+            os.path.basename(fname), st.st_size, int(st.st_mtime),
+            str(iSlice).zfill(5)))
+        if os.path.isfile(fcache):
+            return np.load(fcache)
+
+    # Flip the slice vertically, as in mrc_to_numpy
+    if slices is not None:
+        img = slices[iSlice]
+    else:
+        img = MrcVolume(fname).get_slice(iSlice)
+    dt = np.minimum(proc_border(np.ascontiguousarray(img)), 255).astype(
+        'uint8')
+
+    if fcache:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # Write to a temporary file first, such that concurrent runs never
+        # read a partially written map
+        ftmp = '{0}.{1}.tmp'.format(fcache, os.getpid())
+        with open(ftmp, 'wb') as fid:
+            np.save(fid, dt)
+        os.rename(ftmp, fcache)
+    return dt
+
 def proc_border(img):
     import cv2
     
@@ -1035,3 +2214,37 @@ def convert_units(val_in, units_in, units_out, exp = 1):
 
     val_out = val_in * ((10 ** -exp_out) / (10 ** -exp_in)) ** exp 
     return val_out
+
+def iter_objects(fname, with_meshes = False, views = True, sidecar = False,
+    debug = 0):
+    """
+    Generator that reads the objects of an IMOD model file one at a time, and
+    yields each as a fully parsed ImodObject. Only the object being yielded is
+    held by the generator, such that per-object analyses can run over models
+    that are much larger than memory. The objects are located with the
+    model's chunk index (see ImodIndex).
+
+    Inputs
+    ======
+    fname       - Filename of the IMOD model file.
+    with_meshes - If False, mesh chunks are seeked past, and objects are
+                  yielded without meshes (nMeshes = 0).
+    views       - If True, each object's VIEW data is read as well.
+    sidecar     - If True, the chunk index is loaded from or saved to a
+                  sidecar file next to the model file.
+
+    Returns
+    =======
+    Generator of ImodObject instances, in file order.
+    """
+    index = ImodIndex(fname, sidecar = sidecar)
+    with open(fname, mode = "rb") as fid:
+        for iObject in range(index.nObjects):
+            fid.seek(index.objOffsets[iObject], 0)
+            obj = ImodObject(fid, debug = debug, meshes = with_meshes)
+            if views and index.view_offset(iObject) >= 0:
+                fid.seek(index.view_offset(iObject), 0)
+                obj.Views.append(ImodView(fid))
+            obj.fid = None
+            yield obj
+            del obj
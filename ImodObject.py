@@ -2,12 +2,16 @@ from __future__ import division
 
 import os
 import struct
-import operator
 import numpy as np
 from itertools import count
 from .ImodContour import ImodContour
+from .ImodContourArray import ImodContourArray, read_contour_chunk
 from .ImodMesh import ImodMesh
+from .ImodZIndex import ImodZIndex
+from .features import get_object_points, get_contour_z
 from .utils import is_integer, is_string, set_bit, get_bit
+from .binspec import (OBJECT_HEADER, OBJECT_HEADER_FIELDS, CONTOUR_HEADER,
+    IMAT, IMAT_FIELDS, unpack_fields, cstr)
 
 class ImodObject(object):
     _ids = count(0)
@@ -55,10 +59,19 @@ class ImodObject(object):
         chunkID = 0,
         mepa_set = 0,
         mepa_nBytes = 0,
+        mmap = False,
+        payload = True,
+        meshes = True,
+        z_range = None,
+        compact = False,
+        loader = None,
         **kwargs):
             self.id = self._ids.next()
-            self.Contours = []
-            self.Meshes = []
+            self._Contours = []
+            self._Meshes = []
+            self._zindex = None
+            self._zversion = 0
+            self.pinned = False
             self.Views = []
             self.mepa_byteString = []
             self.__dict__.update(kwargs)
@@ -71,40 +84,28 @@ class ImodObject(object):
 
     def read_file(self):
         fid = self.fid
-        data = fid.read(64)
-        self.name = data[4:-1].split('\x00')[0]
-        fid.seek(68, 1)
-        self.nContours = struct.unpack('>l', fid.read(4))[0]
-        self.flags = struct.unpack('>I', fid.read(4))[0]
-        self.axis = struct.unpack('>l', fid.read(4))[0]
-        self.drawMode = struct.unpack('>l', fid.read(4))[0]
-        self.red = struct.unpack('>f', fid.read(4))[0]
-        self.green = struct.unpack('>f', fid.read(4))[0]
-        self.blue = struct.unpack('>f', fid.read(4))[0]
-        self.pdrawsize = struct.unpack('>l', fid.read(4))[0]
-        self.symbol = struct.unpack('>B', fid.read(1))[0]
-        self.symbolSize = struct.unpack('>B', fid.read(1))[0]
-        self.lineWidth2D = struct.unpack('>B', fid.read(1))[0]
-        self.lineWidth3D = struct.unpack('>B', fid.read(1))[0]
-        self.lineStyle = struct.unpack('>B', fid.read(1))[0] 
-        self.symbolFlags = struct.unpack('>B', fid.read(1))[0]
-        self.sympad = struct.unpack('>B', fid.read(1))[0]
-        self.transparency = struct.unpack('>B', fid.read(1))[0]
-        self.nMeshes = struct.unpack('>l', fid.read(4))[0]
-        self.nSurfaces = struct.unpack('>l', fid.read(4))[0]
- 
-        iContour = 1
-        iMesh = 1
-        while ( iContour <= self.nContours ) or ( iMesh <= self.nMeshes ):
-            datatype = fid.read(4)
-            if self.debug == 1:
-                print datatype
-            if datatype == 'CONT':
-                self.Contours.append(ImodContour(fid, debug = self.debug))
-                iContour += 1
-            elif datatype == 'MESH':
-                self.Meshes.append(ImodMesh(fid, debug = self.debug))
-                iMesh += 1
+        fid.seek(4, 1)
+        header, _ = unpack_fields(OBJECT_HEADER, OBJECT_HEADER_FIELDS,
+            fid.read(OBJECT_HEADER.size))
+        self.__dict__.update(header)
+        self.name = cstr(self.name[:64])
+
+        # If payload is False, only the header is read. Contour and mesh
+        # chunks are seeked past, and are left to be parsed by the loader on
+        # first access of Contours or Meshes.
+        if self.payload:
+            self._Contours, self._Meshes = read_payload(fid, self.nContours,
+                self.nMeshes, debug = self.debug, mmap = self.mmap,
+                skip_meshes = not self.meshes, z_range = self.z_range,
+                compact = self.compact)
+            # If meshes is False or z_range is set, the skipped chunks are
+            # seeked past and the object is read as if it did not have them.
+            self.nContours = len(self._Contours)
+            self.nMeshes = len(self._Meshes)
+        else:
+            skip_payload(fid, self.nContours, self.nMeshes)
+            self._Contours = None
+            self._Meshes = None
 
         while True:
             datatype = fid.read(4)
@@ -133,6 +134,116 @@ class ImodObject(object):
 
         return self
 
+    @property
+    def Contours(self):
+        if self._Contours is None:
+            self.load_payload()
+        return self._Contours
+
+    @Contours.setter
+    def Contours(self, contours):
+        self._Contours = contours
+        self.pinned = True
+
+    @property
+    def Meshes(self):
+        if self._Meshes is None:
+            self.load_payload()
+        return self._Meshes
+
+    @Meshes.setter
+    def Meshes(self, meshes):
+        self._Meshes = meshes
+        self.pinned = True
+
+    def is_compact(self):
+        """
+        Returns True if the object's contours are held in an ImodContourArray.
+        """
+        return isinstance(self._Contours, ImodContourArray)
+
+    def compact_contours(self):
+        """
+        Converts the object's contours to the compact, columnar storage of
+        ImodContourArray, in which Contours[i] returns a lightweight view of
+        contour i.
+        """
+        if not self.is_compact():
+            self.Contours = ImodContourArray.from_contours(self.Contours)
+        return self
+
+    def expand_contours(self):
+        """
+        Converts compactly stored contours back to a list of ImodContour
+        instances.
+        """
+        if self.is_compact():
+            self.Contours = self.Contours.to_contours()
+        return self
+
+    def compress_contours(self, keep):
+        """
+        Keeps only the contours for which the boolean array keep is True, in a
+        single pass over the object's contours.
+        """
+        keep = np.asarray(keep, dtype = bool)
+        if not keep.all():
+            if self.is_compact():
+                self.Contours.compress(keep)
+            else:
+                self.Contours = [x for x, k in zip(self.Contours, keep) if k]
+        self.nContours = len(self.Contours)
+        return self
+
+    def get_npoints(self):
+        """
+        Returns an array of the number of points of each contour.
+        """
+        if self.is_compact():
+            return self.Contours.nPoints
+        return np.asarray([x.nPoints for x in self.Contours], dtype = int)
+
+    def is_loaded(self):
+        """
+        Returns True if the object's contours and meshes are in memory.
+        """
+        return self._Contours is not None and self._Meshes is not None
+
+    def load_payload(self):
+        """
+        Parses the contours and meshes of an object whose header was read with
+        payload = False, using the object's loader. The loader is a callable
+        that takes the object and returns its lists of contours and meshes.
+        """
+        if self.loader is None:
+            raise ValueError('Object has no loader for its contours and '
+                'meshes.')
+        contours, meshes = self.loader(self)
+        if self._Contours is None:
+            self._Contours = contours
+            self.nContours = len(contours)
+        if self._Meshes is None:
+            self._Meshes = meshes
+            self.nMeshes = len(meshes)
+        return self
+
+    def unload_payload(self):
+        """
+        Drops the contours and meshes of a lazily loaded object, such that they
+        are parsed from file again on next access. Objects without a loader,
+        pinned objects, and objects whose Contours or Meshes have been
+        reassigned or resized are left untouched. Returns True if the payload
+        was dropped.
+        """
+        if self.loader is None or self.pinned or not self.is_loaded():
+            return False
+        if (len(self._Contours) != self.nContours or
+            len(self._Meshes) != self.nMeshes):
+            return False
+        self._Contours = None
+        self._Meshes = None
+        return True
+
     def read_clip(self, fid):
         """  
         Skip reading of CLIP data chunks 
@@ -142,19 +253,8 @@ class ImodObject(object):
 
     def read_imat(self, fid):
         fid.seek(4, 1)
-        self.ambient = struct.unpack('>B', fid.read(1))[0]
-        self.diffuse = struct.unpack('>B', fid.read(1))[0]
-        self.specular = struct.unpack('>B', fid.read(1))[0]
-        self.shininess = struct.unpack('>B', fid.read(1))[0]
-        self.fillred = struct.unpack('>B', fid.read(1))[0]
-        self.fillgreen = struct.unpack('>B', fid.read(1))[0]
-        self.fillblue = struct.unpack('>B', fid.read(1))[0]
-        self.quality = struct.unpack('>B', fid.read(1))[0]
-        self.mat2 = struct.unpack('>l', fid.read(4))[0] 
-        self.valblack = struct.unpack('>B', fid.read(1))[0]
-        self.valwhite = struct.unpack('>B', fid.read(1))[0]
-        self.matflags2 = struct.unpack('>B', fid.read(1))[0]
-        self.mat3b3 = struct.unpack('>B', fid.read(1))[0]
+        imat, _ = unpack_fields(IMAT, IMAT_FIELDS, fid.read(IMAT.size))
+        self.__dict__.update(imat)
         return self
 
     def addContour(self):
@@ -286,39 +386,78 @@ class ImodObject(object):
         if not ops.has_key(compStr):
             raise ValueError('{0} is not a valid operator'.format(compStr))
 
-        # Loop to check for nPoints conditional statement
-        c = 0 
-        ckeep = 0 
-        while c < self.nContours:
-            if not ops[compStr] (self.Contours[ckeep].nPoints, nPoints):
-                del(self.Contours[ckeep]) 
-            else:
-                ckeep+=1
-            c+=1
-
-        # Update # of objects
-        self.nContours = len(self.Contours)
-        return self
+        # Evaluate the nPoints conditional statement for all contours, and
+        # remove those that fail it in a single pass
+        return self.compress_contours(ops[compStr] (self.get_npoints(),
+            nPoints))
 
     def sortContours(self):
-        # Determine the Z value of each contour.
-        zunique = [] 
-        for i in range(0, self.nContours):
-            zcoords_i = [round(x) for x in self.Contours[i].points[2::3]]
-            zunique_i = list(set(zcoords_i))
-            if len(zunique_i) > 1:
-                return self
+        # Determine the Z value of each contour. Contours whose points do not
+        # all lie on the same (rounded) Z value are left unsorted.
+        pts, nPoints = get_object_points(self)
+        if not len(nPoints):
+            return self
+        if (nPoints == 0).any():
+            return self
+        z = np.round(pts[:, 2])
+        starts = np.cumsum(nPoints) - nPoints
+        zmin = np.minimum.reduceat(z, starts)
+        if (zmin != np.maximum.reduceat(z, starts)).any():
+            return self
+
+        # Re-order the contours by their Z value, keeping the order of
+        # contours on the same slice
+        order = np.argsort(zmin, kind = 'mergesort')
+        if (order != np.arange(len(order))).any():
+            if self.is_compact():
+                self.Contours.take(order)
             else:
-                zunique_i = zunique_i[0] 
-            zunique.append(zunique_i)
-        # Sort the unique Z values of the object. 
-        zsort = sorted(enumerate(zunique), key = operator.itemgetter(1)) 
+                self.Contours = [self.Contours[i] for i in order]
+        return self
 
-        # Re-order the contours accordingly
-        contours_new = []
-        for i in range(0, len(zsort)):
-            contours_new.append(self.Contours[zsort[i][0]])
-        self.Contours = contours_new
+    def z_index_key(self):
+        """
+        Returns a key that changes whenever the object's contours are
+        reassigned, added, or removed, have their points reassigned, or when
+        invalidate_z_index() is called, against which its Z index (and the model's bounding box index) is
+        checked. Compactly stored contours are tracked by the version of their
+        ImodContourArray. Lists of contours are tracked by the identity of
+        each contour and of its points, and by the number of points.
+        """
+        contours = self.Contours
+        if isinstance(contours, ImodContourArray):
+            return ContourKey([contours], (self._zversion, len(contours),
+                contours.version))
+        refs = [contours]
+        sizes = [self._zversion, len(contours)]
+        for c in contours:
+            refs.append(c)
+            refs.append(c.points)
+            sizes.append(len(c.points))
+        return ContourKey(refs, tuple(sizes))
+
+    def get_z_index(self):
+        """
+        Returns the ImodZIndex of the object's contours, which maps each Z
+        slice to the contours on it. The index is built in a single pass over
+        the contour points on first use, and kept until the contours change.
+        """
+        key = self.z_index_key()
+        if self._zindex is None or self._zindex.key != key:
+            pts, nPoints = get_object_points(self)
+            offsets = np.zeros(len(nPoints) + 1, dtype = np.int64)
+            np.cumsum(nPoints, out = offsets[1:])
+            self._zindex = ImodZIndex(z = get_contour_z(pts, offsets),
+                empty = nPoints == 0, key = key)
+        return self._zindex
+
+    def invalidate_z_index(self):
+        """
+        Drops the object's Z index, e.g. after editing contour points in
+        place, and marks the object as changed for the model's indices.
+        """
+        self._zindex = None
+        self._zversion += 1
 
     def get_z_values(self):
         """
@@ -329,38 +468,134 @@ class ImodObject(object):
         =======
         z - A (1 x ncont) list containing the unique z value of each contour.
         """
-        z = []
-        for iCont in range(self.nContours):
-            z.append(np.unique([int(x) for x in 
-                self.Contours[iCont].points[2::3]]).tolist()[0])
-        return z
+        return self.get_z_index().z.tolist()
 
     def get_contours_per_z(self):
         """
         Returns a list in which each entry is the number of contours on a given
         z slice of the object, sorted in ascending order
         """
-        z = np.asarray(self.get_z_values())
-        contlist = []
-        for i in range(z[0], z[-1]+1):
-            idx = np.where(z == i)
-            contlist.append(len(idx[0]))
-        return contlist
+        return self.get_z_index().get_counts().tolist()
 
     def hasMissingSlices(self):
         """ 
         Returns True if the object has contours on all slices ranging from Zmin
         to Zmax. Otherwise, returns False.
         """
-        zvals = self.get_z_values()
-        zvals_unique = sorted(np.unique(zvals))
-        zmin = zvals_unique[0]
-        zmax = zvals_unique[-1]
-        comp = np.asarray(range(zmin, zmax+1))
-        return np.array_equal(zvals_unique, comp)
+        return self.get_z_index().is_contiguous()
 
     def dump(self):
         from collections import OrderedDict as od
         for key, value in od(sorted(self.__dict__.items())).iteritems():
             print key, value
         print "\n"
+
+def read_payload(fid, nContours, nMeshes, debug = 0, mmap = False,
+    skip_meshes = False, z_range = None, compact = False):
+    """
+    Parses the nContours CONT and nMeshes MESH chunks that follow an OBJT
+    header, and returns them as lists of ImodContour and ImodMesh instances.
+    If skip_meshes is True, the MESH chunks are seeked past and an empty list
+    of meshes is returned. If z_range = (zmin, zmax) is given, only contours
+    whose first point lies within zmin <= z <= zmax are parsed, and all other
+    contours are seeked past. If compact is True, the contours are returned
+    as an ImodContourArray, without creating an ImodContour for each.
+    """
+    contours = []
+    meshes = []
+    chunks = []
+    iContour = 0
+    iMesh = 0
+    while iContour < nContours or iMesh < nMeshes:
+        datatype = fid.read(4)
+        if debug == 1:
+            print datatype
+        if datatype == 'CONT':
+            if z_range is not None and not contour_in_z_range(fid, z_range):
+                skip_contour(fid)
+            elif compact:
+                chunks.append(read_contour_chunk(fid, mmap = mmap))
+            else:
+                contours.append(ImodContour(fid, debug = debug, mmap = mmap))
+            iContour += 1
+        elif datatype == 'MESH':
+            if skip_meshes:
+                skip_mesh(fid)
+            else:
+                meshes.append(ImodMesh(fid, debug = debug, mmap = mmap))
+            iMesh += 1
+    if compact:
+        headers, points, sizes = zip(*chunks) if chunks else ([], [], [])
+        contours = ImodContourArray.from_chunks(headers, points, sizes)
+    return contours, meshes
+
+def skip_payload(fid, nContours, nMeshes):
+    """
+    Seeks past the nContours CONT (and their SIZE) chunks and nMeshes MESH
+    chunks that follow an OBJT header, reading only their headers.
+    """
+    iContour = 0
+    iMesh = 0
+    while iContour < nContours or iMesh < nMeshes:
+        datatype = fid.read(4)
+        if datatype == 'CONT':
+            skip_contour(fid)
+            iContour += 1
+        elif datatype == 'MESH':
+            skip_mesh(fid)
+            iMesh += 1
+
+class ContourKey(object):
+    """
+    Key of the contents of an object's contours (see
+    ImodObject.z_index_key). Two keys are equal if they refer to the same
+    contour and point objects, and have the same sizes. The key holds
+    references to these objects, such that their ids cannot be reused while
+    an index built against it exists.
+    """
+    __slots__ = ('refs', 'sizes')
+
+    def __init__(self, refs, sizes):
+        self.refs = refs
+        self.sizes = sizes
+
+    def __eq__(self, other):
+        return (isinstance(other, ContourKey) and self.sizes == other.sizes and
+            len(self.refs) == len(other.refs) and
+            all(a is b for a, b in zip(self.refs, other.refs)))
+
+    def __ne__(self, other):
+        return not self == other
+
+def skip_contour(fid):
+    """
+    Seeks past a CONT chunk, and its SIZE chunk if present, given a file
+    positioned just after the 'CONT' tag.
+    """
+    nPoints = struct.unpack('>l', fid.read(4))[0]
+    fid.seek(12 + 12 * nPoints, 1)
+    if fid.read(4) == 'SIZE':
+        fid.seek(struct.unpack('>l', fid.read(4))[0], 1)
+    else:
+        fid.seek(-4, 1)
+
+def contour_in_z_range(fid, z_range):
+    """
+    Returns True if the first point of a contour has a Z value within z_range
+    = (zmin, zmax), given a file positioned just after the 'CONT' tag. Empty
+    contours are never within range. The file position is left unchanged.
+    """
+    data = fid.read(CONTOUR_HEADER.size + 12)
+    fid.seek(-len(data), 1)
+    if struct.unpack_from('>l', data)[0] < 1:
+        return False
+    z = struct.unpack_from('>f', data, CONTOUR_HEADER.size + 8)[0]
+    return z_range[0] <= z <= z_range[1]
+
+def skip_mesh(fid):
+    """
+    Seeks past a MESH chunk, given a file positioned just after the 'MESH'
+    tag.
+    """
+    nVertices, nIndices = struct.unpack('>2l', fid.read(8))
+    fid.seek(8 + 12 * nVertices + 4 * nIndices, 1)
@@ -0,0 +1,192 @@
+from collections import OrderedDict
+from functools import partial
+from .ImodObject import ImodObject, read_payload
+
+class ImodObjectList(object):
+    """
+    Sequence proxy used as ImodModel.Objects for models opened with lazy =
+    True. Entries are materialized on first access: indexing the list reads
+    only the object's header (OBJT, IMAT, MEPA, and VIEW data) from the model
+    file, while its contours and meshes are parsed on first access of the
+    object's Contours or Meshes attributes.
+
+    If budget is given, it caps the number of bytes of contour and mesh data
+    (as stored in the model file) that are held in memory at once. When
+    loading an object would exceed the budget, the contours and meshes of the
+    least recently accessed objects are dropped, to be re-read from file if
+    they are accessed again. Object headers are never dropped, so changes to
+    object properties (name, color, etc.) are always kept. Objects whose
+    Contours or Meshes lists have been reassigned or resized are never
+    dropped either. Objects whose points are edited in place should be
+    pinned with pin() beforehand. The payloads of objects that cannot be
+    dropped keep counting towards the budget, until they are removed from
+    the list.
+
+    Header properties of all objects can be queried cheaply through header(),
+    which reads them from the model's chunk index (see ImodIndex) without
+    reading any object from the file.
+    """
+
+    def __init__(self, model, budget = None, items = None):
+        self.model = model
+        self.index = model.get_index(model.sidecar)
+        self.budget = budget
+        self.nBytes = 0
+        if items is None:
+            items = range(self.index.nObjects)
+        self._items = list(items)
+        self._loaded = OrderedDict()
+        # Payloads that could not be dropped when evicted, which are still
+        # in memory
+        self._resident = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        item = self._items[i]
+        if not isinstance(item, ImodObject):
+            iFile = item
+            item = self.model.load_object(iFile, payload = False)
+            item.loader = partial(self._read_payload, iFile)
+            # The contour and mesh counts of models read with z_range or
+            # meshes = False are only known once the payload is read
+            if self.model.z_range is not None or not self.model.meshes:
+                item.load_payload()
+            self._items[i] = item
+        elif item in self._loaded:
+            # Mark the object as most recently used
+            self._loaded[item] = self._loaded.pop(item)
+        return item
+
+    def __setitem__(self, i, obj):
+        if isinstance(i, slice):
+            old = self._items[i]
+        else:
+            old = [self._items[i]]
+        self._items[i] = obj
+        new = obj if isinstance(i, slice) else [obj]
+        for item in old:
+            if not any(item is x for x in new):
+                self._release(item)
+
+    def __delitem__(self, i):
+        old = self._items[i]
+        del self._items[i]
+        for item in (old if isinstance(i, slice) else [old]):
+            self._release(item)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return '<ImodObjectList of {0} objects, {1} in memory>'.format(
+            len(self), len(self._loaded) + len(self._resident))
+
+    def append(self, obj):
+        self._items.append(obj)
+
+    def extend(self, objs):
+        self._items.extend(objs)
+
+    def insert(self, i, obj):
+        self._items.insert(i, obj)
+
+    def compress(self, keep):
+        """
+        Keeps only the objects for which the boolean array keep is True,
+        without reading any object that has not been accessed yet. The
+        payloads of removed objects no longer count towards the budget.
+        """
+        items = []
+        for item, k in zip(self._items, keep):
+            if k:
+                items.append(item)
+            else:
+                self._release(item)
+        self._items = items
+        return self
+
+    def _release(self, item):
+        """
+        Stops counting the payload of an object removed from the list towards
+        the budget.
+        """
+        if not isinstance(item, ImodObject):
+            return
+        if item in self._loaded:
+            self.nBytes -= self._loaded.pop(item)
+        elif item in self._resident:
+            self.nBytes -= self._resident.pop(item)
+
+    def pin(self, i):
+        """
+        Keeps the contours and meshes of object i in memory for the rest of
+        the model's lifetime, regardless of the budget.
+        """
+        self[i].pinned = True
+
+    def header(self, i):
+        """
+        Returns a dictionary of the name, color, and number of contours,
+        points, and meshes of object i. For objects that have not been
+        accessed yet, these are taken from the chunk index without reading the
+        object.
+        """
+        item = self._items[i]
+        if isinstance(item, ImodObject):
+            if item.is_loaded() or item.loader is None:
+                nPoints = sum([x.nPoints for x in item.Contours])
+            else:
+                nPoints = int(self.index.nPoints[item.loader.args[0]])
+            return {'name': item.name,
+                    'red': item.red,
+                    'green': item.green,
+                    'blue': item.blue,
+                    'nContours': item.nContours,
+                    'nMeshes': item.nMeshes,
+                    'nPoints': nPoints}
+        rgb = self.index.colors[item]
+        return {'name': self.index.names[item],
+                'red': float(rgb[0]),
+                'green': float(rgb[1]),
+                'blue': float(rgb[2]),
+                'nContours': int(self.index.nContours[item]),
+                'nMeshes': int(self.index.nMeshes[item]),
+                'nPoints': int(self.index.nPoints[item])}
+
+    def _read_payload(self, iFile, obj):
+        """
+        Loader of the object stored as object iFile of the model file. Evicts
+        the payloads of the least recently used objects as needed, then reads
+        and returns the contours and meshes of the object.
+        """
+        nbytes = int(self.index.objBytes[iFile])
+        if self.budget is not None:
+            while self._loaded and self.nBytes + nbytes > self.budget:
+                old, oldBytes = self._loaded.popitem(last = False)
+                if old.unload_payload():
+                    self.nBytes -= oldBytes
+                else:
+                    # Pinned or modified, so its payload stays in memory
+                    self._resident[old] = oldBytes
+
+        fid = self.model.open_file()
+        try:
+            fid.seek(self.index.objOffsets[iFile] + self.index.objtBytes, 0)
+            contours, meshes = read_payload(fid,
+                int(self.index.nContours[iFile]),
+                int(self.index.nMeshes[iFile]),
+                debug = self.model.debug, mmap = self.model.mmap,
+                skip_meshes = not self.model.meshes,
+                z_range = self.model.z_range, compact = self.model.compact)
+        finally:
+            if not self.model.mmap:
+                fid.close()
+
+        self._loaded[obj] = nbytes
+        self.nBytes += nbytes
+        return contours, meshes
@@ -0,0 +1,156 @@
+import copy
+import tempfile
+from .ImodModel import ImodModel
+from .ImodView import ImodView
+from .ImodWrite import (WRITE_BUFFER, writeModelHeader, writeTail,
+    write_object_header, write_contour, write_mesh, write_imat,
+    write_mepa, write_view)
+
+class ImodStreamWriter(object):
+    """
+    Writes an IMOD model file incrementally, one object (or one contour) at a
+    time, such that models of any size can be generated without holding them
+    in memory. Objects and contours are written to disk as they are added, and
+    the object, contour, and mesh counts stored in the file are back-patched
+    once they are known.
+
+    with pyimod.ImodStreamWriter('out.mod', model = mod) as writer:
+        for obj in objects:
+            writer.add_object(obj)
+
+    or, to stream the contours of an object:
+
+    with pyimod.ImodStreamWriter('out.mod', model = mod) as writer:
+        writer.begin_object(obj)
+        for contour in contours:
+            writer.add_contour(contour)
+        writer.end_object()
+
+    The model-level properties (image size, pixel size, units, VIEW, and MINX
+    data) are taken from model, which defaults to an empty ImodModel. Its
+    objects, if any, are ignored. If the model has VIEW data, the per-object
+    views are spooled to a temporary file until the writer is closed. Objects
+    without views are given a default view of the object's color.
+
+    The nContours and nMeshes attributes of objects passed to begin_object are
+    updated to the number of contours and meshes actually written.
+    """
+
+    def __init__(self,
+        fname,
+        model = None,
+        **kwargs):
+            self.__dict__.update(kwargs)
+            self.fname = fname
+            # Shallow copy of the model header, so that the counts can be
+            # updated without altering the caller's model
+            self.model = copy.copy(model if model is not None else ImodModel())
+            self.model.Objects = []
+            self.model.nObjects = 0
+            self.model.view_objvsize = 0
+            self.obj = None
+            self.fid = open(fname, mode = "wb", buffering = WRITE_BUFFER)
+            self.views = tempfile.TemporaryFile() if self.model.view_set \
+                else None
+            writeModelHeader(self.model, self.fid)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_object(self, obj):
+        """
+        Writes a complete object, including all of its contours and meshes.
+        """
+        self.begin_object(obj)
+        for iContour in range(0, obj.nContours):
+            self.add_contour(obj.Contours[iContour])
+        for iMesh in range(0, obj.nMeshes):
+            self.add_mesh(obj.Meshes[iMesh])
+        self.end_object()
+
+    def begin_object(self, obj):
+        """
+        Writes the header of a new object, whose contours and meshes are then
+        added with add_contour and add_mesh. Ends the current object, if any.
+        """
+        if self.fid is None:
+            raise ValueError('Stream writer has been closed.')
+        if self.obj is not None:
+            self.end_object()
+        self.obj = obj
+        self.objectOffset = self.fid.tell()
+        self.nObjectContours = 0
+        self.nObjectMeshes = 0
+        write_object_header(obj, self.fid)
+
+    def add_contour(self, contour):
+        """
+        Writes a contour of the current object.
+        """
+        if self.obj is None:
+            raise ValueError('No object has been begun.')
+        if self.nObjectMeshes:
+            raise ValueError('Contours must be added before meshes.')
+        write_contour(contour, self.fid)
+        self.nObjectContours += 1
+
+    def add_mesh(self, mesh):
+        """
+        Writes a mesh of the current object.
+        """
+        if self.obj is None:
+            raise ValueError('No object has been begun.')
+        write_mesh(mesh, self.fid)
+        self.nObjectMeshes += 1
+
+    def end_object(self):
+        """
+        Writes the IMAT and MEPA chunks of the current object, back-patches
+        its contour and mesh counts, and spools its view.
+        """
+        obj = self.obj
+        if obj is None:
+            return
+        write_imat(obj, self.fid)
+        if obj.mepa_set:
+            write_mepa(obj, self.fid)
+        if (obj.nContours, obj.nMeshes) != (self.nObjectContours,
+            self.nObjectMeshes):
+            obj.nContours = self.nObjectContours
+            obj.nMeshes = self.nObjectMeshes
+            end = self.fid.tell()
+            self.fid.seek(self.objectOffset)
+            write_object_header(obj, self.fid)
+            self.fid.seek(end)
+
+        if self.views is not None:
+            if obj.Views:
+                view = obj.Views[0]
+            else:
+                view = ImodView(red = obj.red, green = obj.green,
+                    blue = obj.blue)
+            write_view(view, self.views)
+            self.model.view_objvsize += 1
+        self.model.nObjects += 1
+        self.obj = None
+
+    def close(self):
+        """
+        Ends the current object, writes the VIEW, MINX, and IEOF chunks, and
+        back-patches the number of objects in the model header.
+        """
+        if self.fid is None:
+            return
+        try:
+            self.end_object()
+            writeTail(self.model, self.fid, views = self.views)
+            self.fid.seek(0)
+            writeModelHeader(self.model, self.fid)
+        finally:
+            self.fid.close()
+            self.fid = None
+            if self.views is not None:
+                self.views.close()
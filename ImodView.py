@@ -1,5 +1,5 @@
-import struct
 from .utils import is_string, is_integer
+from .binspec import OBJECT_VIEW, OBJECT_VIEW_FIELDS, unpack_fields
 
 class ImodView(object):
 
@@ -46,43 +46,11 @@ class ImodView(object):
 
     def read_file(self):
         fid = self.fid
-        self.flags = struct.unpack('>I', fid.read(4))[0]
-        self.red = struct.unpack('>f', fid.read(4))[0]
-        self.green = struct.unpack('>f', fid.read(4))[0]
-        self.blue = struct.unpack('>f', fid.read(4))[0]
-        self.pdrawsize = struct.unpack('>i', fid.read(4))[0]
-        self.linewidth = struct.unpack('>B', fid.read(1))[0]
-        self.linesty = struct.unpack('>B', fid.read(1))[0]
-        self.trans = struct.unpack('>B', fid.read(1))[0]
-        self.clips_count = struct.unpack('>B', fid.read(1))[0]
-        self.clips_flags = struct.unpack('>B', fid.read(1))[0]
-        self.clips_trans = struct.unpack('>B', fid.read(1))[0]
-        self.clips_plane = struct.unpack('>B', fid.read(1))[0]
-        self.clips_normal_x = struct.unpack('>f', fid.read(4))[0]
-        self.clips_normal_y = struct.unpack('>f', fid.read(4))[0]
-        self.clips_normal_z = struct.unpack('>f', fid.read(4))[0]
-        self.clips_points_x = struct.unpack('>f', fid.read(4))[0]
-        self.clips_points_y = struct.unpack('>f', fid.read(4))[0]
-        self.clips_points_z = struct.unpack('>f', fid.read(4))[0]
-        self.ambient = struct.unpack('>B', fid.read(1))[0]
-        self.diffuse = struct.unpack('>B', fid.read(1))[0]
-        self.specular = struct.unpack('>B', fid.read(1))[0]
-        self.shininess = struct.unpack('>B', fid.read(1))[0]
-        self.fillred = struct.unpack('>B', fid.read(1))[0]
-        self.fillgreen = struct.unpack('>B', fid.read(1))[0]
-        self.fillblue = struct.unpack('>B', fid.read(1))[0]
-        self.quality = struct.unpack('>B', fid.read(1))[0] 
-        self.mat2 = struct.unpack('>I', fid.read(4))[0]
-        self.valblack = struct.unpack('>B', fid.read(1))[0]
-        self.valwhite = struct.unpack('>B', fid.read(1))[0]
-        self.mat3b2 = struct.unpack('>B', fid.read(1))[0]
-        self.mat3b3 = struct.unpack('>B', fid.read(1))[0]
-        self.clips_normal = []
-        for i in range(0, 15):
-            self.clips_normal.append(struct.unpack('>f', fid.read(4))[0])
-        self.clips_point = []
-        for i in range(0, 15):
-            self.clips_point.append(struct.unpack('>f', fid.read(4))[0])
+        view, values = unpack_fields(OBJECT_VIEW, OBJECT_VIEW_FIELDS,
+            fid.read(OBJECT_VIEW.size))
+        self.__dict__.update(view)
+        self.clips_normal = list(values[-30:-15])
+        self.clips_point = list(values[-15:])
         return self
 
     def setColor(self, r, g, b): 
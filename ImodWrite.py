@@ -1,226 +1,155 @@
 import struct
+import shutil
+import numpy as np
+from .binspec import (MODEL_HEADER, MODEL_HEADER_FIELDS, OBJECT_HEADER,
+    OBJECT_HEADER_FIELDS, CONTOUR_HEADER, CONTOUR_HEADER_FIELDS, MESH_HEADER,
+    MESH_HEADER_FIELDS, IMAT, IMAT_FIELDS, VIEW_HEADER, VIEW_HEADER_FIELDS,
+    VIEW_HEADER_TAIL_FIELDS, OBJECT_VIEW, OBJECT_VIEW_FIELDS, MINX,
+    MINX_FIELDS, pack_fields)
+
+# Size of the output buffer. Chunks are accumulated in memory and written to
+# disk in blocks of this size.
+WRITE_BUFFER = 1 << 22
 
 def ImodWrite(imodModel, fname):
-    with open(fname, mode = "wb") as fid:
+    with open(fname, mode = "wb", buffering = WRITE_BUFFER) as fid:
         writeModelHeader(imodModel, fid)
         for iObject in range(0, imodModel.nObjects):
-            writeObjectHeader(imodModel, iObject, fid)
-            for iContour in range(0, imodModel.Objects[iObject].nContours):
-                writeContour(imodModel, iObject, iContour, fid)
-            for iMesh in range(0, imodModel.Objects[iObject].nMeshes):
-                writeMesh(imodModel, iObject, iMesh, fid)
-            writeIMAT(imodModel, iObject, fid)
-            if imodModel.Objects[iObject].mepa_set:
-                writeMEPA(imodModel, iObject, fid)
-
-        # Handles the case in which there is a 4 byte VIEW chunk before the 
-        # main VIEW chunk. In this case, write the chunk title ('VIEW'), the
-        # number of bytes (4), and the cview value read from the file.
-        if imodModel.view_4bytes == 1:
-            fid.write('VIEW')
-            fid.write(struct.pack('>i', 4))
-            fid.write(struct.pack('>i', imodModel.view_4bytes_cview))    
-
-        # Write the main VIEW chunk model-level header
-        if imodModel.view_set:
-            writeViewHeader(imodModel, fid)
-
-            # Write each object's VIEW chunk
+            write_object(imodModel.Objects[iObject], fid)
+        writeTail(imodModel, fid)
+        fid.close()
+
+def writeTail(imodModel, fid, views = None):
+    """
+    Writes the chunks that follow the objects: the VIEW chunks, MINX, and the
+    IEOF marker. If views is given, it is a file object holding the encoded
+    per-object VIEW data, which is copied in place of the Views of the model's
+    objects.
+    """
+    # Handles the case in which there is a 4 byte VIEW chunk before the 
+    # main VIEW chunk. In this case, write the chunk title ('VIEW'), the
+    # number of bytes (4), and the cview value read from the file.
+    if imodModel.view_4bytes == 1:
+        fid.write('VIEW')
+        fid.write(struct.pack('>i', 4))
+        fid.write(struct.pack('>i', imodModel.view_4bytes_cview))    
+
+    # Write the main VIEW chunk model-level header
+    if imodModel.view_set:
+        writeViewHeader(imodModel, fid)
+
+        # Write each object's VIEW chunk
+        if views is not None:
+            views.seek(0)
+            shutil.copyfileobj(views, fid, WRITE_BUFFER)
+        else:
             for iObject in range(imodModel.view_objvsize):
                 if imodModel.Objects[iObject].Views:
                     writeView(imodModel, iObject, fid)
 
-        # Write MINX data, if it has been created or read.
-        if imodModel.minx_set:
-            writeMinx(imodModel, fid)
+    # Write MINX data, if it has been created or read.
+    if imodModel.minx_set:
+        writeMinx(imodModel, fid)
 
-        fid.write('IEOF')
-        fid.close()
+    fid.write('IEOF')
     
 def writeModelHeader(imodModel, fid):
-    tag = 'IMOD' + imodModel.version
-    nChar = len(imodModel.name)
-    nameStr = imodModel.name + struct.pack('>B', 0) * (128 - nChar)
-    fid.write(tag)
-    fid.write(nameStr)
-    fid.write(struct.pack('>i', imodModel.xMax))
-    fid.write(struct.pack('>i', imodModel.yMax))
-    fid.write(struct.pack('>i', imodModel.zMax))
-    fid.write(struct.pack('>i', imodModel.nObjects))
-    fid.write(struct.pack('>I', imodModel.flags))
-    fid.write(struct.pack('>i', imodModel.drawMode))
-    fid.write(struct.pack('>i', imodModel.mouseMode))
-    fid.write(struct.pack('>i', imodModel.blackLevel))
-    fid.write(struct.pack('>i', imodModel.whiteLevel))
-    fid.write(struct.pack('>f', imodModel.xOffset))
-    fid.write(struct.pack('>f', imodModel.yOffset))
-    fid.write(struct.pack('>f', imodModel.zOffset))
-    fid.write(struct.pack('>f', imodModel.xScale))
-    fid.write(struct.pack('>f', imodModel.yScale))
-    fid.write(struct.pack('>f', imodModel.zScale))
-    fid.write(struct.pack('>i', imodModel.object))
-    fid.write(struct.pack('>i', imodModel.contour))
-    fid.write(struct.pack('>i', imodModel.point))
-    fid.write(struct.pack('>i', imodModel.res))
-    fid.write(struct.pack('>i', imodModel.thresh))
-    fid.write(struct.pack('>f', imodModel.pixelSizeXY))
-    fid.write(struct.pack('>i', imodModel.units))
-    fid.write(struct.pack('>i', imodModel.csum))
-    fid.write(struct.pack('>f', imodModel.alpha))
-    fid.write(struct.pack('>f', imodModel.beta))
-    fid.write(struct.pack('>f', imodModel.gamma))
+    fid.write('IMOD' + imodModel.version)
+    fid.write(pack_fields(MODEL_HEADER, MODEL_HEADER_FIELDS, imodModel))
 
 def writeObjectHeader(imodModel, iObject, fid):
-    fid.write('OBJT')
-    name = imodModel.Objects[iObject].name
-    nChar = len(name)
-    tagStr = name + struct.pack('>B', 0) * (128 - nChar)
-    fid.write(tagStr)
-    fid.write(struct.pack('>i', imodModel.Objects[iObject].nContours))
-    fid.write(struct.pack('>I', imodModel.Objects[iObject].flags))
-    fid.write(struct.pack('>i', imodModel.Objects[iObject].axis))
-    fid.write(struct.pack('>i', imodModel.Objects[iObject].drawMode))
-    fid.write(struct.pack('>f', imodModel.Objects[iObject].red))
-    fid.write(struct.pack('>f', imodModel.Objects[iObject].green))
-    fid.write(struct.pack('>f', imodModel.Objects[iObject].blue))
-    fid.write(struct.pack('>i', imodModel.Objects[iObject].pdrawsize))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].symbol))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].symbolSize))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].lineWidth2D))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].lineWidth3D))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].lineStyle))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].symbolFlags))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].sympad))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].transparency))
-    fid.write(struct.pack('>i', imodModel.Objects[iObject].nMeshes))
-    fid.write(struct.pack('>i', imodModel.Objects[iObject].nSurfaces))
+    write_object_header(imodModel.Objects[iObject], fid)
 
 def writeContour(imodModel, iObject, iContour, fid):
-    tagStr = 'CONT'
-    fid.write(tagStr)
-    fid.write(struct.pack('>i', imodModel.Objects[iObject].Contours[iContour].nPoints))
-    try:
-        fid.write(struct.pack('>I', imodModel.Objects[iObject].Contours[iContour].flags))
-    except:
-        fid.write(struct.pack('>I', 0))
-    fid.write(struct.pack('>i', imodModel.Objects[iObject].Contours[iContour].type))
-    fid.write(struct.pack('>i', imodModel.Objects[iObject].Contours[iContour].iSurface))
-    fid.write("".join([struct.pack('>f', x) for x in imodModel.Objects[iObject].Contours[iContour].points]))
-
-    # Write SIZE chunk, if necessary
-    if imodModel.Objects[iObject].Contours[iContour].size_set:
-        npts = len(imodModel.Objects[iObject].Contours[iContour].size_vals)
-        fid.write('SIZE') 
-        fid.write(struct.pack('>i', npts * 4))
-        for i in range(npts):
-            fid.write(struct.pack('>f', 
-                imodModel.Objects[iObject].Contours[iContour].size_vals[i]))
+    write_contour(imodModel.Objects[iObject].Contours[iContour], fid)
 
 def writeMesh(imodModel, iObject, iMesh, fid):
-    tagStr = 'MESH'
-    fid.write(tagStr)
-    fid.write(struct.pack('>i', imodModel.Objects[iObject].Meshes[iMesh].nVertices))
-    fid.write(struct.pack('>i', imodModel.Objects[iObject].Meshes[iMesh].nIndices))
-    fid.write(struct.pack('>I', imodModel.Objects[iObject].Meshes[iMesh].flag))
-    fid.write(struct.pack('>h', imodModel.Objects[iObject].Meshes[iMesh].type))
-    fid.write(struct.pack('>h', imodModel.Objects[iObject].Meshes[iMesh].pad))
-    fid.write("".join([struct.pack('>f', x) for x in imodModel.Objects[iObject].Meshes[iMesh].vertices]))
-    fid.write("".join([struct.pack('>i', x) for x in imodModel.Objects[iObject].Meshes[iMesh].indices]))
+    write_mesh(imodModel.Objects[iObject].Meshes[iMesh], fid)
 
 def writeIMAT(imodModel, iObject, fid):
-    tagStr = 'IMAT'
-    fid.write(tagStr)
-    fid.write(struct.pack('>i', 16))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].ambient))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].diffuse))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].specular))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].shininess))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].fillred))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].fillgreen))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].fillblue))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].quality))
-    fid.write(struct.pack('>l', imodModel.Objects[iObject].mat2))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].valblack))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].valwhite))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].matflags2))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].mat3b3))
+    write_imat(imodModel.Objects[iObject], fid)
 
 def writeMEPA(imodModel, iObject, fid):
-    fid.write('MEPA')
-    fid.write(struct.pack('>i', imodModel.Objects[iObject].mepa_nBytes))
-    [fid.write(struct.pack('>B', x)) for x in imodModel.Objects[iObject].mepa_byteString]
+    write_mepa(imodModel.Objects[iObject], fid)
 
 def writeViewHeader(imodModel, fid):
     fid.write('VIEW')
-    fid.write(struct.pack('>i', 184 + imodModel.nObjects * 187))
-    fid.write(struct.pack('>f', imodModel.view_fovy)) 
-    fid.write(struct.pack('>f', imodModel.view_rad))
-    fid.write(struct.pack('>f', imodModel.view_aspect))
-    fid.write(struct.pack('>f', imodModel.view_cnear))
-    fid.write(struct.pack('>f', imodModel.view_cfar))
-    fid.write(struct.pack('>f', imodModel.view_rot_x))
-    fid.write(struct.pack('>f', imodModel.view_rot_y))
-    fid.write(struct.pack('>f', imodModel.view_rot_z))
-    fid.write(struct.pack('>f', imodModel.view_trans_x))
-    fid.write(struct.pack('>f', imodModel.view_trans_y))
-    fid.write(struct.pack('>f', imodModel.view_trans_z)) 
-    fid.write(struct.pack('>f', imodModel.view_scale_x))
-    fid.write(struct.pack('>f', imodModel.view_scale_y))
-    fid.write(struct.pack('>f', imodModel.view_scale_z))
-    [fid.write(struct.pack('>f', x)) for x in imodModel.view_mat]
-    fid.write(struct.pack('>i', imodModel.view_world))
-    tag = imodModel.view_label
-    nChar = len(tag)
-    fid.write(tag + struct.pack('>B', 0) * (32 - nChar))
-    fid.write(struct.pack('>f', imodModel.view_dcstart))
-    fid.write(struct.pack('>f', imodModel.view_dcend))
-    fid.write(struct.pack('>f', imodModel.view_lightx))
-    fid.write(struct.pack('>f', imodModel.view_lighty))
-    fid.write(struct.pack('>f', imodModel.view_plax))
-    fid.write(struct.pack('>i', imodModel.view_objvsize)) #objvsize
-    fid.write(struct.pack('>i', imodModel.view_objvsize * 187)) #bytesObjv
+    fid.write(struct.pack('>i', VIEW_HEADER.size +
+        imodModel.nObjects * OBJECT_VIEW.size))
+    fid.write(VIEW_HEADER.pack(*(
+        [getattr(imodModel, x) for x in VIEW_HEADER_FIELDS] +
+        list(imodModel.view_mat) +
+        [getattr(imodModel, x) for x in VIEW_HEADER_TAIL_FIELDS] +
+        [imodModel.view_objvsize * OBJECT_VIEW.size])))
 
 def writeView(imodModel, iObject, fid):
-    fid.write(struct.pack('>I', imodModel.Objects[iObject].Views[0].flags))
-    fid.write(struct.pack('>f', imodModel.Objects[iObject].Views[0].red))
-    fid.write(struct.pack('>f', imodModel.Objects[iObject].Views[0].green))
-    fid.write(struct.pack('>f', imodModel.Objects[iObject].Views[0].blue))
-    fid.write(struct.pack('>i', imodModel.Objects[iObject].Views[0].pdrawsize))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].linewidth))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].linesty))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].trans))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].clips_count))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].clips_flags))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].clips_trans))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].clips_plane))
-    fid.write(struct.pack('>f', imodModel.Objects[iObject].Views[0].clips_normal_x))
-    fid.write(struct.pack('>f', imodModel.Objects[iObject].Views[0].clips_normal_y))
-    fid.write(struct.pack('>f', imodModel.Objects[iObject].Views[0].clips_normal_z))
-    fid.write(struct.pack('>f', imodModel.Objects[iObject].Views[0].clips_points_x))
-    fid.write(struct.pack('>f', imodModel.Objects[iObject].Views[0].clips_points_y))
-    fid.write(struct.pack('>f', imodModel.Objects[iObject].Views[0].clips_points_z))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].ambient))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].diffuse))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].specular))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].shininess))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].fillred))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].fillgreen))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].fillblue))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].quality))
-    fid.write(struct.pack('>I', imodModel.Objects[iObject].Views[0].mat2))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].valblack))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].valwhite))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].mat3b2))
-    fid.write(struct.pack('>B', imodModel.Objects[iObject].Views[0].mat3b3))
-    [fid.write(struct.pack('>f', x)) for x in imodModel.Objects[iObject].Views[0].clips_normal]
-    [fid.write(struct.pack('>f', x)) for x in imodModel.Objects[iObject].Views[0].clips_point] 
+    write_view(imodModel.Objects[iObject].Views[0], fid)
 
 def writeMinx(imodModel, fid):
     fid.write('MINX')
-    fid.write(struct.pack('>i', 72))
-    [fid.write(struct.pack('>f', x)) for x in imodModel.minx_oscale]
-    [fid.write(struct.pack('>f', x)) for x in imodModel.minx_otrans]
-    [fid.write(struct.pack('>f', x)) for x in imodModel.minx_orot]
-    [fid.write(struct.pack('>f', x)) for x in imodModel.minx_cscale]
-    [fid.write(struct.pack('>f', x)) for x in imodModel.minx_ctrans]
-    [fid.write(struct.pack('>f', x)) for x in imodModel.minx_crot]
+    fid.write(struct.pack('>i', MINX.size))
+    fid.write(MINX.pack(*[x for key in MINX_FIELDS
+        for x in getattr(imodModel, key)]))
+
+# The following functions write single objects and their chunks, independent
+# of the model that holds them. They are shared with ImodStreamWriter.
+
+def write_object(obj, fid):
+    """
+    Writes an object's OBJT header, contours, meshes, IMAT, and MEPA chunks.
+    """
+    write_object_header(obj, fid)
+    for iContour in range(0, obj.nContours):
+        write_contour(obj.Contours[iContour], fid)
+    for iMesh in range(0, obj.nMeshes):
+        write_mesh(obj.Meshes[iMesh], fid)
+    write_imat(obj, fid)
+    if obj.mepa_set:
+        write_mepa(obj, fid)
+
+def write_object_header(obj, fid):
+    fid.write('OBJT')
+    fid.write(pack_fields(OBJECT_HEADER, OBJECT_HEADER_FIELDS, obj))
+
+def write_contour(contour, fid):
+    try:
+        fid.write('CONT' + pack_fields(CONTOUR_HEADER, CONTOUR_HEADER_FIELDS,
+            contour))
+    except:
+        fid.write('CONT' + CONTOUR_HEADER.pack(contour.nPoints, 0,
+            contour.type, contour.iSurface))
+    fid.write(to_bytes(contour.points, '>f4'))
+
+    # Write SIZE chunk, if necessary
+    if contour.size_set:
+        npts = len(contour.size_vals)
+        fid.write('SIZE' + struct.pack('>i', npts * 4))
+        fid.write(to_bytes(contour.size_vals, '>f4'))
+
+def write_mesh(mesh, fid):
+    fid.write('MESH' + pack_fields(MESH_HEADER, MESH_HEADER_FIELDS, mesh))
+    fid.write(to_bytes(mesh.vertices, '>f4'))
+    fid.write(to_bytes(mesh.indices, '>i4'))
+
+def write_imat(obj, fid):
+    fid.write('IMAT')
+    fid.write(struct.pack('>i', IMAT.size))
+    fid.write(pack_fields(IMAT, IMAT_FIELDS, obj))
+
+def write_mepa(obj, fid):
+    fid.write('MEPA')
+    fid.write(struct.pack('>i', obj.mepa_nBytes))
+    fid.write(to_bytes(obj.mepa_byteString, 'u1'))
+
+def write_view(view, fid):
+    fid.write(pack_fields(OBJECT_VIEW, OBJECT_VIEW_FIELDS, view,
+        *(list(view.clips_normal) + list(view.clips_point))))
+
+def to_bytes(values, dtype):
+    """
+    Encodes a sequence of values (list, tuple, or Numpy array) as a single
+    block of bytes of the given Numpy dtype, e.g. '>f4'. Arrays that already
+    have the target dtype, such as the views of memory mapped models, are
+    written without conversion.
+    """
+    return np.asarray(values, dtype = dtype).tobytes()
@@ -0,0 +1,137 @@
+import numpy as np
+
+class ImodZIndex(object):
+    """
+    Index of contours by Z slice. Given the Z value of each contour (see
+    ImodObject.get_z_values), the contours are sorted by Z once, such that the
+    contours of a slice, and the number of contours per slice, are looked up
+    without scanning the contours again, and per-contour values can be reduced
+    per slice in a single pass.
+
+    Indices are kept by ImodObject.get_z_index, for the contours of one object,
+    and by ImodModel.get_z_index, for the contours of all objects, in which
+    case objIds and contIds give the object and contour of each entry. Both
+    are rebuilt when the contours are reassigned, added, or removed, or have
+    their points reassigned. Contours whose points are edited in place
+    require invalidate_z_index() to be called on their object.
+
+    Empty contours have no Z value, and are left out of all slices.
+    """
+
+    def __init__(self,
+        z = None,
+        empty = None,
+        objIds = None,
+        contIds = None,
+        key = None):
+            self.z = np.zeros(0, dtype = int) if z is None else \
+                np.asarray(z, dtype = int)
+            self.empty = np.zeros(len(self.z), dtype = bool) if empty is None \
+                else np.asarray(empty, dtype = bool)
+            self.objIds = objIds
+            self.contIds = contIds
+            self.key = key
+            full = np.flatnonzero(~self.empty)
+            self.order = full[np.argsort(self.z[full], kind = 'mergesort')]
+            self.slices, self.starts, self.counts = np.unique(
+                self.z[self.order], return_index = True, return_counts = True)
+
+    def __len__(self):
+        return len(self.z)
+
+    def __repr__(self):
+        return '<ImodZIndex of {0} contours on {1} slices>'.format(len(self),
+            self.nSlices)
+
+    @property
+    def nSlices(self):
+        """
+        Number of unique Z slices.
+        """
+        return len(self.slices)
+
+    @property
+    def zmin(self):
+        return int(self.slices[0]) if self.nSlices else None
+
+    @property
+    def zmax(self):
+        return int(self.slices[-1]) if self.nSlices else None
+
+    def find(self, z):
+        """
+        Returns the position of slice z in slices, or -1 if it has no
+        contours.
+        """
+        i = np.searchsorted(self.slices, z)
+        if i < self.nSlices and self.slices[i] == z:
+            return i
+        return -1
+
+    def get_contours(self, z):
+        """
+        Returns the array of indices of the contours on slice z, in ascending
+        order.
+        """
+        i = self.find(z)
+        if i < 0:
+            return np.zeros(0, dtype = int)
+        return self.order[self.starts[i]:self.starts[i] + self.counts[i]]
+
+    def get_counts(self, zmin = None, zmax = None):
+        """
+        Returns an array of the number of contours on each slice from zmin to
+        zmax, which default to the smallest and largest Z values.
+        """
+        if not self.nSlices:
+            return np.zeros(0, dtype = int)
+        zmin = self.zmin if zmin is None else zmin
+        zmax = self.zmax if zmax is None else zmax
+        counts = np.zeros(zmax - zmin + 1, dtype = int)
+        sel = (self.slices >= zmin) & (self.slices <= zmax)
+        counts[self.slices[sel] - zmin] = self.counts[sel]
+        return counts
+
+    def is_contiguous(self):
+        """
+        Returns True if every slice from the smallest to the largest Z value
+        has contours.
+        """
+        return self.nSlices > 0 and self.zmax - self.zmin + 1 == self.nSlices
+
+    def reduce(self, values, ufunc = np.add, full = False, fill = 0):
+        """
+        Reduces an array of per-contour values (or rows of values) per slice
+        with a Numpy ufunc, e.g. np.add or np.maximum.
+
+        Inputs
+        ======
+        values - Array with one value (or row) per contour.
+        ufunc  - Numpy ufunc used for the reduction. Default is np.add.
+        full   - If True, returns one entry for every slice from the smallest
+                 to the largest Z value, with slices without contours set to
+                 fill. By default, returns one entry per slice in slices.
+        """
+        values = np.asarray(values)
+        if not self.nSlices:
+            return values[:0]
+        out = ufunc.reduceat(values[self.order], self.starts, axis = 0)
+        if not full:
+            return out
+        res = np.empty((self.zmax - self.zmin + 1,) + out.shape[1:],
+            dtype = out.dtype)
+        res.fill(fill)
+        res[self.slices - self.zmin] = out
+        return res
+
+    def mean(self, values):
+        """
+        Returns the mean of the per-contour values on each slice in slices,
+        ignoring NaNs. Slices on which all values are NaN are NaN.
+        """
+        values = np.asarray(values, dtype = float)
+        valid = ~np.isnan(values)
+        total = self.reduce(np.where(valid, values, 0))
+        n = self.reduce(valid.astype(int))
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return total / n
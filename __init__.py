@@ -1,8 +1,14 @@
 from ImodModel import *
 from ImodObject import ImodObject
 from ImodContour import ImodContour
+from ImodContourArray import ImodContourArray
 from ImodMesh import ImodMesh
+from ImodIndex import ImodIndex, scan
+from ImodObjectList import ImodObjectList
+from ImodZIndex import ImodZIndex
+from ImodBoxIndex import ImodBoxIndex
 from ImodWrite import ImodWrite
+from ImodStreamWriter import ImodStreamWriter
 from ImodExport import ImodExport
 from ImodGen import *
 from mrc import *
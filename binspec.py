@@ -0,0 +1,85 @@
+"""
+Precompiled struct layouts of the fixed-size blocks of the IMOD binary model
+file format (http://bio3d.colorado.edu/imod/doc/binspec.html). Each block is
+decoded and encoded with a single call to its Struct, rather than one call per
+field. All layouts are big-endian. The field tuples list the attribute names,
+in file order, that the values of each layout correspond to.
+"""
+
+import struct
+
+# Model header, following the 'IMOD' tag and the 4 byte version string
+MODEL_HEADER = struct.Struct('>128s4lI4l6f5lf2l3f')
+MODEL_HEADER_FIELDS = ('name', 'xMax', 'yMax', 'zMax', 'nObjects', 'flags',
+    'drawMode', 'mouseMode', 'blackLevel', 'whiteLevel', 'xOffset', 'yOffset',
+    'zOffset', 'xScale', 'yScale', 'zScale', 'object', 'contour', 'point',
+    'res', 'thresh', 'pixelSizeXY', 'units', 'csum', 'alpha', 'beta', 'gamma')
+
+# OBJT chunk, following the 'OBJT' tag
+OBJECT_HEADER = struct.Struct('>128slI2l3fl8B2l')
+OBJECT_HEADER_FIELDS = ('name', 'nContours', 'flags', 'axis', 'drawMode',
+    'red', 'green', 'blue', 'pdrawsize', 'symbol', 'symbolSize', 'lineWidth2D',
+    'lineWidth3D', 'lineStyle', 'symbolFlags', 'sympad', 'transparency',
+    'nMeshes', 'nSurfaces')
+
+# CONT chunk header, following the 'CONT' tag
+CONTOUR_HEADER = struct.Struct('>lI2l')
+CONTOUR_HEADER_FIELDS = ('nPoints', 'flags', 'type', 'iSurface')
+
+# MESH chunk header, following the 'MESH' tag
+MESH_HEADER = struct.Struct('>2lI2h')
+MESH_HEADER_FIELDS = ('nVertices', 'nIndices', 'flag', 'type', 'pad')
+
+# IMAT chunk data, following the 'IMAT' tag and the chunk length (16)
+IMAT = struct.Struct('>8Bl4B')
+IMAT_FIELDS = ('ambient', 'diffuse', 'specular', 'shininess', 'fillred',
+    'fillgreen', 'fillblue', 'quality', 'mat2', 'valblack', 'valwhite',
+    'matflags2', 'mat3b3')
+
+# Model-level VIEW data, following the 'VIEW' tag and the chunk length. The
+# 16 values of view_mat follow the first 14 fields.
+VIEW_HEADER = struct.Struct('>14f16fi32s5f2i')
+VIEW_HEADER_FIELDS = ('view_fovy', 'view_rad', 'view_aspect', 'view_cnear',
+    'view_cfar', 'view_rot_x', 'view_rot_y', 'view_rot_z', 'view_trans_x',
+    'view_trans_y', 'view_trans_z', 'view_scale_x', 'view_scale_y',
+    'view_scale_z')
+VIEW_HEADER_TAIL_FIELDS = ('view_world', 'view_label', 'view_dcstart',
+    'view_dcend', 'view_lightx', 'view_lighty', 'view_plax', 'view_objvsize')
+
+# Per-object VIEW data, following the model-level VIEW data. The 15 values of
+# both clips_normal and clips_point follow the listed fields.
+OBJECT_VIEW = struct.Struct('>I3fl7B6f8BI4B30f')
+OBJECT_VIEW_FIELDS = ('flags', 'red', 'green', 'blue', 'pdrawsize',
+    'linewidth', 'linesty', 'trans', 'clips_count', 'clips_flags',
+    'clips_trans', 'clips_plane', 'clips_normal_x', 'clips_normal_y',
+    'clips_normal_z', 'clips_points_x', 'clips_points_y', 'clips_points_z',
+    'ambient', 'diffuse', 'specular', 'shininess', 'fillred', 'fillgreen',
+    'fillblue', 'quality', 'mat2', 'valblack', 'valwhite', 'mat3b2', 'mat3b3')
+
+# MINX chunk data, following the 'MINX' tag and the chunk length (72). Each
+# field holds 3 values.
+MINX = struct.Struct('>18f')
+MINX_FIELDS = ('minx_oscale', 'minx_otrans', 'minx_orot', 'minx_cscale',
+    'minx_ctrans', 'minx_crot')
+
+def unpack_fields(layout, fields, data, offset = 0):
+    """
+    Decodes data with the given layout, and returns a dictionary of the
+    decoded values keyed by fields, along with the tuple of all values. Values
+    beyond the length of fields are only contained in the latter.
+    """
+    values = layout.unpack_from(data, offset)
+    return dict(zip(fields, values)), values
+
+def pack_fields(layout, fields, obj, *extra):
+    """
+    Encodes the attributes of obj named by fields, followed by any extra
+    values, with the given layout.
+    """
+    return layout.pack(*([getattr(obj, x) for x in fields] + list(extra)))
+
+def cstr(data):
+    """
+    Returns the null-terminated string stored in a fixed-size string field.
+    """
+    return data.split('\x00')[0]
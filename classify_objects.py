@@ -3,7 +3,6 @@
 from __future__ import division
 
 import os
-import subprocess
 import pyimod
 import timeit
 import math
@@ -15,110 +14,39 @@ import multiprocessing as mp
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import KMeans
 
-def imodinfo_e(fname, iObj, ncont):
-    cmd = "imodinfo -e -o {0} {1}".format(iObj + 1, fname)
-    proc = subprocess.Popen(cmd.split(), stdout = subprocess.PIPE)
-    M = np.zeros([ncont, 5])
-    data_switch = 0 
-    C = 1 
-    for line in proc.stdout:
-        if not data_switch and "semi-major" in line:
-            data_switch = 1 
-        elif data_switch and C <= ncont: 
-            line = line.split()
-            if str(line[0]) == 'Mean':
-                delta = ncont - C + 1
-                for i in range(delta):
-                    M[C-1,:] = np.nan
-                    C+=1
-                continue
-            if C != int(line[0]):
-                delta = int(line[0]) - C
-                for i in range(delta): 
-                    M[C-1,:] = np.nan
-                    C+=1
-            if C <= ncont:
-                M[C-1,0] = float(line[4])
-                M[C-1,1] = float(line[5])
-                M[C-1,2] = M[C-1,0] / M[C-1,1]
-                M[C-1,3] = float(line[6])
-                M[C-1,4] = float(line[7])
-                C+=1
-    return M
-
-def imodinfo_v(fname, iObj, ncont):
-    cmd = "imodinfo -v -o {0} {1}".format(iObj + 1, fname)
-    proc = subprocess.Popen(cmd.split(), stdout = subprocess.PIPE)
-    M = np.zeros([ncont, 13])
-    C = -1
-    for line in proc.stdout:
-        if "CONTOUR" in line:
-            C+=1
-            M[C,0] = line.split()[2] #N points
-        elif "Closed/Open length" in line:
-            M[C,1] = line.split()[3] #Closed length
-            M[C,2] = line.split()[5] #Open length
-        elif "Enclosed Area" in line:
-            M[C,3] = line.split()[3] #Area
-        elif "Center of Mass" in line:
-            M[C,4] = line.split()[4][1:-1] #Centroid X
-            M[C,5] = line.split()[5][0:-1] #Centroid Y
-            M[C,6] = line.split()[6][0:-1] #Centroid Z
-        elif "Circle" in line:
-            M[C,7] = line.split()[2] #Circle
-        elif "Orientation" in line:
-            M[C,8] = line.split()[2] #Orientation
-        elif "Ellipse" in line:
-            M[C,9] = line.split()[2] #Ellipse
-        elif "Length X Width" in line:
-            M[C,10] = line.split()[4] #Length
-            M[C,11] = line.split()[6] #Width
-        elif "Aspect Ratio" in line:
-            M[C,12] = line.split()[3] #Aspect Ratio
-        elif "Total volume inside mesh" in line:
-            volume = float(line.split()[5]) / (1000 ** 3) #Volume
-        elif "Total mesh surface area" in line:
-            sa = float(line.split()[5]) / (1000 ** 2) #Surface Area
-    return M, volume, sa
-
 def calc_delta_centroid(iObj, z, fv):
     # Analyzes the change in centroid position in (X, Y) across slices, and
     # returns statistics for the whole object. Statistics computed are the
     # maximum change in Euclidean distance between two slices, the mean # change across all slices, and the variance of change.  #
     # Inputs
     #    iObj - Object number.
-    #    z    - List of z coordinate of every contour in the object.
+    #    z    - Z index of the object's contours (see get_z_values).
     #    fv   - Feature vector to append metrics to.
     #
     # Returns
     #    fv - Feature vector with metrics appended.
-    xc = []
-    yc = []
-    d = []
-    for i in range(z[0], z[-1] + 1):
-        idx = np.where(z == i)[0]
-        pts = []
-      
-        # Get points of all contours at current Z value
-        for j in idx:
-            pts.extend(mod.Objects[iObj].Contours[j].points)
-       
-        # Compute centroid components for the current Z value. Append them to 
-        # the x and y centroid coordinate lists, xc and yc, respectively.
-        if pts:
-            Npts = int(len(pts) / 3)
-            xci = sum([x * mod.pixelSizeXY / 1000 for x in pts[0::3]]) / Npts
-            yci = sum([y * mod.pixelSizeXY / 1000 for y in pts[1::3]]) / Npts
-        xc.append(xci)
-        yc.append(yci)       
-
-        # Compute the Euclidean distance between the (X,Y) centroid coordinates
-        # of successive slices. Append to the distance list, d. 
-        if len(xc) > 1:
-            d.append(math.sqrt((xc[-1] - xc[-2]) ** 2 + (yc[-1] - yc[-2]) ** 2))
-
-    # Append the maximum distance, mean distance, and variance of distance to
-    # the feature vector.
+
+    # Sum up the X and Y coordinates and the number of points of all contours
+    # at each Z value, from the minimum to the maximum Z.
+    pts, nPoints = pyimod.get_object_points(mod.Objects[iObj])
+    starts = np.cumsum(nPoints) - nPoints
+    full = nPoints > 0
+    sums = np.zeros([len(nPoints), 3])
+    sums[full, :2] = np.add.reduceat(pts[:, :2], starts[full])
+    sums[:, 2] = nPoints
+    S = z.reduce(sums, full = True)
+
+    # Compute the centroid of each Z value. Z values without points keep the
+    # centroid of the previous Z value.
+    has = S[:, 2] > 0
+    idx = np.maximum.accumulate(np.where(has, np.arange(len(S)), 0))
+    xc = S[idx, 0] / S[idx, 2] * mod.pixelSizeXY / 1000
+    yc = S[idx, 1] / S[idx, 2] * mod.pixelSizeXY / 1000
+
+    # Compute the Euclidean distance between the (X,Y) centroid coordinates
+    # of successive slices. Append the maximum distance, mean distance, and
+    # variance of distance to the feature vector.
+    d = np.hypot(np.diff(xc), np.diff(yc))
     fv.append(np.max(d))
     fv.append(np.mean(d))
     fv.append(np.var(d))
@@ -173,22 +101,14 @@ def calc_centroid_3d(iObj, fv):
     return fv
 
 def get_z_values(iObj):
-    ncont = mod.Objects[iObj].nContours
-    z = np.zeros([ncont, 1])
-    # Get a list of the Z value of each contour
-    for i in range(ncont):
-        z[i] = np.unique([int(x) for x in mod.Objects[iObj].Contours[i].points[2::3]])
-    return z
+    # Returns the Z index of the object, which maps each Z value to the
+    # contours on it (see pyimod.ImodZIndex)
+    return mod.Objects[iObj].get_z_index()
 
 def calc_stats(datain, iObj, z, fv):
-    D = []
-    for i in range(z[0], z[-1] + 1):
-        idx = np.where(z == i)[0]
-        if len(idx): 
-            datai = datain[idx]
-            datai = datai[~np.isnan(datai)] 
-            if len(datai):
-                D = np.append(D, np.mean(datai))
+    # Mean of the values of the contours of each Z value, ignoring NaNs
+    D = z.mean(datain)
+    D = D[~np.isnan(D)]
     if len(D):
         fv.append(np.min(D))
         fv.append(np.max(D))
@@ -199,15 +119,10 @@ def calc_stats(datain, iObj, z, fv):
     return fv
 
 def fit_quadratic(Araw, iObj, z, fv):
-    ncont = mod.Objects[iObj].nContours
-
-    # Loop from the minimum Z to the maximum Z. Sum up the areas enclosed by
-    # all contours on the given Z value. Convert area to microns squared, and
-    # append to an area list (A).
-    A = []
-    for i in range(z[0], z[-1] + 1):
-        idx = np.where(z == i)[0]
-        A = np.append(A, sum(Araw[idx]) / (1000 ** 2)) 
+    # From the minimum Z to the maximum Z, sum up the areas enclosed by all
+    # contours on each Z value. Convert area to microns squared, and store to
+    # an area list (A).
+    A = z.reduce(Araw, full = True) / (1000 ** 2)
 
     # Fit a quadratic to the evolution of area across Z. Calculate the R-
     # squared value of this fit.
@@ -229,8 +144,13 @@ def calc_rsq(p, x, y):
 
 def extract_features(iObj):
     print "Processing Object {0}".format(iObj)
-    iiv, volume, sa = imodinfo_v(fname_tmp, iObj, mod.Objects[iObj].nContours)
-    iie = imodinfo_e(fname_tmp, iObj, mod.Objects[iObj].nContours)
+    # Contour metrics, and mesh volume and surface area, computed from the
+    # model in memory. Contour metrics are in model units, as output by
+    # imodinfo -v, and are scaled in fit_quadratic. Volume and surface area
+    # are converted to microns cubed and squared, as before.
+    iiv = pyimod.contour_metrics(mod, [iObj])
+    volume, sa = pyimod.mesh_metrics(mod, [iObj])[0] / [1000 ** 3, 1000 ** 2]
+    iie = ellipse[iObj]
 
     # Add values to object's feature vector
     fvi = []
@@ -247,10 +167,10 @@ def extract_features(iObj):
     z = get_z_values(iObj)
 
     # Get fit metrics for a quadratic to contour area 
-    fvi = fit_quadratic(iiv[:,3], iObj, z, fvi)
+    fvi = fit_quadratic(iiv[:,5], iObj, z, fvi)
 
     # Get fit metrics for a quadratic to closed length
-    fvi = fit_quadratic(iiv[:,2], iObj, z, fvi)
+    fvi = fit_quadratic(iiv[:,4], iObj, z, fvi)
 
     # Get contour centroid metrics 
     fvi = calc_delta_centroid(iObj, z, fvi)
@@ -258,8 +178,11 @@ def extract_features(iObj):
     # Get the standard distance
     fvi = calc_centroid_3d(iObj, fvi)
 
-    fvi = calc_stats(iiv[:,7], iObj, z, fvi)
-    fvi = calc_stats(iiv[:,12], iObj, z, fvi)
+    # Circularity, and aspect ratio (NaN for contours without width)
+    fvi = calc_stats(iiv[:,9], iObj, z, fvi)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        aspect = np.where(iiv[:,11] > 0, iiv[:,10] / iiv[:,11], np.nan)
+    fvi = calc_stats(aspect, iObj, z, fvi)
 
     fvi = calc_stats(iie[:,2], iObj, z, fvi)
     fvi = calc_stats(iie[:,3], iObj, z, fvi)
@@ -277,7 +200,7 @@ def run_ef():
 #        vol = extract_features(i)
 
 if __name__ == '__main__':
-    global fname_tmp, mod, ncpu
+    global ellipse, mod, ncpu
 
     # Use 3/4 of the machine's processors
     ncpu = int(mp.cpu_count() * 0.75)
@@ -287,38 +210,24 @@ if __name__ == '__main__':
     print "Loading IMOD model file: {0}".format(fname)
     mod = pyimod.ImodModel(fname)
     
-    # Remove empty contours.
-    print "Removing empty contours and objects."
-    mod.removeEmptyContours()
-
-    # Keep objects with greater than 2 contours. First, run in remove =
-    # False mode to create a visual representation of the filter.
-    mod_tmp = mod
-    mod_tmp.filterByNContours('>', 2, remove = False)
-    pyimod.ImodWrite(mod_tmp, 'output_01_filterByNContours.mod') 
-    del(mod_tmp)
-    mod.filterByNContours('>', 2)
-
-    # Remove objects touching the border
-    print "Removing border objects."
-    mod_tmp = mod
-    mod_tmp.removeBorderObjects(remove = False)
-    pyimod.ImodWrite(mod_tmp, 'output_02_removeBorderObjects.mod')
-    del(mod_tmp)
-    mod.removeBorderObjects()
+    # Remove empty contours, objects with 2 contours or less, and objects
+    # touching the border, in a single pass. The objects that fail the filters
+    # are first colored red, to create a visual representation of the filter,
+    # and then removed.
+    print "Removing empty contours, small objects, and border objects."
+    keep = mod.filterObjects(nPoints = ('>', 0), nContours = ('>', 2),
+        border = True, remove = False)
+    pyimod.ImodWrite(mod, 'output_01_filterObjects.mod')
+    mod.compressObjects(keep)
     
     # Re-order all contours to go in ascending stack order
     for i in range(0, mod.nObjects):
         mod.Objects[i].sortContours()
     
-    # Write output to a temporary model file
-    fname_tmp = pyimod.utils.random_filename(30)
-    print "Writing to temporary IMOD model file: {0}".format(fname_tmp)
-    pyimod.ImodWrite(mod, fname_tmp)
-    del mod
-
-    # Read temporary IMOD model file
-    mod = pyimod.ImodModel(fname_tmp) 
+    # Fit ellipses to the contours of all objects in one pass, and split the
+    # metrics by object
+    ellipse = np.split(pyimod.ellipse_metrics(mod),
+        np.cumsum([len(x.Contours) for x in mod.Objects])[:-1])
 
     # Loop over all objects. Extract relevant features. Store each object's 
     # feature vector to an individually numbered CSV file.
@@ -1,5 +1,6 @@
 import subprocess
 import numpy as np
+from .ImodMesh import triangle_volume, triangle_area
 
 def imodinfo_e(fname, iObj, ncont):
     """
@@ -21,6 +22,9 @@ def imodinfo_e(fname, iObj, ncont):
         are stored to their corresponding numbered lines. The metrics stored
         are: (1) Semi-major axis length, (2) semi-minor axis length, (3) the
         ratio of semi-major to semi-minor, (4) eccentricity, and (5) long angle.
+
+    See ellipse_metrics for an in-process equivalent, which does not require
+    the model to be written to a file.
     """
 
     # Run the command and get its output
@@ -136,6 +140,549 @@ def imodinfo_v(fname, iObj, ncont):
             sa = float(line.split()[5]) / (1000 ** 2) #Surface Area
     return M, volume, sa
 
+# Columns of the table returned by contour_metrics
+CONTOUR_METRICS = ('object', 'contour', 'nPoints', 'closedLength',
+    'openLength', 'area', 'centroidX', 'centroidY', 'centroidZ',
+    'circularity', 'length', 'width')
+
+def contour_metrics(model, objects = None):
+    """
+    Computes metrics of every contour of the given objects of a model, from
+    the model's point data in memory, in a single vectorized pass over all
+    contours. This replaces running imodinfo -v on each object of the model
+    file. All metrics are computed from the points scaled by the model's
+    pixel sizes (pixelSizeXY in X and Y, pixelSizeZ in Z), and are thus given
+    in the model's units.
+
+    Inputs
+    ======
+    model   - ImodModel instance.
+    objects - List of object indices (0 - nObjects-1) to compute the metrics
+              of. By default, all objects are used.
+
+    Returns
+    =======
+    M - A numpy array of size (ncont x 12), with one line for each contour of
+        the selected objects, in order. The columns, listed in
+        CONTOUR_METRICS, are: (1) the object index, (2) the contour index
+        within the object, (3) the number of points, (4) the closed length,
+        (5) the open length, (6) the enclosed area (shoelace formula, in the
+        X/Y plane), (7-9) the X, Y, and Z coordinates of the centroid (the
+        center of mass of the enclosed area, or the mean of the points for
+        contours without area), (10) the circularity, 4 * pi * area / closed
+        length ** 2, and (11-12) the length and width of the contour's
+        bounding box, aligned to its principal axis.
+    """
+    pts, offsets, objIds, contIds = get_contour_arrays(model, objects)
+    nc = len(objIds)
+    M = np.zeros([nc, len(CONTOUR_METRICS)])
+    M[:, 0] = objIds
+    M[:, 1] = contIds
+    n = np.diff(offsets)
+    M[:, 2] = n
+    if not len(pts):
+        return M
+    geom = contour_geometry(pts, offsets)
+    x, y, z = pts[:, 0], pts[:, 1], pts[:, 2]
+    nxt, cid, cross = geom['next'], geom['cid'], geom['cross']
+    segsum = lambda v: np.bincount(cid, weights = v, minlength = nc)
+    nonempty = n > 0
+    last = offsets[1:][nonempty] - 1
+
+    # Lengths, with and without the segment closing the contour
+    seg = np.sqrt(((pts[nxt] - pts) ** 2).sum(1))
+    M[:, 3] = segsum(seg)
+    M[:, 4] = M[:, 3]
+    M[nonempty, 4] -= seg[last]
+
+    # Enclosed area and its centroid. Contours without area fall back to the
+    # mean of their points.
+    A2 = segsum(cross)
+    M[:, 5] = np.abs(A2) / 2
+    mean = geom['mean']
+    M[:, 6:9] = mean
+    hasArea = A2 != 0
+    M[hasArea, 6] = (segsum((x + x[nxt]) * cross)[hasArea] /
+        (3 * A2[hasArea]))
+    M[hasArea, 7] = (segsum((y + y[nxt]) * cross)[hasArea] /
+        (3 * A2[hasArea]))
+
+    # Circularity
+    hasLength = M[:, 3] > 0
+    M[hasLength, 9] = (4 * np.pi * M[hasLength, 5] /
+        M[hasLength, 3] ** 2)
+
+    # Extent along the principal axis and perpendicular to it
+    theta = geom['theta']
+    dx = x - mean[cid, 0]
+    dy = y - mean[cid, 1]
+    u = dx * np.cos(theta[cid]) + dy * np.sin(theta[cid])
+    v = -dx * np.sin(theta[cid]) + dy * np.cos(theta[cid])
+    starts = offsets[:-1][nonempty]
+    lu = np.maximum.reduceat(u, starts) - np.minimum.reduceat(u, starts)
+    lv = np.maximum.reduceat(v, starts) - np.minimum.reduceat(v, starts)
+    M[nonempty, 10] = np.maximum(lu, lv)
+    M[nonempty, 11] = np.minimum(lu, lv)
+    return M
+
+def ellipse_metrics(model, objects = None):
+    """
+    Fits an ellipse to every contour of the given objects of a model, from
+    the second moments of the area enclosed by each contour, in a single
+    vectorized pass over all contours. This replaces running imodinfo -e on
+    each object of the model file. An ellipse with the same area moments as
+    the contour has semi-axes 2 * sqrt(lambda), where lambda are the
+    eigenvalues of the contour's central moment matrix (normalized by area).
+    Coordinates are scaled by the model's pixel sizes, such that axis lengths
+    are given in the model's units.
+
+    Inputs
+    ======
+    model   - ImodModel instance.
+    objects - List of object indices (0 - nObjects-1) to compute the metrics
+              of. By default, all objects are used.
+
+    Returns
+    =======
+    M - A numpy array of size (ncont x 5), with one line for each contour of
+        the selected objects, in the same order as contour_metrics. As with
+        imodinfo_e, the metrics stored are: (1) Semi-major axis length, (2)
+        semi-minor axis length, (3) the ratio of semi-major to semi-minor, (4)
+        eccentricity, and (5) long angle, in degrees from the X axis. Contours
+        that enclose no area are stored as NaNs.
+    """
+    pts, offsets, objIds, contIds = get_contour_arrays(model, objects)
+    nc = len(objIds)
+    M = np.zeros([nc, 5])
+    M.fill(np.nan)
+    if not len(pts):
+        return M
+    geom = contour_geometry(pts, offsets)
+    cid, nxt = geom['cid'], geom['next']
+    segsum = lambda v: np.bincount(cid, weights = v, minlength = nc)
+
+    # Area moments by Green's theorem, about the mean of each contour's points
+    x = pts[:, 0] - geom['mean'][cid, 0]
+    y = pts[:, 1] - geom['mean'][cid, 1]
+    x1, y1 = x[nxt], y[nxt]
+    cross = x * y1 - x1 * y
+    A = segsum(cross) / 2
+    ok = np.abs(A) > 0
+    A = A[ok]
+    cx = segsum((x + x1) * cross)[ok] / (6 * A)
+    cy = segsum((y + y1) * cross)[ok] / (6 * A)
+    mxx = segsum((x * x + x * x1 + x1 * x1) * cross)[ok] / (12 * A) - cx ** 2
+    myy = segsum((y * y + y * y1 + y1 * y1) * cross)[ok] / (12 * A) - cy ** 2
+    mxy = segsum((x * y1 + 2 * x * y + 2 * x1 * y1 + x1 * y) *
+        cross)[ok] / (24 * A) - cx * cy
+
+    # Eigenvalues of the central moment matrix
+    mid = (mxx + myy) / 2
+    diff = np.sqrt(((mxx - myy) / 2) ** 2 + mxy ** 2)
+    a = 2 * np.sqrt(np.maximum(mid + diff, 0))
+    b = 2 * np.sqrt(np.maximum(mid - diff, 0))
+    M[ok, 0] = a
+    M[ok, 1] = b
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        M[ok, 2] = a / b
+        M[ok, 3] = np.sqrt(1 - (b / a) ** 2)
+    M[ok, 4] = np.degrees(0.5 * np.arctan2(2 * mxy, mxx - myy))
+    return M
+
+def mesh_metrics(model, objects = None):
+    """
+    Computes the volume and surface area of the meshes of the given objects
+    of a model, in a single vectorized pass over the triangles of all meshes.
+    This replaces parsing the 'Total volume inside mesh' and 'Total mesh
+    surface area' output of imodinfo -v for each object. Coordinates are
+    scaled by the model's pixel sizes (pixelSizeXY in X and Y, pixelSizeZ in
+    Z), such that the metrics are given in the model's units.
+
+    Inputs
+    ======
+    model   - ImodModel instance.
+    objects - List of object indices (0 - nObjects-1) to compute the metrics
+              of. By default, all objects are used.
+
+    Returns
+    =======
+    M - A numpy array of size (nobj x 2), holding the mesh volume and surface
+        area of each of the selected objects, in order. Volumes are summed
+        over the meshes of an object, each computed with the divergence
+        theorem. Objects without meshes have zero volume and surface area.
+    """
+    if objects is None:
+        objects = range(model.nObjects)
+    scale = [model.pixelSizeXY, model.pixelSizeXY, model.pixelSizeZ]
+    tris = [np.zeros([0, 3, 3])]
+    meshIds = []
+    meshObjs = []
+    for i, iObj in enumerate(objects):
+        for mesh in model.Objects[iObj].Meshes:
+            tri = mesh.get_triangle_coords(scale)
+            tris.append(tri)
+            meshIds.append(np.repeat(len(meshObjs), len(tri)))
+            meshObjs.append(i)
+    tris = np.concatenate(tris)
+    meshIds = np.concatenate(meshIds or [[]]).astype(int)
+
+    M = np.zeros([len(objects), 2])
+    if meshObjs:
+        vol = np.abs(np.bincount(meshIds, weights = triangle_volume(tris),
+            minlength = len(meshObjs)))
+        sa = np.bincount(meshIds, weights = triangle_area(tris),
+            minlength = len(meshObjs))
+        M[:, 0] = np.bincount(meshObjs, weights = vol,
+            minlength = len(objects))
+        M[:, 1] = np.bincount(meshObjs, weights = sa,
+            minlength = len(objects))
+    return M
+
+def get_contour_arrays(model, objects = None, scale = True):
+    """
+    Gathers the points of all contours of the given objects (by default, all
+    objects) of a model into a single array.
+
+    Returns
+    =======
+    pts     - (N x 3) array of the points of all contours, scaled by the
+              model's pixel sizes, unless scale is False.
+    offsets - Array of ncont + 1 offsets, such that the points of contour i
+              are pts[offsets[i]:offsets[i+1]].
+    objIds  - Object index of each contour.
+    contIds - Index of each contour within its object.
+    """
+    if objects is None:
+        objects = range(model.nObjects)
+    pts = []
+    nPoints = []
+    objIds = []
+    contIds = []
+    for iObj in objects:
+        pts_i, nPoints_i = get_object_points(model.Objects[iObj])
+        pts.append(pts_i)
+        nPoints.append(nPoints_i)
+        objIds.append(np.repeat(iObj, len(nPoints_i)))
+        contIds.append(np.arange(len(nPoints_i)))
+    nPoints = np.concatenate(nPoints or [[]]).astype(np.int64)
+    offsets = np.zeros(len(nPoints) + 1, dtype = np.int64)
+    np.cumsum(nPoints, out = offsets[1:])
+    if pts:
+        pts = np.concatenate(pts).astype(float).reshape(-1, 3)
+    else:
+        pts = np.zeros([0, 3])
+    if scale:
+        pts *= [model.pixelSizeXY, model.pixelSizeXY, model.pixelSizeZ]
+    return (pts, offsets, np.concatenate(objIds or [[]]).astype(int),
+        np.concatenate(contIds or [[]]).astype(int))
+
+def get_object_points(obj):
+    """
+    Returns the unscaled points of all contours of an object as a single
+    (N x 3) array, and the array of the number of points of each contour.
+    """
+    contours = obj.Contours
+    if hasattr(contours, 'offsets'):
+        # Compactly stored contours (see ImodContourArray)
+        return contours.points, contours.nPoints
+    nPoints = np.asarray([len(c.points) // 3 for c in contours], dtype = int)
+    if not len(contours):
+        return np.zeros([0, 3]), nPoints
+    return np.concatenate([np.asarray(c.points, dtype = float).reshape(-1, 3)
+        for c in contours]), nPoints
+
+def get_contour_z(pts, offsets):
+    """
+    Returns the Z value of each contour, as the smallest of the truncated Z
+    coordinates of its points (see ImodObject.get_z_values), or -1 for empty
+    contours, given the point array and offsets of get_contour_arrays.
+    """
+    nPoints = np.diff(offsets)
+    z = np.zeros(len(nPoints), dtype = int) - 1
+    full = nPoints > 0
+    if full.any():
+        z[full] = np.minimum.reduceat(pts[:, 2].astype(int),
+            offsets[:-1][full])
+    return z
+
+def contour_geometry(pts, offsets):
+    """
+    Returns the per-point and per-contour quantities shared by the vectorized
+    contour metrics, as a dictionary of: cid, the contour index of each point;
+    next, the index of the next point of each point's contour, wrapping from
+    the last point to the first; cross, the cross product x[i] * y[next] -
+    x[next] * y[i] of each point, whose sum over a contour is twice its signed
+    area; mean, the (ncont x 3) mean of the points of each contour; and the
+    (ncont x 3) second central moments Sxx, Syy, Sxy (summed, not averaged)
+    and the angle theta of the principal axis of each contour's points.
+    """
+    nc = len(offsets) - 1
+    n = np.diff(offsets)
+    cid = np.repeat(np.arange(nc), n)
+    nxt = np.arange(len(pts)) + 1
+    nonempty = n > 0
+    nxt[offsets[1:][nonempty] - 1] = offsets[:-1][nonempty]
+    x, y = pts[:, 0], pts[:, 1]
+    cross = x * y[nxt] - x[nxt] * y
+    segsum = lambda v: np.bincount(cid, weights = v, minlength = nc)
+    mean = np.zeros([nc, 3])
+    for i in range(3):
+        mean[nonempty, i] = segsum(pts[:, i])[nonempty] / n[nonempty]
+    dx = x - mean[cid, 0]
+    dy = y - mean[cid, 1]
+    Sxx = segsum(dx * dx)
+    Syy = segsum(dy * dy)
+    Sxy = segsum(dx * dy)
+    theta = 0.5 * np.arctan2(2 * Sxy, Sxx - Syy)
+    return {'cid': cid,
+            'next': nxt,
+            'cross': cross,
+            'mean': mean,
+            'moments': np.column_stack([Sxx, Syy, Sxy]),
+            'theta': theta}
+
+def contour_spans(pts, offsets, shape, groups = None):
+    """
+    Scan-converts closed contours into horizontal runs of pixels, for all
+    contours at once. Pixel (row, col) of an image of the given (ny, nx)
+    shape is inside a contour if its center, (col + 0.5, row + 0.5) in model
+    coordinates, lies inside the polygon of the contour's X and Y
+    coordinates, by the even-odd rule. Rows are in model order, i.e. as
+    stored in MRC files, and not flipped as by get_slice.
+
+    The crossings of every polygon edge with the pixel rows it spans are
+    computed in a single pass, then sorted by contour, row, and X, such that
+    consecutive pairs of crossings delimit the runs.
+
+    If groups, an array of the group of each contour, is given, the
+    crossings are paired per group rather than per contour, such that the
+    contours of a group are combined by the even-odd rule: contours inside
+    another contour of their group are holes in it.
+
+    Returns
+    =======
+    cid  - Contour index (0 - ncont-1) of each run, or its group if groups is
+           given, in ascending order.
+    rows - Row of each run.
+    c0   - First column of each run.
+    c1   - Column after the last column of each run, such that run i covers
+           columns c0[i] to c1[i]-1. Runs are clipped to the image.
+    """
+    ny, nx = shape
+    offsets = np.asarray(offsets, dtype = np.int64)
+    nPoints = np.diff(offsets)
+    cid = np.repeat(np.arange(len(nPoints)) if groups is None else
+        np.asarray(groups, dtype = np.int64), nPoints)
+    nxt = np.arange(len(pts)) + 1
+    full = nPoints > 0
+    nxt[offsets[1:][full] - 1] = offsets[:-1][full]
+    x0, y0 = pts[:, 0], pts[:, 1]
+    x1, y1 = pts[nxt, 0], pts[nxt, 1]
+
+    # Rows whose centers lie in [ymin, ymax) of each edge, such that every
+    # row crosses a closed polygon an even number of times
+    r0 = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, ny).astype(np.int64)
+    r1 = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, ny).astype(np.int64)
+    n = r1 - r0
+    e = np.repeat(np.arange(len(pts)), n)
+    rows = (np.repeat(r0 - np.cumsum(n) + n, n) +
+        np.arange(n.sum(), dtype = np.int64))
+    xc = x0[e] + (rows + 0.5 - y0[e]) * (x1[e] - x0[e]) / (y1[e] - y0[e])
+    order = np.lexsort((xc, rows, cid[e]))
+    xc = xc[order]
+    rows = rows[order][0::2]
+    cid = cid[e][order][0::2]
+
+    # Columns whose centers lie in [xa, xb) of each pair of crossings
+    c0 = np.clip(np.ceil(xc[0::2] - 0.5), 0, nx).astype(np.int64)
+    c1 = np.clip(np.ceil(xc[1::2] - 0.5), 0, nx).astype(np.int64)
+    full = c1 > c0
+    return cid[full], rows[full], c0[full], c1[full]
+
+def span_pixels(rows, c0, c1):
+    """
+    Expands the runs of contour_spans into the (row, col) coordinates of
+    their pixels. Returns the index of the run of each pixel, and the arrays
+    of rows and columns.
+    """
+    n = c1 - c0
+    run = np.repeat(np.arange(len(n)), n)
+    cols = (np.repeat(c0 - np.cumsum(n) + n, n) +
+        np.arange(n.sum(), dtype = np.int64))
+    return run, rows[run], cols
+
+def contour_samples(pts, offsets, step = 1.0):
+    """
+    Samples closed contours along their edges, for all contours at once.
+    Each edge, from a point to the next point of its contour (wrapping from
+    the last point to the first), is sampled at its start and at regular
+    intervals of at most step after it.
+
+    Returns
+    =======
+    cid - Contour index (0 - ncont-1) of each sample, in ascending order.
+    x   - X coordinate of each sample.
+    y   - Y coordinate of each sample.
+    """
+    offsets = np.asarray(offsets, dtype = np.int64)
+    nPoints = np.diff(offsets)
+    cid = np.repeat(np.arange(len(nPoints)), nPoints)
+    nxt = np.arange(len(pts)) + 1
+    full = nPoints > 0
+    nxt[offsets[1:][full] - 1] = offsets[:-1][full]
+    d = pts[nxt, :2] - pts[:, :2]
+    k = np.maximum(np.ceil(np.sqrt((d ** 2).sum(1)) / step), 1).astype(
+        np.int64)
+    e = np.repeat(np.arange(len(pts)), k)
+    t = (np.arange(k.sum()) - np.repeat(np.cumsum(k) - k, k)) / k[e].astype(
+        float)
+    return cid[e], pts[e, 0] + t * d[e, 0], pts[e, 1] + t * d[e, 1]
+
+def fill_contours(pts, offsets, labels, shape, dtype = np.uint8, out = None,
+    groups = None):
+    """
+    Fills closed contours into a 2D image of the given (ny, nx) shape, with
+    one label per contour (see contour_spans for the pixels inside a
+    contour). Contours are filled in order, such that where contours
+    overlap, the label of the last one is kept. If groups is given, the
+    contours of each group are filled together, with holes, and labels
+    holds the label of each group.
+
+    Inputs
+    ======
+    pts     - (N x 2) or (N x 3) array of the points of all contours.
+    offsets - Array of ncont + 1 offsets, such that the points of contour i
+              are pts[offsets[i]:offsets[i+1]].
+    labels  - Label of each contour.
+    shape   - (ny, nx) shape of the image.
+    dtype   - Data type of the image. Default is uint8.
+    out     - Image to fill. By default, a new image of zeros is returned.
+    groups  - Group (0 - ngroups-1) of each contour, in ascending order, as
+              for contour_spans.
+    """
+    if out is None:
+        out = np.zeros(shape, dtype = dtype)
+    cid, rows, c0, c1 = contour_spans(np.asarray(pts, dtype = float),
+        offsets, shape, groups = groups)
+    run, rows, cols = span_pixels(rows, c0, c1)
+    out[rows, cols] = np.asarray(labels)[cid[run]]
+    return out
+
+def trace_labels(img, simplify = True, holes = False):
+    """
+    Traces the boundaries of the labeled regions of a 2D image, for all
+    labels at once, as closed contours along the pixel edges. Pixel (row,
+    col) covers [col, col + 1) x [row, row + 1) in model coordinates, such
+    that filling the contours by the pixel centers inside them (see
+    contour_spans) gives back the regions. Rows are in model order, as
+    stored in MRC files.
+
+    Every pixel edge between two labels is turned into a directed edge of
+    each nonzero label, with the label on its left, and each edge is linked
+    to the edge of its label that starts where it ends. Where two pixels of
+    a label only touch diagonally, the left turn is taken, such that each
+    contour bounds a 4-connected region. The cycles of linked edges are then
+    ordered by pointer jumping, in O(log n) vectorized passes. Outer
+    boundaries run counterclockwise, and the boundaries of holes clockwise.
+
+    Inputs
+    ======
+    img      - 2D array of integer labels, with 0 as background.
+    simplify - If True (default), keeps only the corners of the contours,
+               dropping the points along straight runs of pixel edges.
+    holes    - If True, the boundaries of holes in the regions are returned
+               as contours of their label. By default, they are dropped.
+
+    Returns
+    =======
+    labels  - Label of each contour.
+    offsets - Array of ncont + 1 offsets, such that the points of contour i
+              are pts[offsets[i]:offsets[i+1]].
+    pts     - (N x 2) array of the X and Y coordinates of the points.
+    """
+    img = np.asarray(img)
+    ny, nx = img.shape
+    pad = np.zeros([ny + 2, nx + 2], dtype = img.dtype)
+    pad[1:-1, 1:-1] = img
+
+    # Directed edges, as their start corner, direction, and label, from the
+    # horizontal edges between the pixels below and above them, and the
+    # vertical edges between the pixels left and right of them
+    below, above = pad[:-1, 1:-1], pad[1:, 1:-1]
+    left, right = pad[1:-1, :-1], pad[1:-1, 1:]
+    sx, sy, dx, dy, lab = [], [], [], [], []
+    for side, other, x0, y0, ddx, ddy in [
+        (above, below, 0, 0, 1, 0),
+        (below, above, 1, 0, -1, 0),
+        (right, left, 0, 1, 0, -1),
+        (left, right, 0, 0, 0, 1)]:
+        r, c = np.nonzero((side != other) & (side != 0))
+        sx.append(c + x0)
+        sy.append(r + y0)
+        dx.append(np.repeat(ddx, len(r)))
+        dy.append(np.repeat(ddy, len(r)))
+        lab.append(side[r, c])
+    sx, sy, dx, dy, lab = [np.concatenate(x).astype(np.int64)
+        for x in [sx, sy, dx, dy, lab]]
+    n = len(sx)
+    if not n:
+        return (np.zeros(0, dtype = np.int64), np.zeros(1, dtype = np.int64),
+            np.zeros([0, 2]))
+
+    # Link each edge to the edge of its label starting at its end corner,
+    # taking the left turn where two edges start there
+    uniq, rank = np.unique(lab, return_inverse = True)
+    nv = (nx + 1) * (ny + 1)
+    skey = rank * nv + sy * (nx + 1) + sx
+    ekey = rank * nv + (sy + dy) * (nx + 1) + sx + dx
+    so = np.argsort(skey, kind = 'mergesort')
+    lo = np.searchsorted(skey[so], ekey, side = 'left')
+    ncand = np.searchsorted(skey[so], ekey, side = 'right') - lo
+    succ = so[lo]
+    two = np.flatnonzero(ncand == 2)
+    alt = so[lo[two] + 1]
+    right_turn = dx[two] * dy[succ[two]] - dy[two] * dx[succ[two]] < 0
+    succ[two[right_turn]] = alt[right_turn]
+
+    # Start of each cycle, as its smallest edge, and distance of each edge
+    # to the last edge of its cycle, by pointer jumping
+    nIter = int(np.ceil(np.log2(n))) + 1
+    head = np.arange(n)
+    jump = succ.copy()
+    for _ in range(nIter):
+        head = np.minimum(head, head[jump])
+        jump = jump[jump]
+    last = succ == head
+    jump = np.where(last, np.arange(n), succ)
+    dist = (~last).astype(np.int64)
+    for _ in range(nIter):
+        dist = dist + dist[jump]
+        jump = jump[jump]
+    order = np.lexsort((-dist, head))
+    heads, cid = np.unique(head[order], return_inverse = True)
+    nEdges = np.bincount(cid)
+    starts = np.cumsum(nEdges) - nEdges
+
+    # Signed area of each cycle, positive for outer boundaries
+    ex, ey = sx + dx, sy + dy
+    area = np.bincount(cid, weights = (sx * ey - ex * sy)[order])
+    keep = np.ones(len(order), dtype = bool)
+    if simplify:
+        prev = np.arange(len(order)) - 1
+        prev[starts] = starts + nEdges - 1
+        turn = ((dx[order] != dx[order][prev]) |
+                (dy[order] != dy[order][prev]))
+        keep &= turn
+    if not holes:
+        keep &= area[cid] > 0
+    order, cid = order[keep], cid[keep]
+    nPoints = np.bincount(cid, minlength = len(heads))
+    full = nPoints > 0
+    offsets = np.zeros(full.sum() + 1, dtype = np.int64)
+    np.cumsum(nPoints[full], out = offsets[1:])
+    pts = np.column_stack([sx[order], sy[order]]).astype(float)
+    return uniq[rank[heads[full]]], offsets, pts
+
 def calc_delta_centroid(iObj, z, fv):
     """
     Analyzes the change in centroid position in (X, Y) across slices, and
@@ -1,7 +1,340 @@
 import struct
+import threading
+import Queue
+from collections import OrderedDict
 
 import numpy as np
 
+# Numpy data types of the MRC data modes. Mode 0 is unsigned, unless the
+# header flags it as signed (see MrcVolume).
+MRC_MODES = {0: 'u1',
+             1: 'i2',
+             2: 'f4',
+             6: 'u2',
+             12: 'f2'}
+
+# MRC data mode of each Numpy data type that can be written (see
+# write_mrc_header)
+MRC_DTYPES = {'u1': 0,
+              'i1': 0,
+              'i2': 1,
+              'f4': 2,
+              'u2': 6,
+              'f2': 12}
+
+# IMOD stamp, whose presence marks the bytes of mode 0 files as signed when
+# bit 0 of the flags that follow it is set.
+IMOD_STAMP = 1146047817
+
+class MrcVolume(object):
+    """
+    Memory mapped MRC volume. The header is parsed once, and the data is
+    exposed as a read-only Numpy memory map of shape (nz, ny, nx), such that
+    indexing the volume, e.g. vol[z], vol[z, y0:y1, x0:x1], or vol[::2],
+    returns views that read only the bytes they cover, without copying.
+
+    Data modes 0 (8-bit), 1 (16-bit signed), 2 (32-bit float), 6 (16-bit
+    unsigned), and 12 (16-bit float) are supported, in either byte order,
+    which is read from the MACHST field (or guessed from the header, for old
+    files without it). The extended header, of nsymbt bytes, is skipped.
+
+    Rows are stored bottom to top, as in IMOD. get_slice() returns slices
+    flipped vertically, as mrc_to_numpy does.
+    """
+
+    def __init__(self,
+        fname,
+        mode = 'r',
+        memmap = True):
+            self.fname = fname
+            self.data = None
+            self.read_header()
+            if memmap:
+                self.data = np.memmap(fname, dtype = self.dtype, mode = mode,
+                    offset = self.dataOffset, shape = self.shape)
+
+    def read_header(self):
+        with open(self.fname, mode = "rb") as fid:
+            header = fid.read(1024)
+        if len(header) < 1024:
+            raise ValueError('{0} is not a valid MRC file.'.format(
+                self.fname))
+
+        # Byte order: 0x44 ('D') for little endian, 0x11 for big endian. Old
+        # files without MACHST are checked for valid dimensions and data mode
+        # instead.
+        machst = ord(header[212])
+        if machst == 0x44:
+            self.byteorder = '<'
+        elif machst == 0x11:
+            self.byteorder = '>'
+        else:
+            dims = struct.unpack('<4i', header[0:16])
+            if all(0 < x < 1 << 24 for x in dims[:3]) and dims[3] in MRC_MODES:
+                self.byteorder = '<'
+            else:
+                self.byteorder = '>'
+        bo = self.byteorder
+
+        self.nx, self.ny, self.nz, self.mode = struct.unpack(bo + '4i',
+            header[0:16])
+        self.nxstart, self.nystart, self.nzstart = struct.unpack(bo + '3i',
+            header[16:28])
+        self.mx, self.my, self.mz = struct.unpack(bo + '3i', header[28:40])
+        self.cella = struct.unpack(bo + '3f', header[40:52])
+        self.dmin, self.dmax, self.dmean = struct.unpack(bo + '3f',
+            header[76:88])
+        self.nsymbt = struct.unpack(bo + 'i', header[92:96])[0]
+        imodStamp, imodFlags = struct.unpack(bo + '2i', header[152:160])
+        self.origin = struct.unpack(bo + '3f', header[196:208])
+        self.nlabl = struct.unpack(bo + 'i', header[220:224])[0]
+        self.labels = [header[224+80*i:304+80*i].rstrip(' \0')
+            for i in range(min(max(self.nlabl, 0), 10))]
+
+        if self.mode not in MRC_MODES:
+            raise ValueError('MRC data mode {0} is not supported.'.format(
+                self.mode))
+        dtype = MRC_MODES[self.mode]
+        if self.mode == 0 and imodStamp == IMOD_STAMP and imodFlags & 1:
+            dtype = 'i1'
+        self.dtype = np.dtype(bo + dtype)
+        self.dataOffset = 1024 + max(self.nsymbt, 0)
+
+        # Pixel spacing, from the cell dimensions and sampling
+        self.pixelSpacing = tuple(c / m if m else 1.0 for c, m in
+            zip(self.cella, [self.mx, self.my, self.mz]))
+        return self
+
+    @property
+    def shape(self):
+        return (self.nz, self.ny, self.nx)
+
+    def __len__(self):
+        return self.nz
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __repr__(self):
+        return '<MrcVolume {0}: {1} x {2} x {3}, mode {4}>'.format(
+            self.fname, self.nx, self.ny, self.nz, self.mode)
+
+    def get_slice(self, z, flip = True):
+        """
+        Returns a view of slice z (0 - nz-1), flipped vertically unless flip
+        is False.
+        """
+        img = self.data[z]
+        return img[::-1] if flip else img
+
+    def subvolume(self, x = None, y = None, z = None, step = 1):
+        """
+        Returns a view of the sub-volume spanning the (start, end) ranges of
+        x, y, and z, each of which defaults to the full extent, sampled every
+        step voxels along each axis.
+        """
+        x = x or (0, self.nx)
+        y = y or (0, self.ny)
+        z = z or (0, self.nz)
+        return self.data[z[0]:z[1]:step, y[0]:y[1]:step, x[0]:x[1]:step]
+
+    def close(self):
+        """
+        Releases the memory map. Views returned earlier keep it open until
+        they are deleted.
+        """
+        self.data = None
+
+class MrcSliceCache(object):
+    """
+    Bounded LRU cache of the decoded slices of an MRC volume. Slices are read
+    from the volume's memory map (flipped vertically, as by get_slice) on
+    first access, and kept in memory until the total size of the cached
+    slices exceeds budget bytes, at which point the least recently used
+    slices are dropped.
+
+    If readahead is > 0, a background thread prefetches the next readahead
+    slices whenever slices are accessed sequentially (in either direction),
+    such that reading from slow storage overlaps with processing. The hits,
+    misses, and prefetched counters can be used to size the cache.
+
+    cache = MrcSliceCache('stack.mrc', budget = 2 << 30, readahead = 4)
+    for z in range(cache.volume.nz):
+        img = cache[z]
+    print cache.stats()
+    cache.close()
+    """
+
+    def __init__(self,
+        volume,
+        budget = 1 << 30,
+        readahead = 0,
+        flip = True):
+            if not isinstance(volume, MrcVolume):
+                volume = MrcVolume(volume)
+            self.volume = volume
+            self.budget = budget
+            self.readahead = readahead
+            self.flip = flip
+            self.slices = OrderedDict()
+            self.nBytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.prefetched = 0
+            self.last = None
+            self.pending = set()
+            self.cond = threading.Condition()
+            self.queue = None
+            self.thread = None
+            if readahead > 0:
+                self.queue = Queue.Queue()
+                self.thread = threading.Thread(target = self.prefetch_loop)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def __getitem__(self, z):
+        return self.get(z)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, z):
+        """
+        Returns slice z (0 - nz-1), from the cache if present.
+        """
+        if not 0 <= z < self.volume.nz:
+            raise IndexError('Slice {0} is out of range.'.format(z))
+        with self.cond:
+            # Wait for a slice that is being prefetched
+            while z in self.pending:
+                self.cond.wait()
+            img = self.slices.pop(z, None)
+            if img is not None:
+                self.slices[z] = img
+                self.hits += 1
+            else:
+                self.misses += 1
+        if img is None:
+            img = self.load(z)
+            self.insert(z, img)
+
+        # Prefetch ahead of sequential scans
+        if self.queue is not None and self.last is not None and \
+            abs(z - self.last) == 1:
+            self.schedule(range(z + (z - self.last),
+                z + (z - self.last) * (self.readahead + 1), z - self.last))
+        self.last = z
+        return img
+
+    def load(self, z):
+        return np.array(self.volume.get_slice(z, flip = self.flip))
+
+    def insert(self, z, img):
+        with self.cond:
+            if z not in self.slices:
+                self.slices[z] = img
+                self.nBytes += img.nbytes
+            while self.nBytes > self.budget and len(self.slices) > 1:
+                old = self.slices.popitem(last = False)[1]
+                self.nBytes -= old.nbytes
+
+    def schedule(self, slices):
+        with self.cond:
+            for z in slices:
+                if (0 <= z < self.volume.nz and z not in self.slices and
+                    z not in self.pending):
+                    self.pending.add(z)
+                    self.queue.put(z)
+
+    def prefetch_loop(self):
+        while True:
+            z = self.queue.get()
+            if z is None:
+                break
+            try:
+                img = self.load(z)
+                self.insert(z, img)
+                with self.cond:
+                    self.prefetched += 1
+            finally:
+                with self.cond:
+                    self.pending.discard(z)
+                    self.cond.notify_all()
+
+    def stats(self):
+        """
+        Returns a dictionary of the cache's hit, miss, and prefetch counters,
+        and of the number and total size of the cached slices.
+        """
+        with self.cond:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'prefetched': self.prefetched,
+                    'nSlices': len(self.slices),
+                    'nBytes': self.nBytes}
+
+    def clear(self):
+        with self.cond:
+            self.slices.clear()
+            self.nBytes = 0
+
+    def close(self):
+        """
+        Stops the read-ahead thread, and drops the cached slices.
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            self.queue = None
+        self.clear()
+
+def write_mrc_header(fid, shape, dtype, pixelSpacing = (1, 1, 1),
+    origin = (0, 0, 0), stats = (0, 0, 0), labels = ()):
+    """
+    Writes a 1024 byte little endian MRC header, with no extended header, at
+    the current position of an open file, such that the data of an MRC
+    volume can then be written slice by slice. The header can be rewritten
+    once the data is known, e.g. to update its statistics.
+
+    Inputs
+    ======
+    fid          - File ID of the MRC file, opened in binary writing mode.
+    shape        - (nz, ny, nx) shape of the volume.
+    dtype        - Numpy data type of the data, one of those in MRC_DTYPES.
+                   Signed bytes are flagged in the IMOD header fields.
+    pixelSpacing - X, Y, and Z pixel spacing, in Angstroms.
+    origin       - X, Y, and Z origin.
+    stats        - Minimum, maximum, and mean of the data.
+    labels       - Up to 10 strings of up to 80 characters each.
+    """
+    dtype = np.dtype(dtype)
+    code = dtype.kind + str(dtype.itemsize)
+    if code not in MRC_DTYPES:
+        raise ValueError('Data type {0} cannot be written to MRC files.'.format(
+            dtype))
+    nz, ny, nx = shape
+    header = bytearray(1024)
+    struct.pack_into('<4i', header, 0, nx, ny, nz, MRC_DTYPES[code])
+    struct.pack_into('<3i', header, 28, nx, ny, nz)
+    struct.pack_into('<3f', header, 40, *[n * p for n, p in
+        zip([nx, ny, nz], pixelSpacing)])
+    struct.pack_into('<3f', header, 52, 90, 90, 90)
+    struct.pack_into('<3i', header, 64, 1, 2, 3)
+    struct.pack_into('<3f', header, 76, *stats)
+    struct.pack_into('<2i', header, 152, IMOD_STAMP, int(code == 'i1'))
+    struct.pack_into('<3f', header, 196, *origin)
+    header[208:216] = 'MAP \x44\x44\x00\x00'
+    labels = list(labels)[:10]
+    struct.pack_into('<i', header, 220, len(labels))
+    for i, label in enumerate(labels):
+        label = label[:80]
+        header[224+80*i:224+80*i+len(label)] = label
+    fid.write(header)
+
 def get_dims(fname):
     """
     Returns the X, Y, and Z dimensions of the input MRC file.
@@ -17,17 +350,19 @@ def get_dims(fname):
     nz - Max Z dimension.
     """
 
-    with open(fname, mode = "rb") as fid:
-        # Read the image dimensions, nx, ny, and nz from the MRC file header
-        nx = struct.unpack('<i', fid.read(4))[0]
-        ny = struct.unpack('<i', fid.read(4))[0]
-        nz = struct.unpack('<i', fid.read(4))[0]
-    return nx, ny, nz
+    # Read the image dimensions, nx, ny, and nz from the MRC file header
+    vol = MrcVolume(fname, memmap = False)
+    return vol.nx, vol.ny, vol.nz
 
 def mrc_to_numpy(fid, nx, ny):
     """
     Given the file ID of an open MRC file and the file's dimensions, return 
-    the current slice as a Numpy array.
+    the current slice as a Numpy array, and advance the file to the next
+    slice. The data type, byte order, and data offset are read from the
+    file's header (see MrcVolume), such that the file may be positioned
+    anywhere from the end of the 1024 byte header to the start of a slice.
+
+    Deprecated: index an MrcVolume, or use get_slice, instead.
 
     Inputs
     ======
@@ -37,10 +372,11 @@ def mrc_to_numpy(fid, nx, ny):
 
     Returns
     =======
-    imgSlice - A Numpy array of the MRC slice.
+    imgSlice - A Numpy array of the MRC slice, in the file's data type.
     """
-    # Get the Numpy array, assuming the MRC file is 8-bit, unsigned integer
-    imgSlice = np.fromfile(fid, dtype = np.uint8, count = nx * ny)
+    vol = MrcVolume(fid.name, memmap = False)
+    fid.seek(max(fid.tell(), vol.dataOffset))
+    imgSlice = np.fromfile(fid, dtype = vol.dtype, count = nx * ny)
 
     # Reshape the Numpy array into the proper dimensions
     imgSlice = np.reshape(imgSlice, [ny, nx])
@@ -51,9 +387,25 @@ def mrc_to_numpy(fid, nx, ny):
 
     return imgSlice
 
+def mrc_memmap(fname):
+    """
+    Returns the image data of an MRC file as a read-only Numpy memory map of
+    shape (nz, ny, nx), such that only the slices that are accessed are read
+    from disk. Slices are stored as in the file, i.e. not flipped (see
+    mrc_to_numpy).
+
+    Inputs
+    ======
+    fname - Filename of the MRC file.
+    """
+    return MrcVolume(fname).data
+
 def get_slice(fname, nSlice):
     """
-    Returns a numpy array consisting of a given slice of an input MRC file.
+    Returns a numpy array consisting of a given slice of an input MRC file,
+    flipped vertically. The slice is read through a memory map of the file
+    (see MrcVolume), and returned as a new, writable array in the file's
+    data type.
 
     Inputs
     ======
@@ -64,13 +416,4 @@ def get_slice(fname, nSlice):
     =======
     imgSlice - A Numpy array of the MRC slice.
     """
-
-    nx, ny, nz = get_dims(fname)
-
-    with open(fname, mode = "rb") as fid:
-        # Seek to the proper location in the binary file
-        fid.seek(1024 + (nx * ny) * (nSlice - 1) ,0) 
-
-        # Get the image slice as a Numpy array
-        imgSlice = mrc_to_numpy(fid, nx, ny)
-    return imgSlice
+    return np.array(MrcVolume(fname).get_slice(nSlice - 1))
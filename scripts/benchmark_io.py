@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+"""
+Micro-benchmarks of model file reading and writing. A synthetic model with
+many small objects is written to a temporary file, and the time taken to read
+and write it is reported, along with the time taken to decode the fixed-size
+header blocks (OBJT header, per-object VIEW) one field at a time versus with
+the precompiled layouts in pyimod.binspec. A second, point-heavy model with a
+few large contours and meshes is used to time a write/read round trip, which
+is checked to reproduce the file byte for byte.
+"""
+
+from __future__ import division
+
+import os
+import sys
+import struct
+import filecmp
+import timeit
+import numpy as np
+from optparse import OptionParser
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+from pyimod import *
+from pyimod.binspec import (OBJECT_HEADER, OBJECT_HEADER_FIELDS, OBJECT_VIEW,
+    OBJECT_VIEW_FIELDS, pack_fields, unpack_fields)
+
+def parse_args():
+    global p
+    p = OptionParser(usage = "%prog [options]")
+    p.add_option("--objects",
+                 dest = "nObjects",
+                 type = "int",
+                 default = 20000,
+                 help = "Number of objects in the synthetic model.")
+    p.add_option("--points",
+                 dest = "nPoints",
+                 type = "int",
+                 default = 1000000,
+                 help = "Number of points in the point-heavy synthetic "
+                        "model.")
+    p.add_option("--repeat",
+                 dest = "repeat",
+                 type = "int",
+                 default = 3,
+                 help = "Number of repetitions of each timing. The best time "
+                        "is reported.")
+    (opts, args) = p.parse_args()
+    return opts
+
+def make_model(nObjects):
+    """
+    Returns a model with nObjects objects, each with a single 4 point contour
+    and a view.
+    """
+    mod = ImodModel()
+    mod.view_set = 1
+    mod.setImageSize(1000, 1000, 1000)
+    for iObject in range(nObjects):
+        mod.addObject()
+        mod.Objects[-1].addContour()
+        mod.Objects[-1].Contours[-1].points = [1, 1, 1, 2, 1, 1, 2, 2, 1, 1,
+            2, 1]
+        mod.Objects[-1].Contours[-1].nPoints = 4
+    return mod
+
+def make_point_model(nPoints, nObjects = 4, nContours = 10):
+    """
+    Returns a model with a total of nPoints random points, split evenly across
+    nObjects objects of nContours contours each. Each object also has a mesh
+    with one vertex/normal pair per point.
+    """
+    mod = ImodModel()
+    mod.setImageSize(1000, 1000, 1000)
+    n = max(1, nPoints // (nObjects * nContours))
+    for iObject in range(nObjects):
+        mod.addObject()
+        obj = mod.Objects[-1]
+        for iContour in range(nContours):
+            obj.addContour()
+            obj.Contours[-1].points = list(1000 * np.random.rand(3 * n))
+            obj.Contours[-1].nPoints = n
+        m = n * nContours
+        indices = [-23] + range(0, 2 * m, 2) + [-22, -1]
+        obj.Meshes.append(ImodMesh(nVertices = 2 * m,
+            nIndices = len(indices), vertices = list(np.random.rand(6 * m)),
+            indices = indices))
+        obj.nMeshes += 1
+    return mod
+
+def unpack_per_field(fmts, data):
+    """
+    Decodes data one field at a time, given a list of single-field formats.
+    """
+    values = []
+    pos = 0
+    for fmt in fmts:
+        n = struct.calcsize(fmt)
+        values.append(struct.unpack(fmt, data[pos:pos+n])[0])
+        pos += n
+    return values
+
+def best(stmt, repeat, number = 1):
+    return min(timeit.repeat(stmt, repeat = repeat, number = number))
+
+if __name__ == '__main__':
+    opts = parse_args()
+    fname = utils.random_filename(30)
+    mod = make_model(opts.nObjects)
+    ImodWrite(mod, fname)
+    print "Synthetic model: {0} objects, {1:.1f} MB".format(opts.nObjects,
+        os.path.getsize(fname) / 1e6)
+
+    try:
+        # Header block decoding
+        N = 100000
+        obj = mod.Objects[0]
+        view = obj.Views[0]
+        data_objt = pack_fields(OBJECT_HEADER, OBJECT_HEADER_FIELDS, obj)
+        data_view = pack_fields(OBJECT_VIEW, OBJECT_VIEW_FIELDS, view,
+            *(view.clips_normal + view.clips_point))
+        fmts_objt = ['>128s'] + ['>l', '>I'] + ['>l'] * 2 + ['>f'] * 3 + \
+            ['>l'] + ['>B'] * 8 + ['>l'] * 2
+        fmts_view = ['>I'] + ['>f'] * 3 + ['>i'] + ['>B'] * 7 + ['>f'] * 6 + \
+            ['>B'] * 8 + ['>I'] + ['>B'] * 4 + ['>f'] * 30
+        for name, layout, fields, fmts, data in [
+            ('OBJT header', OBJECT_HEADER, OBJECT_HEADER_FIELDS, fmts_objt,
+                data_objt),
+            ('Object VIEW', OBJECT_VIEW, OBJECT_VIEW_FIELDS, fmts_view,
+                data_view)]:
+            t_field = best(lambda: unpack_per_field(fmts, data), opts.repeat,
+                N)
+            t_struct = best(lambda: unpack_fields(layout, fields, data),
+                opts.repeat, N)
+            print "{0}: per-field {1:.2f} us, precompiled {2:.2f} us " \
+                "({3:.1f}x)".format(name, 1e6 * t_field / N,
+                1e6 * t_struct / N, t_field / t_struct)
+
+        # Whole model reading and writing
+        t_read = best(lambda: ImodModel(fname), opts.repeat)
+        print "Read model: {0:.3f} s".format(t_read)
+        t_write = best(lambda: ImodWrite(mod, fname), opts.repeat)
+        print "Write model: {0:.3f} s".format(t_write)
+    finally:
+        os.remove(fname)
+
+    # Point-heavy round trip
+    fname1 = utils.random_filename(30)
+    fname2 = utils.random_filename(30)
+    mod = make_point_model(opts.nPoints)
+    try:
+        t_write = best(lambda: ImodWrite(mod, fname1), opts.repeat)
+        print "Point-heavy model: {0} points, {1:.1f} MB".format(
+            opts.nPoints, os.path.getsize(fname1) / 1e6)
+        print "Write model: {0:.3f} s".format(t_write)
+        for mmap in [False, True]:
+            t_read = best(lambda: ImodModel(fname1, mmap = mmap), opts.repeat)
+            mod2 = ImodModel(fname1, mmap = mmap)
+            t_write = best(lambda: ImodWrite(mod2, fname2), opts.repeat)
+            print "Round trip (mmap = {0}): read {1:.3f} s, write {2:.3f} " \
+                "s, identical: {3}".format(mmap, t_read, t_write,
+                filecmp.cmp(fname1, fname2, shallow = False))
+            del mod2
+    finally:
+        for fname in [fname1, fname2]:
+            if os.path.isfile(fname):
+                os.remove(fname)
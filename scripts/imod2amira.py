@@ -131,7 +131,9 @@ if __name__ == '__main__':
     # Load input model file
     print "imod2amira"
     print "Loading {}...".format(file_in)
-    modin = ImodModel(file_in)
+    # Objects are read lazily, such that only those selected by --objects are
+    # parsed. The chunk index is kept in a sidecar file for subsequent runs.
+    modin = ImodModel(file_in, lazy = True, sidecar = True)
 
     # Get the objects to convert. If a list is entered using the --objects flag,
     # parse this list and check for validity against the object numbers actually
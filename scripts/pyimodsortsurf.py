@@ -18,16 +18,15 @@ from pyimod import *
 
 fname = sys.argv[1]
 
-# Load model
-mod = ImodModel(fname)
+# Load model, without its meshes
+mod = ImodModel(fname, meshes = False)
 
 # Remove empty objects (i.e. objects with zero contours)
 mod.filterByNContours('>', 0)
 
-# Remove meshes, re-mesh with a liberal cross-slice tolerance, and run
-# imodsortsurf to separate objects.
+# Re-mesh with a liberal cross-slice tolerance, and run imodsortsurf to
+# separate objects.
 nObjectsBefore = mod.nObjects
-mod = ImodCmd(mod, 'imodmesh -e')
 mod = ImodCmd(mod, 'imodmesh -CTs -P 10')
 mod, stdout = ImodCmd(mod, 'imodsortsurf -s', return_output = True)
 nObjectsAfter = mod.nObjects
@@ -74,8 +74,9 @@ if __name__ == '__main__':
     if opts.modelOut and not opts.modelIn:
         usage("Must specify an input model with --modelIn")
     
-    # Load the scattered point model.
-    mod = pyimod.ImodModel(file_mod)
+    # Load the scattered point model. Only the first object is needed, so
+    # objects are read lazily.
+    mod = pyimod.ImodModel(file_mod, lazy = True)
 
     # Get listing of z values for realignment
     ncont = mod.Objects[0].nContours
@@ -42,17 +42,16 @@ if __name__ == '__main__':
     strDate = str(datetime.datetime.now())
     date, time = strDate.split()
 
+    # Scan the headers of the IMOD model and extract pertinent data. Point
+    # data is not read.
+    stats = pyimod.scan(fileModel)
+    nObjects = stats['nObjects']
+    nContours = stats['nContours']
+
     # Get filesize in MB
-    fileSize = float(os.path.getsize(fileModel))
+    fileSize = float(stats['fileSize'])
     fileSize = fileSize / (1e6)
 
-    # Load IMOD model into pyimod and extract pertinent data
-    mod = pyimod.ImodModel(fileModel)
-    nObjects = mod.nObjects
-    nContours = 0
-    for N in range(nObjects):
-        nContours = nContours + mod.Objects[N].nContours
-
     # Write basic data on the model file
     fid.write('{0},{1},{2},{3},{4}'.format(date, time, fileSize, nObjects, nContours))
 
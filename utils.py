@@ -29,6 +29,24 @@ def ImodCmd(imodModel, cmdStr, return_output = False):
     else:
         return imodModel
 
+def read_array(fid, fmt, count, mmap = False):
+    """
+    Reads count big-endian values of the single-character struct format fmt
+    (e.g. 'f' or 'l') from fid. If mmap is True, fid must be a memory map of
+    the model file, and a read-only Numpy view into the mapping is returned
+    in place of a tuple, without copying or decoding any values.
+    """
+    import struct
+    if mmap:
+        import numpy as np
+        dtype = np.dtype({'f': '>f4', 'i': '>i4', 'l': '>i4'}[fmt])
+        arr = np.frombuffer(fid, dtype = dtype, count = count,
+            offset = fid.tell())
+        fid.seek(count * dtype.itemsize, 1)
+        return arr
+    return struct.unpack('>{0}{1}'.format(count, fmt),
+        fid.read(struct.calcsize('>' + fmt) * count))
+
 def random_filename(length):
     import random 
     import string